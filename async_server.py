@@ -0,0 +1,307 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from server import CameraServer
+from status import KEEPALIVE_INTERVAL, STATUS_TIMEOUT
+from subscriber import Subscriber
+
+
+class DataProtocol(asyncio.DatagramProtocol):
+    """
+    UDP data port: greetings and control messages of clients, video is sent on the same socket
+    """
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        try:
+            self.server.receive_datagram(data, addr)
+        except (ValueError, IndexError):
+            print(f"Broken greetings from {addr} discarded.")
+        except BlockingIOError:
+            # socket buffer is full, retransmission is skipped
+            pass
+
+    def error_received(self, exc):
+        print(f"Data socket error: {exc}")
+
+
+class AsyncCameraServer(CameraServer):
+    """
+    CameraServer on one asyncio event loop instead of poll-and-sleep threads.
+    status connections are served by a stream server, video goes through a DatagramProtocol on the UDP data port.
+    a client starts streaming as soon as both of its channels are up and leaves as soon as its status
+    connection closes. camera reads and sending run in executors and jpeg encoding in the encoder pool,
+    so the loop never blocks.
+    only the UDP data server is supported.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.server_type != "UDP":
+            raise ValueError("AsyncCameraServer only serves UDP data.")
+        # camera is only touched by one thread
+        self.camera_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Camera")
+        # waits for encoder pool results
+        self.output_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Output")
+        self.send_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="Send")
+        # subscribers with both channels up
+        self.sessions = set()
+        self.stream_task = None
+        # lifecycle events, created on the running loop
+        self.loop = None
+        self.active = None
+        self.frame_captured = None
+
+    def start_subscriber(self, subscriber: Subscriber):
+        # sessions start from connection events, no thread polls the subscriber
+        pass
+
+    def start_status(self, subscriber: Subscriber):
+        # notify_status writes status at once, no sender thread
+        pass
+
+    def subscriber_changed(self, subscriber: Subscriber):
+        if not subscriber.ready or subscriber in self.sessions:
+            return
+        self.sessions.add(subscriber)
+        print(f"{subscriber} joined.")
+        self.refresh()
+        self.active.set()
+        self.start_stream()
+
+    def start_stream(self):
+        if self.stream_task is None or self.stream_task.done():
+            self.stream_task = asyncio.ensure_future(self.run_stream())
+
+    def leave(self, subscriber: Subscriber):
+        self.sessions.discard(subscriber)
+        self.remove_subscriber(subscriber)
+        if not self.sessions:
+            self.active.clear()
+            # wake up dispatcher so that it can stop
+            self.frame_captured.set()
+
+    def receive_datagram(self, message: bytes, address):
+        subscriber = super().receive_datagram(message, address)
+        if subscriber and subscriber.mux and subscriber.closed:
+            # single port session said BYE
+            self.leave(subscriber)
+        elif subscriber:
+            self.subscriber_changed(subscriber)
+        return subscriber
+
+    def notify_status(self, subscriber: Subscriber):
+        # written right away, status_socket is the StreamWriter of the connection
+        if subscriber.status_socket and subscriber.binary_status is not None:
+            data = self.status_messages(subscriber)
+            if data:
+                subscriber.status_socket.write(data)
+
+    def platform_moved(self, angles):
+        # motion planner calls from its own thread, status is written on the loop
+        if self.loop is None:
+            super().platform_moved(angles)
+        else:
+            self.loop.call_soon_threadsafe(super().platform_moved, angles)
+
+    async def serve_status(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        one status connection, alive as long as the client
+        :return: None
+        """
+        addr = writer.get_extra_info("peername")
+        print(f"Status server connected by {addr}")
+        subscriber = self.find_subscriber(addr[0], "status_socket")
+        subscriber.status_socket = writer
+        # angles and role are sent once the first message tells the protocol of client
+        self.assign_controller(subscriber)
+        self.subscriber_changed(subscriber)
+        tail = ""
+        try:
+            while subscriber.status_socket:
+                message = await asyncio.wait_for(reader.read(1024*16), STATUS_TIMEOUT)
+                tail = self.handle_status(subscriber, message, tail)
+        except ConnectionError:
+            print(f"{subscriber}: Client status connection lost")
+        except asyncio.TimeoutError:
+            print(f"{subscriber}: Client status connection timed out")
+        except ValueError:
+            # empty message, connection is closed
+            pass
+        finally:
+            subscriber.drop_status()
+            self.leave(subscriber)
+
+    def streaming(self) -> bool:
+        return bool(self.sessions) or (self.bus is not None and self.bus.active())
+
+    async def capture_frames(self):
+        loop = asyncio.get_running_loop()
+        while self.streaming():
+            if not self.camera:
+                await loop.run_in_executor(self.camera_executor, self.init_camera)
+                continue
+            ret, item = await loop.run_in_executor(self.camera_executor, self.read_frame)
+            if not ret:
+                print("Camera Error! Restarting...")
+                await loop.run_in_executor(self.camera_executor, self.close_camera)
+                await asyncio.sleep(1)
+                continue
+            # oldest frame is discarded if dispatcher falls behind
+            self.buffer.put(item)
+            self.frame_captured.set()
+
+    async def dispatch_frames(self):
+        while self.streaming():
+            await self.frame_captured.wait()
+            self.frame_captured.clear()
+            item = self.buffer.get(timeout=0)
+            if item is None:
+                continue
+            timestamp, frame, stages, changed = item
+            groups = self.group_subscribers(timestamp, changed)
+            if groups:
+                self.encoder.submit((timestamp, frame, stages, groups))
+
+    async def send_frames(self):
+        loop = asyncio.get_running_loop()
+        while self.streaming():
+            result = await loop.run_in_executor(self.output_executor, self.encoder.get, 0.5)
+            if result is None:
+                continue
+            timestamp, encoded = result
+            await asyncio.gather(*(self.send_frame(subscriber, timestamp, jpeg, stages) for jpeg, stages, subscribers in encoded for subscriber in subscribers))
+            self.count += 1
+
+    async def send_frame(self, subscriber: Subscriber, timestamp: float, encoded, stages: dict):
+        if subscriber is self.recorder or subscriber is self.bus:
+            # queued for the writer thread, does not wait
+            subscriber.put(timestamp, encoded, stages)
+            return
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.send_executor, subscriber.send_frame, timestamp, encoded, stages)
+        except BlockingIOError:
+            # socket buffer is full, client repairs or drops the frame
+            pass
+        except OSError as error:
+            print(f"{subscriber}: Client data connection lost ({error})")
+            subscriber.drop_data()
+            # closing status connection ends the session
+            subscriber.close()
+
+    async def run_stream(self):
+        loop = asyncio.get_running_loop()
+        while self.streaming():
+            stages = [asyncio.ensure_future(stage) for stage in (self.capture_frames(), self.dispatch_frames(), self.send_frames())]
+            # stages end together, a client joining just as the last one left may keep one of them running
+            done, pending = await asyncio.wait(stages, return_when=asyncio.FIRST_COMPLETED)
+            for stage in pending:
+                stage.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for stage in done:
+                stage.result()
+            await loop.run_in_executor(self.camera_executor, self.reset, "run_stream")
+            if await self.keep_warm():
+                continue
+            # idle for too long, release camera before a new session can open it
+            await loop.run_in_executor(self.camera_executor, self.stop_camera)
+
+    async def keep_warm(self) -> bool:
+        """
+        last client has left, camera stays open and is read at idle_fps
+        :return: True if a session started within idle_timeout, False if the camera can be closed
+        """
+        loop = asyncio.get_running_loop()
+        idle_since = time.time()
+        if self.camera:
+            print(f"Camera is idle, kept open for {self.idle_timeout} s.")
+        while self.camera and time.time() - idle_since < self.idle_timeout:
+            if self.streaming():
+                print("Camera resumed.")
+                await loop.run_in_executor(self.camera_executor, self.flush_camera)
+                return True
+            await loop.run_in_executor(self.camera_executor, self.idle_read)
+            try:
+                # a joining client sets active
+                await asyncio.wait_for(self.active.wait(), 1 / self.idle_fps)
+            except asyncio.TimeoutError:
+                pass
+        return False
+
+    async def measure(self):
+        while not self.server_should_close:
+            await self.active.wait()
+            subscribers = self.ready_subscribers()
+            start = self.start_measurement(subscribers)
+            await asyncio.sleep(1.0)
+            self.report_network_flux(subscribers, start)
+            await asyncio.sleep(1.0)
+
+    async def watch_sessions(self):
+        # keepalives and idle detection of single port sessions, clients that never open their second link
+        while not self.server_should_close:
+            for subscriber in [subscriber for subscriber in self.sessions if subscriber.mux]:
+                self.check_session(subscriber)
+                if subscriber.closed:
+                    try:
+                        self.leave(subscriber)
+                    except OSError as error:
+                        # one broken session must not end the watch of all others
+                        print(f"{subscriber}: Leaving failed ({error})")
+            for subscriber in self.pending_subscribers():
+                if self.link_expired(subscriber):
+                    # a status connection ends in serve_status, a data link alone is removed here
+                    subscriber.close()
+                    if subscriber.status_socket is None:
+                        self.remove_subscriber(subscriber)
+            with self.subscribers_lock:
+                self.purge_sessions()
+            await asyncio.sleep(KEEPALIVE_INTERVAL)
+
+    def pending_subscribers(self):
+        with self.subscribers_lock:
+            return [subscriber for subscriber in self.subscribers if not subscriber.ready and not subscriber.closed]
+
+    async def watch_bus(self):
+        # local readers of the frame bus start the stream without a client, checked every second
+        while not self.server_should_close:
+            if self.bus.active():
+                self.start_stream()
+            await asyncio.sleep(1.0)
+
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        self.loop = loop
+        self.active = asyncio.Event()
+        self.frame_captured = asyncio.Event()
+        self.data_server.setblocking(False)
+        status_server = await asyncio.start_server(self.serve_status, sock=self.status_server)
+        transport, _ = await loop.create_datagram_endpoint(lambda: DataProtocol(self), sock=self.data_server)
+        measure = asyncio.ensure_future(self.measure())
+        watch_sessions = asyncio.ensure_future(self.watch_sessions())
+        watch_bus = asyncio.ensure_future(self.watch_bus()) if self.bus is not None else None
+        try:
+            async with status_server:
+                await status_server.serve_forever()
+        finally:
+            measure.cancel()
+            watch_sessions.cancel()
+            if watch_bus is not None:
+                watch_bus.cancel()
+            transport.close()
+            self.encoder.close()
+            if self.recorder is not None:
+                self.recorder.close()
+            if self.bus is not None:
+                self.bus.close()
+            for executor in (self.camera_executor, self.output_executor, self.send_executor):
+                executor.shutdown(wait=False)
+
+    def __call__(self, *args, **kwargs):
+        asyncio.run(self.serve())
+
+
+if __name__ == "__main__":
+    camera_server = AsyncCameraServer()
+    camera_server()
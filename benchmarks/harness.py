@@ -0,0 +1,182 @@
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+
+from benchmarks.link import LossyLink
+from benchmarks.sources import make_source
+from client import Client
+
+
+class StubPlatform:
+    """
+    CloudPlatform stand-in, keeps the angles it was given
+    """
+    def __init__(self):
+        self.angles = [0.0, 0.0]
+        self.moves = 0
+
+    def __call__(self, degree):
+        self.angles = list(degree)
+        self.moves += 1
+
+
+class HeadlessClient(Client):
+    """
+    Client without window: frames are decoded and timed but not shown, for duration seconds
+    counted from warmup seconds after the first decoded frame. frames queued in the socket while
+    the client was starting up are not counted.
+    """
+    def __init__(self, *args, duration=10.0, warmup=1.0, layer=None, **kwargs):
+        self.duration = duration
+        self.warmup = warmup
+        super().__init__(*args, **kwargs)
+        if layer:
+            # asked with the first status message
+            self.change_settings(layer=layer)
+        # one latency report for the whole run
+        self.latency.interval = float("inf")
+        self.displayed = 0
+        self.received_bytes = 0
+        self.first_sequence = None
+        self.last_sequence = None
+        self.elapsed = 0.0
+        self.created = time.time()
+
+    def render_stream(self):
+        start = None
+        while start is None or time.time() - start < self.duration:
+            self.buffer_decoded(min(self.playout.next_due(), 0.1))
+            played = self.playout.get()
+            if played is None:
+                if start is None and time.time() - self.created > 30:
+                    print("No frame received in 30 s.")
+                    break
+                continue
+            frame, image, decode_time, waited = played
+            now = time.time()
+            self.decoder.release(image)
+            if start is None:
+                start = now + self.warmup
+            if now < start:
+                continue
+            self.record_latency(frame, decode_time, now, now, waited)
+            self.displayed += 1
+            self.received_bytes += len(frame.data)
+            if frame.sequence is not None:
+                self.first_sequence = frame.sequence if self.first_sequence is None else self.first_sequence
+                self.last_sequence = frame.sequence
+        self.elapsed = time.time() - start if start else 0.0
+        self.stop()
+
+    def stop(self):
+        self.decoder.close()
+        self.disconnect()
+
+    def results(self) -> dict:
+        elapsed = max(self.elapsed, 1e-6)
+        sent = (self.last_sequence - self.first_sequence + 1) & 0xFFFFFFFF if self.first_sequence is not None else None
+        return {
+            "layer": self.layer,
+            "frames": self.displayed,
+            "fps": round(self.displayed / elapsed, 2),
+            "kbps": round(self.received_bytes / elapsed / 1024, 2),
+            # frames shown of frames sent, binary packets only
+            "completion": round(self.displayed / sent, 4) if sent else None,
+            "expired": self.reassembler.expired,
+            "recovered": self.reassembler.recovered,
+            "unchanged": self.reassembler.unchanged,
+            "nacks": self.nack_count,
+            "broken": self.decoder.broken,
+            "playout_ms": round(self.playout.delay * 1000, 1),
+            "late": self.playout.late,
+            "latency": self.latency.report(self.clock),
+        }
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp, socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp:
+        tcp.bind(("127.0.0.1", 0))
+        port = tcp.getsockname()[1]
+        udp.bind(("127.0.0.1", port))
+        return port
+
+
+def run_server(case: dict, data_port: int, status_port: int, ready, verbose=False):
+    # child process
+    if not verbose:
+        sys.stdout = open(os.devnull, "w")
+    if case["core"] == "async":
+        from async_server import AsyncCameraServer as server_class
+    else:
+        from server import CameraServer as server_class
+    server = server_class(
+        fps=case["fps"], width=case["width"], height=case["height"], host="127.0.0.1", data_port=data_port, status_port=status_port,
+        passthrough=case["passthrough"], encode_workers=case["encode_workers"], server_type=case["server_type"],
+        source=make_source(case["source"], case["width"], case["height"], case["fps"]), platform=StubPlatform(),
+    )
+    ready.set()
+    server()
+
+
+def run_link(listen_port: int, data_port: int, case: dict, ready):
+    # child process
+    link = LossyLink(("127.0.0.1", listen_port), ("127.0.0.1", data_port), case["loss"], case["delay"], case["jitter"], seed=0).start()
+    ready.set()
+    while True:
+        time.sleep(10)
+        print(link.stats())
+
+
+def run_case(case: dict, verbose=False) -> dict:
+    """
+    start a server with a synthetic or replayed camera and case["clients"] headless clients on loopback
+    :param case: settings, see benchmarks.suite
+    :param verbose: show server and client output
+    :return: case with per-client results
+    """
+    data_port, status_port = free_port(), free_port()
+    processes = []
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=run_server, args=(case, data_port, status_port, ready, verbose), daemon=True)
+    server.start()
+    processes.append(server)
+    client_port = data_port
+    try:
+        if not ready.wait(30):
+            raise RuntimeError("Server did not start.")
+        if case["server_type"] == "UDP" and (case["loss"] or case["delay"] or case["jitter"]):
+            client_port = free_port()
+            ready = multiprocessing.Event()
+            link = multiprocessing.Process(target=run_link, args=(client_port, data_port, case, ready), daemon=True)
+            link.start()
+            processes.append(link)
+            ready.wait(10)
+        stdout = sys.stdout
+        if not verbose:
+            sys.stdout = open(os.devnull, "w")
+        try:
+            clients = []
+            threads = []
+            for _ in range(case["clients"]):
+                # one after another, server pairs status and data connections of a host in order
+                client = HeadlessClient(
+                    "127.0.0.1", client_port, status_port, codec=case["codec"], packet_format=f"v1:{case['pack_size']}",
+                    fec=case["fec"], nack=case["nack"], server_type=case["server_type"], width=case["width"], height=case["height"],
+                    duration=case["duration"], layer=case.get("layer"), mux=case.get("mux", False),
+                )
+                thread = threading.Thread(target=client)
+                thread.start()
+                clients.append(client)
+                threads.append(thread)
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.stdout = stdout
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+    return dict(case, results=[client.results() for client in clients])
@@ -0,0 +1,106 @@
+import heapq
+import random
+import select
+import socket
+import threading
+import time
+
+
+class LossyLink:
+    """
+    UDP relay between clients and the server data port with packet loss, delay and jitter, like
+    "tc qdisc netem" in user space. clients send to listen address, every client gets its own
+    socket towards the server so the server still sees one address per client.
+    """
+    def __init__(self, listen, server, loss=0.0, delay=0.0, jitter=0.0, seed=None):
+        """
+        :param listen: (host, port) clients send to
+        :param server: (host, port) of server data port
+        :param loss: probability of dropping a datagram, both directions
+        :param delay: one way delay in seconds
+        :param jitter: extra random delay up to jitter seconds, reorders datagrams
+        :param seed: random seed for repeatable runs
+        """
+        self.server = server
+        self.loss = loss
+        self.delay = delay
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self.socket.bind(listen)
+        # client address -> upstream socket, upstream socket -> client address
+        self.upstream = {}
+        self.clients = {}
+        # (due, order, socket, data, address) waiting to be sent
+        self.queue = []
+        self.order = 0
+        self.condition = threading.Condition()
+        self.running = True
+        # counters
+        self.forwarded = 0
+        self.dropped = 0
+
+    def upstream_socket(self, client):
+        sock = self.upstream.get(client)
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+            sock.bind((self.server[0], 0))
+            self.upstream[client] = sock
+            self.clients[sock] = client
+        return sock
+
+    def schedule(self, sock, data, address):
+        if self.random.random() < self.loss:
+            self.dropped += 1
+            return
+        due = time.time() + self.delay + (self.random.random() * self.jitter if self.jitter else 0.0)
+        if not self.delay and not self.jitter:
+            sock.sendto(data, address)
+            self.forwarded += 1
+            return
+        with self.condition:
+            self.order += 1
+            heapq.heappush(self.queue, (due, self.order, sock, data, address))
+            self.condition.notify()
+
+    def relay(self):
+        while self.running:
+            readable, _, _ = select.select([self.socket, *self.clients], [], [], 0.2)
+            for sock in readable:
+                data, address = sock.recvfrom(65536)
+                if sock is self.socket:
+                    self.schedule(self.upstream_socket(address), data, self.server)
+                else:
+                    self.schedule(self.socket, data, self.clients[sock])
+
+    def deliver(self):
+        while self.running:
+            with self.condition:
+                self.condition.wait_for(lambda: self.queue or not self.running, 0.2)
+                now = time.time()
+                due = []
+                while self.queue and self.queue[0][0] <= now:
+                    due.append(heapq.heappop(self.queue))
+                wait = self.queue[0][0] - now if self.queue else None
+            for _, _, sock, data, address in due:
+                sock.sendto(data, address)
+                self.forwarded += 1
+            if wait and not due:
+                time.sleep(min(wait, 0.001))
+
+    def start(self):
+        for target in (self.relay, self.deliver):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def close(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+
+    def stats(self) -> str:
+        return f"LossyLink: loss {self.loss} delay {self.delay} jitter {self.jitter} forwarded {self.forwarded} dropped {self.dropped}"
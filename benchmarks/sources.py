@@ -0,0 +1,136 @@
+import time
+
+import numpy as np
+import cv2
+
+from recorder import PlaybackCamera
+
+
+#  frame sources standing in for cv2.VideoCapture, CameraServer(source=...) opens them instead of camera 0
+
+
+class SyntheticCamera:
+    """
+    moving noise texture with a frame counter, paced at the requested fps.
+    texture gives jpeg sizes close to a real scene, motion keeps every frame different, static shows
+    the same picture every frame.
+    with CAP_PROP_CONVERT_RGB off, frames are delivered as jpeg buffers like an MJPEG camera.
+    """
+    def __init__(self, width=640, height=480, fps=60, quality=80, seed=0, static=False):
+        self.properties = {
+            cv2.CAP_PROP_FRAME_WIDTH: width,
+            cv2.CAP_PROP_FRAME_HEIGHT: height,
+            cv2.CAP_PROP_FPS: fps,
+            cv2.CAP_PROP_CONVERT_RGB: 1,
+        }
+        self.quality = quality
+        self.static = static
+        self.random = np.random.default_rng(seed)
+        self.texture = None
+        # frame number of the last grab
+        self.index = -1
+        self.next_frame = 0.0
+        self.opened = True
+
+    def isOpened(self) -> bool:
+        return self.opened
+
+    def set(self, prop, value) -> bool:
+        if prop not in self.properties:
+            return False
+        self.properties[prop] = value
+        if prop in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT):
+            self.texture = None
+        return True
+
+    def get(self, prop) -> float:
+        return float(self.properties.get(prop, 0))
+
+    def make_texture(self, width: int, height: int):
+        noise = self.random.integers(0, 256, (height // 8 + 1, width // 8 + 1, 3), dtype=np.uint8)
+        # smooth blobs of colour, 2x wide so it can scroll
+        texture = cv2.resize(noise, (width * 2, height), interpolation=cv2.INTER_CUBIC)
+        return cv2.GaussianBlur(texture, (5, 5), 0)
+
+    def pace(self):
+        # wait for the next frame time like a real sensor
+        now = time.time()
+        if self.next_frame > now:
+            time.sleep(self.next_frame - now)
+        self.next_frame = max(now, self.next_frame) + 1 / max(self.properties[cv2.CAP_PROP_FPS], 1)
+
+    def render(self):
+        width, height = int(self.properties[cv2.CAP_PROP_FRAME_WIDTH]), int(self.properties[cv2.CAP_PROP_FRAME_HEIGHT])
+        if self.texture is None:
+            self.texture = self.make_texture(width, height)
+        if self.static:
+            return np.ascontiguousarray(self.texture[:, :width])
+        offset = self.index * 4 % width
+        frame = np.ascontiguousarray(self.texture[:, offset: offset + width])
+        cv2.putText(frame, str(self.index), (10, height // 2), cv2.FONT_HERSHEY_SIMPLEX, height / 240, (255, 255, 255), 2)
+        return frame
+
+    def read(self):
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def grab(self) -> bool:
+        if not self.opened:
+            return False
+        self.pace()
+        self.index += 1
+        return True
+
+    def retrieve(self):
+        # frame of the last grab
+        frame = self.render()
+        if not self.properties[cv2.CAP_PROP_CONVERT_RGB]:
+            # undecoded jpeg buffer, as delivered by V4L2 MJPEG
+            frame = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])[1].reshape(1, -1)
+        return True, frame
+
+    def release(self):
+        self.opened = False
+
+
+class ReplayCamera(SyntheticCamera):
+    """
+    frames of a video file, looped and resized to the requested size, paced at the requested fps
+    """
+    def __init__(self, path: str, width=640, height=480, fps=60, quality=80):
+        super().__init__(width, height, fps, quality)
+        self.path = path
+        self.video = cv2.VideoCapture(path)
+        if not self.video.isOpened():
+            raise ValueError(f"Can not open video {path}.")
+
+    def render(self):
+        ret, frame = self.video.read()
+        if not ret:
+            # end of file, start again
+            self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.video.read()
+            if not ret:
+                raise ValueError(f"No frames in video {self.path}.")
+        width, height = int(self.properties[cv2.CAP_PROP_FRAME_WIDTH]), int(self.properties[cv2.CAP_PROP_FRAME_HEIGHT])
+        if frame.shape[1] != width or frame.shape[0] != height:
+            frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        return frame
+
+    def release(self):
+        super().release()
+        self.video.release()
+
+
+def make_source(spec: str, width: int, height: int, fps: int):
+    """
+    :param spec: "synthetic", "static" (synthetic scene that never changes), "recording:<directory>" of recorder.Recorder or a video file path
+    :return: callable opening the source, for CameraServer(source=...)
+    """
+    if spec in ("synthetic", "static"):
+        return lambda: SyntheticCamera(width, height, fps, static=spec == "static")
+    if spec.startswith("recording:"):
+        # recorded size and frame rate are kept
+        return lambda: PlaybackCamera(spec[len("recording:"):])
+    return lambda: ReplayCamera(spec, width, height, fps)
@@ -0,0 +1,130 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import time
+
+from benchmarks.harness import run_case
+
+
+#  headless benchmark of the whole stream: synthetic or replayed camera, stub platform, headless clients on loopback
+#  run from project root:
+#    python -m benchmarks.suite --resolutions 640x480,1280x720 --codecs raw,adaptive --clients 1,2 --loss 0,0.01
+#    python -m benchmarks.suite --compare benchmarks/results/old.json benchmarks/results/new.json
+#  every case runs in fresh processes, results are saved to benchmarks/results/<time>.json
+
+RESULTS_DIRECTORY = os.path.join(os.path.dirname(__file__), "results")
+# settings identifying a case when runs are compared
+CASE_KEYS = ("core", "server_type", "source", "width", "height", "fps", "pack_size", "codec", "fec", "nack", "clients", "layer", "loss", "delay", "jitter", "mux")
+
+
+def split(text: str, kind=str):
+    return [kind(item) for item in text.split(",") if item]
+
+
+def resolution(text: str):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def cases(args):
+    for (width, height), pack_size, codec, clients, layer, loss in itertools.product(
+            split(args.resolutions, resolution), split(args.pack_sizes, int), split(args.codecs), split(args.clients, int), split(args.layers), split(args.loss, float)):
+        yield {
+            "core": args.core, "server_type": args.server_type, "source": args.source, "width": width, "height": height,
+            "fps": args.fps, "pack_size": pack_size, "codec": codec, "fec": args.fec, "nack": not args.no_nack, "clients": clients, "layer": layer,
+            "loss": loss, "delay": args.delay / 1000, "jitter": args.jitter / 1000, "duration": args.duration,
+            "passthrough": not args.no_passthrough, "encode_workers": args.encode_workers, "mux": args.mux,
+        }
+
+
+def summary(case: dict) -> dict:
+    # mean over clients, worst client for latency percentiles
+    results = case["results"]
+    completions = [result["completion"] for result in results if result["completion"] is not None]
+    totals = [result["latency"]["stages"].get("total", {}) for result in results]
+    return {
+        "fps": round(sum(result["fps"] for result in results) / max(len(results), 1), 2),
+        "kbps": round(sum(result["kbps"] for result in results), 2),
+        "completion": round(sum(completions) / len(completions), 4) if completions else None,
+        "p50": max((total.get("p50", 0.0) for total in totals), default=0.0),
+        "p95": max((total.get("p95", 0.0) for total in totals), default=0.0),
+        "p99": max((total.get("p99", 0.0) for total in totals), default=0.0),
+        "playout_ms": max((result.get("playout_ms", 0.0) for result in results), default=0.0),
+    }
+
+
+def case_name(case: dict) -> str:
+    name = f"{case['core']} {case['server_type']} {case['width']}x{case['height']}@{case['fps']} pack {case['pack_size']} {case['codec']} clients {case['clients']} {case.get('layer', 'full')}"
+    if case.get("mux"):
+        name += " mux"
+    if case["loss"] or case["delay"] or case["jitter"]:
+        name += f" loss {case['loss']} delay {case['delay'] * 1000:g}ms jitter {case['jitter'] * 1000:g}ms"
+    return name
+
+
+def print_summary(case: dict):
+    result = case["summary"]
+    print(f"{case_name(case):<70} {result['fps']:8.2f} fps {result['kbps']:10.1f} kb/s completion {result['completion']} "
+          f"total p50 {result['p50']:.1f} p95 {result['p95']:.1f} p99 {result['p99']:.1f} ms playout {result.get('playout_ms', 0.0):.1f} ms")
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path) as f:
+        old = {tuple(case.get(key) for key in CASE_KEYS): case for case in json.load(f)["cases"]}
+    with open(new_path) as f:
+        new = json.load(f)["cases"]
+    print(f"{'case':<70} {'fps':>17} {'p95 ms':>17} {'completion':>19}")
+    for case in new:
+        before = old.get(tuple(case.get(key) for key in CASE_KEYS))
+        if before is None:
+            print(f"{case_name(case):<70} new case")
+            continue
+        a, b = before["summary"], case["summary"]
+        print(f"{case_name(case):<70} {a['fps']:7.1f} -> {b['fps']:7.1f} {a['p95']:7.1f} -> {b['p95']:7.1f} {a['completion']} -> {b['completion']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="headless stream benchmark")
+    parser.add_argument("--resolutions", default="640x480", help="comma separated WxH")
+    parser.add_argument("--pack-sizes", default="1400", help="comma separated udp packet sizes")
+    parser.add_argument("--codecs", default="raw", help="comma separated codec specs")
+    parser.add_argument("--clients", default="1", help="comma separated client counts")
+    parser.add_argument("--layers", default="full", help="comma separated simulcast layers asked by clients")
+    parser.add_argument("--loss", default="0", help="comma separated loss ratios, emulated by a udp relay")
+    parser.add_argument("--delay", type=float, default=0.0, help="one way delay in ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra delay up to ms")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per case")
+    parser.add_argument("--fec", type=float, default=0.0, help="fec overhead asked by clients")
+    parser.add_argument("--no-nack", action="store_true")
+    parser.add_argument("--no-passthrough", action="store_true", help="camera delivers BGR frames instead of jpeg")
+    parser.add_argument("--encode-workers", type=int, default=3)
+    parser.add_argument("--core", choices=("threaded", "async"), default="threaded")
+    parser.add_argument("--server-type", choices=("UDP", "TCP"), default="UDP")
+    parser.add_argument("--mux", action="store_true", help="clients send status through the udp data port, see mux.py")
+    parser.add_argument("--source", default="synthetic", help="'synthetic', 'static', 'recording:<directory>' or a video file to replay")
+    parser.add_argument("--output", help="result file, benchmarks/results/<time>.json by default")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    parser.add_argument("--verbose", action="store_true", help="show server and client output")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    results = []
+    for case in cases(args):
+        case = run_case(case, args.verbose)
+        case["summary"] = summary(case)
+        print_summary(case)
+        results.append(case)
+    output = args.output or os.path.join(RESULTS_DIRECTORY, f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"time": time.time(), "host": platform.node(), "machine": platform.machine(), "python": platform.python_version(), "cases": results}, f, indent=1)
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import argparse
+import os
+import socket
+import threading
+import time
+
+from packet import DEFAULT_PACK_SIZE, LEGACY_PACK_SIZE, PacketSender, Packetizer
+
+
+#  microbenchmark of udp frame sending paths over loopback
+#  run from project root: python -m benchmarks.udp_send --frame-size 40000 --frames 2000
+
+
+def legacy_slicer():
+    # Subscriber.slice_data_udp needs numpy
+    try:
+        from subscriber import Subscriber
+    except ImportError as error:
+        print(f"legacy path skipped: {error}")
+        return None
+    return Subscriber.slice_data_udp
+
+
+class Drain:
+    # receiving socket emptied by a thread so kernel buffers do not fill up
+    def __init__(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.settimeout(0.2)
+        self.address = self.socket.getsockname()
+        self.packets = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.drain)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def drain(self):
+        buffer = bytearray(65536)
+        while self.running:
+            try:
+                self.socket.recv_into(buffer)
+                self.packets += 1
+            except socket.timeout:
+                pass
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.socket.close()
+
+
+def run(name, send_frame, frames, frame, drain):
+    drain.packets = 0
+    start = time.perf_counter()
+    for _ in range(frames):
+        send_frame(frame)
+    elapsed = time.perf_counter() - start
+    time.sleep(0.3)
+    print(f"{name:<28} {frames / elapsed:10.1f} frames/s {elapsed / frames * 1e6:10.1f} us/frame received packets: {drain.packets}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="compare udp send paths")
+    parser.add_argument("--frame-size", type=int, default=40000, help="encoded frame size in bytes")
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--pack-size", type=int, default=DEFAULT_PACK_SIZE)
+    args = parser.parse_args()
+
+    frame = os.urandom(args.frame_size)
+    drain = Drain()
+    sender_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * 1024 * 1024)
+
+    slice_data_udp = legacy_slicer()
+    if slice_data_udp:
+        def legacy(data):
+            for pack in slice_data_udp(data, LEGACY_PACK_SIZE):
+                sender_socket.sendto(pack, drain.address)
+        run(f"legacy ascii {LEGACY_PACK_SIZE}", legacy, args.frames, frame, drain)
+
+    packetizer = Packetizer(args.pack_size)
+
+    def concatenated(data):
+        for pack in packetizer.packetize(data):
+            sender_socket.sendto(pack, drain.address)
+    run(f"concat + sendto {args.pack_size}", concatenated, args.frames, frame, drain)
+
+    sendmsg = PacketSender(sender_socket, args.pack_size, gso=False)
+    run(f"sendmsg {args.pack_size}", lambda data: sendmsg.send(data, drain.address), args.frames, frame, drain)
+
+    gso = PacketSender(sender_socket, args.pack_size, gso=True)
+    run(f"sendmsg + gso {args.pack_size}", lambda data: gso.send(data, drain.address), args.frames, frame, drain)
+    if gso.gso:
+        print(f"gso: {gso.packets / max(gso.syscalls, 1):.1f} packets per syscall")
+
+    drain.close()
+    sender_socket.close()
+
+
+if __name__ == "__main__":
+    main()
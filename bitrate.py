@@ -0,0 +1,117 @@
+import time
+
+
+class BitrateController:
+    """
+    closed-loop stream settings driven by client reports.
+    on congestion (packet loss, reassembly timeouts) jpeg quality is cut first, then resolution, then frame rate.
+    when the client decodes slower than the frame interval, resolution is cut first.
+    after enough good reports settings are raised again in reverse order, while the measured send rate
+    stays under the rate where congestion was last seen.
+    """
+    def __init__(self, max_fps=60, max_quality=90, min_quality=30, scales=(1.0, 0.75, 0.5, 0.25),
+                 min_fps=10, loss_threshold=0.02, good_reports=3):
+        self.max_fps = max_fps
+        self.min_fps = min_fps
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        # camera frame rate and full jpeg quality, client limits stay below them
+        self.fps_limit = max_fps
+        self.quality_limit = max_quality
+        self.scales = scales
+        self.loss_threshold = loss_threshold
+        # consecutive good reports before stepping up
+        self.good_reports = good_reports
+        self.reset()
+
+    def reset(self):
+        self.quality = self.max_quality
+        self.scale_index = 0
+        self.fps = self.max_fps
+        # send rate (bytes/s) where congestion was last seen
+        self.ceiling = None
+        self.good = 0
+        self.last_sent = 0.0
+
+    @property
+    def scale(self) -> float:
+        return self.scales[self.scale_index]
+
+    @property
+    def full(self) -> bool:
+        # client can take the camera stream as it is
+        return self.scale_index == 0 and self.fps >= self.fps_limit and self.quality >= self.quality_limit
+
+    def settings(self) -> str:
+        return f"quality {self.quality} scale {self.scale} fps {self.fps}"
+
+    def should_send(self, now=None) -> bool:
+        """
+        frame rate limit, frames arriving faster than the target fps are skipped
+        :param now: capture time of frame
+        :return: bool
+        """
+        now = time.time() if now is None else now
+        if self.fps >= self.fps_limit or now - self.last_sent >= 0.95 / self.fps:
+            self.last_sent = now
+            return True
+        return False
+
+    def limit(self, max_fps=None, max_quality=None):
+        """
+        stream limits asked by client, settings start again from them
+        :param max_fps: frame rate, up to camera frame rate
+        :param max_quality: jpeg quality, up to full quality
+        :return: None
+        """
+        if max_fps is not None:
+            self.max_fps = min(max(int(max_fps), self.min_fps), self.fps_limit)
+        if max_quality is not None:
+            self.max_quality = min(max(int(max_quality), self.min_quality), self.quality_limit)
+        self.reset()
+
+    def update(self, report: dict, send_rate: float) -> bool:
+        """
+        adjust settings with one client report
+        :param report: {"loss": ratio of frames lost, "timeouts": reassembly timeouts, "decode_ms": average decode time}
+        :param send_rate: bytes/s measured by server
+        :return: True if settings changed
+        """
+        before = (self.quality, self.scale_index, self.fps)
+        congested = report.get("loss", 0.0) > self.loss_threshold or report.get("timeouts", 0) > 0
+        slow_decode = report.get("decode_ms", 0.0) > 1000 / self.fps
+        if congested:
+            self.good = 0
+            self.ceiling = send_rate * 0.9 if send_rate else self.ceiling
+            self.step_down()
+        elif slow_decode:
+            self.good = 0
+            self.step_down(resolution_first=True)
+        else:
+            self.good += 1
+            if self.ceiling and send_rate > self.ceiling * 0.9:
+                # close to the rate that congested the link, probe slowly
+                self.ceiling *= 1.05
+            elif self.good >= self.good_reports:
+                self.good = 0
+                self.step_up()
+        return before != (self.quality, self.scale_index, self.fps)
+
+    def step_down(self, resolution_first=False):
+        if resolution_first and self.scale_index < len(self.scales) - 1:
+            self.scale_index += 1
+        elif self.quality > self.min_quality:
+            self.quality = max(self.min_quality, int(self.quality * 0.8))
+        elif self.scale_index < len(self.scales) - 1:
+            self.scale_index += 1
+            self.quality = self.max_quality
+        elif self.fps > self.min_fps:
+            self.fps = max(self.min_fps, self.fps // 2)
+
+    def step_up(self):
+        if self.fps < self.max_fps:
+            self.fps = min(self.max_fps, self.fps * 2)
+        elif self.quality < self.max_quality:
+            self.quality = min(self.max_quality, self.quality + 5)
+        elif self.scale_index > 0:
+            self.scale_index -= 1
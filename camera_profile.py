@@ -0,0 +1,239 @@
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+import numpy as np
+import cv2
+
+
+#  camera capability profile
+#
+#  "python camera_profile.py" opens camera 0, tries every format / size / frame rate combination and saves
+#  what the device really delivers to camera_profiles/<device name>.json. CameraServer loads the profile of
+#  its camera and sets the best mode for the asked size at once, without probing sets and warm-up sleeps.
+#  per mode: fourcc, width, height, fps as read back after setting them, accepted (every set succeeded),
+#  measured_fps, first_frame_ms (from setting the mode to the first frame), read_ms (mean read call),
+#  latency_ms (age of a frame when read, from the V4L2 buffer timestamp, None where the backend has none)
+#  and jpeg (frames can be read undecoded for MJPEG passthrough).
+
+PROFILE_DIRECTORY = "camera_profiles"
+FOURCCS = ("MJPG", "YUYV")
+SIZES = ((320, 240), (640, 480), (800, 600), (1280, 720), (1920, 1080))
+FRAME_RATES = (15, 30, 60)
+
+
+def open_device(index=0):
+    if sys.platform == 'linux':
+        return cv2.VideoCapture(index, cv2.CAP_V4L2)
+    return cv2.VideoCapture(index, cv2.CAP_DSHOW)  # direct show
+
+
+def device_name(index=0) -> str:
+    """
+    :param index: camera index
+    :return: name of the device, file name safe, "camera<index>" if it is not known
+    """
+    try:
+        with open(f"/sys/class/video4linux/video{index}/name") as f:
+            name = re.sub(r"[^A-Za-z0-9]+", "_", f.read()).strip("_")
+    except OSError:
+        name = ""
+    return name or f"camera{index}"
+
+
+def fourcc_name(code) -> str:
+    code = int(code)
+    return "".join(chr(code >> 8 * i & 0xFF) for i in range(4)).strip("\x00 ")
+
+
+def is_jpeg(frame) -> bool:
+    """
+    check if a captured frame is an undecoded jpeg buffer (1-row uint8 array starting with SOI marker)
+    :param frame: frame returned by camera.read()
+    :return: bool
+    """
+    if frame is None or frame.dtype != np.uint8 or frame.size < 4:
+        return False
+    if frame.ndim > 2 or (frame.ndim == 2 and 1 not in frame.shape):
+        return False
+    data = frame.reshape(-1)
+    return data[0] == 0xFF and data[1] == 0xD8
+
+
+def set_mode(camera, fourcc: str, width: int, height: int, fps: float) -> bool:
+    """
+    :param camera: opened cv2.VideoCapture
+    :param fourcc: "MJPG", "YUYV", ... , "" keeps the format
+    :return: True if every property was accepted
+    """
+    accepted = True
+    if fourcc:
+        accepted &= camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter.fourcc(*fourcc))
+    accepted &= camera.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    accepted &= camera.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    accepted &= camera.set(cv2.CAP_PROP_FPS, fps)
+    return bool(accepted)
+
+
+def frame_age(camera):
+    # seconds since the driver filled the buffer just read, None if the backend gives no monotonic timestamp
+    age = time.monotonic() - camera.get(cv2.CAP_PROP_POS_MSEC) / 1000
+    return age if 0 <= age < 5 else None
+
+
+def probe_mode(camera, fourcc: str, width: int, height: int, fps: float, frames=30):
+    """
+    set a mode and measure it
+    :param camera: opened cv2.VideoCapture
+    :param frames: frames read for the measurement
+    :return: mode dict, see top of file, None if no frame can be read
+    """
+    start = time.time()
+    accepted = set_mode(camera, fourcc, width, height, fps)
+    # undecoded frames if the device sends jpeg, that is how the server reads them
+    camera.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+    ret, frame = camera.read()
+    if not ret:
+        camera.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+        return None
+    first_frame = time.time() - start
+    jpeg = bool(is_jpeg(frame))
+    if not jpeg:
+        camera.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+    reads = []
+    ages = []
+    measure_start = time.time()
+    for _ in range(frames):
+        read_start = time.time()
+        ret, frame = camera.read()
+        if not ret:
+            break
+        reads.append(time.time() - read_start)
+        age = frame_age(camera)
+        if age is not None:
+            ages.append(age)
+    elapsed = time.time() - measure_start
+    camera.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+    return {
+        "fourcc": fourcc_name(camera.get(cv2.CAP_PROP_FOURCC)) if fourcc else "",
+        "width": int(camera.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(camera.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        "fps": camera.get(cv2.CAP_PROP_FPS),
+        "asked": [fourcc, width, height, fps],
+        "accepted": accepted,
+        "measured_fps": round(len(reads) / elapsed, 2) if reads else 0.0,
+        "first_frame_ms": round(first_frame * 1000, 2),
+        "read_ms": round(sum(reads) / len(reads) * 1000, 2) if reads else None,
+        "latency_ms": round(float(np.median(ages)) * 1000, 2) if ages else None,
+        "jpeg": jpeg,
+    }
+
+
+class CameraProfile:
+    """
+    modes measured by probe, saved per device
+    """
+    def __init__(self, device: str, modes, path=None):
+        self.device = device
+        self.modes = modes
+        self.path = path
+
+    def __repr__(self):
+        return f"<CameraProfile {self.device} modes {len(self.modes)}>"
+
+    @classmethod
+    def probe(cls, camera, device: str, fourccs=FOURCCS, sizes=SIZES, frame_rates=FRAME_RATES, frames=30):
+        """
+        :param camera: opened cv2.VideoCapture
+        :param device: name of the device
+        :return: CameraProfile of every mode that delivers frames
+        """
+        modes = []
+        for fourcc in fourccs:
+            for width, height in sizes:
+                for fps in frame_rates:
+                    mode = probe_mode(camera, fourcc, width, height, fps, frames)
+                    if mode is None:
+                        print(f"{fourcc or '-'} {width}x{height}@{fps}: no frames")
+                        continue
+                    print(f"{fourcc or '-'} {width}x{height}@{fps}: {mode['fourcc'] or '-'} {mode['width']}x{mode['height']}@{mode['fps']:g} "
+                          f"measured {mode['measured_fps']} fps first frame {mode['first_frame_ms']} ms read {mode['read_ms']} ms "
+                          f"latency {mode['latency_ms']} ms jpeg {mode['jpeg']} accepted {mode['accepted']}")
+                    modes.append(mode)
+        return cls(device, modes)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path) as f:
+            content = json.load(f)
+        return cls(content["device"], content["modes"], path)
+
+    @classmethod
+    def find(cls, index=0, directory=PROFILE_DIRECTORY):
+        """
+        :return: saved profile of camera index, None if it has not been probed
+        """
+        path = os.path.join(directory, device_name(index) + ".json")
+        return cls.load(path) if os.path.exists(path) else None
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"device": self.device, "time": time.time(), "modes": self.modes}, f, indent=1)
+        self.path = path
+
+    def choose(self, width: int, height: int, fps: float, passthrough=True):
+        """
+        best mode for a size: the asked size, else the smallest larger one, else the largest. among those,
+        the mode reaching fps (95 percent counts), then one with jpeg frames if passthrough, then the frame
+        rate closest to fps (a faster mode costs cpu for frames that are not sent), then the lowest latency
+        :return: mode dict, None if the profile has no usable mode
+        """
+        modes = [mode for mode in self.modes if mode["accepted"] and mode["measured_fps"] > 0]
+        if not modes:
+            return None
+        exact = [mode for mode in modes if (mode["width"], mode["height"]) == (width, height)]
+        larger = [mode for mode in modes if mode["width"] >= width and mode["height"] >= height]
+        if exact:
+            modes = exact
+        elif larger:
+            area = min(mode["width"] * mode["height"] for mode in larger)
+            modes = [mode for mode in larger if mode["width"] * mode["height"] == area]
+        else:
+            area = max(mode["width"] * mode["height"] for mode in modes)
+            modes = [mode for mode in modes if mode["width"] * mode["height"] == area]
+        return min(modes, key=lambda mode: (
+            -min(mode["measured_fps"], fps * 0.95),
+            not (passthrough and mode["jpeg"]),
+            abs(mode["fps"] - fps),
+            mode["latency_ms"] if mode["latency_ms"] is not None else mode["read_ms"],
+        ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="measure the modes of a camera and save its profile")
+    parser.add_argument("--device", type=int, default=0, help="camera index")
+    parser.add_argument("--formats", default=",".join(FOURCCS), help="comma separated fourcc")
+    parser.add_argument("--sizes", default=",".join(f"{width}x{height}" for width, height in SIZES), help="comma separated WxH")
+    parser.add_argument("--fps", default=",".join(str(fps) for fps in FRAME_RATES), help="comma separated frame rates")
+    parser.add_argument("--frames", type=int, default=30, help="frames measured per mode")
+    parser.add_argument("--output", help=f"profile file, {PROFILE_DIRECTORY}/<device name>.json by default")
+    args = parser.parse_args()
+
+    name = device_name(args.device)
+    camera = open_device(args.device)
+    if not camera.isOpened():
+        raise SystemExit(f"Can not open camera {args.device}.")
+    try:
+        profile = CameraProfile.probe(
+            camera, name, fourccs=args.formats.split(","), frames=args.frames,
+            sizes=[tuple(int(value) for value in size.split("x")) for size in args.sizes.split(",")],
+            frame_rates=[float(fps) for fps in args.fps.split(",")],
+        )
+    finally:
+        camera.release()
+    profile.save(args.output or os.path.join(PROFILE_DIRECTORY, name + ".json"))
+    print(f"Profile of {name} saved to {profile.path}.")
@@ -0,0 +1,73 @@
+import numpy as np
+import cv2
+
+
+class ChangeDetector:
+    """
+    tells if a captured frame shows something new since the last frame that was sent.
+    frames are compared on a small luma plane: jpeg buffers are decoded at 1/8 scale straight to grayscale
+    (DCT scaling, no full decode), BGR frames are area-resized and weighted to luma. a frame has changed when
+    more than min_area of the cells differ by more than threshold levels from the reference, the plane of the
+    last changed frame, so slow drift adds up until it is sent and sensor noise is averaged away.
+    a frame is passed anyway every refresh_interval seconds, and after force().
+    """
+    def __init__(self, threshold=10, min_area=0.0005, size=(64, 48), refresh_interval=2.0):
+        """
+        :param threshold: luma difference (0 - 255) of a changed cell
+        :param min_area: ratio of changed cells of a changed frame
+        :param size: width, height of the compared plane
+        :param refresh_interval: seconds between frames sent while nothing changes
+        """
+        self.threshold = threshold
+        self.min_area = min_area
+        self.size = size
+        self.refresh_interval = refresh_interval
+        self.reference = None
+        self.last_sent = 0.0
+        # counters
+        self.changed_count = 0
+        self.unchanged_count = 0
+        self.refreshed = 0
+
+    def luma(self, frame):
+        """
+        :param frame: BGR image or raw jpeg buffer
+        :return: int16 luma plane of size, None if frame can not be decoded
+        """
+        if frame.ndim != 3:
+            frame = cv2.imdecode(frame.reshape(-1), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+            if frame is None:
+                return None
+            return cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA).astype(np.int16)
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        return (small @ np.array([0.114, 0.587, 0.299], dtype=np.float32)).astype(np.int16)
+
+    def changed(self, frame, timestamp: float) -> bool:
+        """
+        :param frame: captured frame
+        :param timestamp: capture time
+        :return: True if frame has to be sent
+        """
+        plane = self.luma(frame)
+        if plane is None or self.reference is None or self.reference.shape != plane.shape:
+            changed = True
+        else:
+            changed = np.count_nonzero(np.abs(plane - self.reference) > self.threshold) > self.min_area * plane.size
+        if not changed and timestamp - self.last_sent >= self.refresh_interval:
+            # late joiners and lossy links get a full frame now and then
+            self.refreshed += 1
+            changed = True
+        if not changed:
+            self.unchanged_count += 1
+            return False
+        self.reference = plane
+        self.last_sent = timestamp
+        self.changed_count += 1
+        return True
+
+    def force(self):
+        # next frame is sent
+        self.reference = None
+
+    def stats(self) -> str:
+        return f"ChangeDetector: changed {self.changed_count} unchanged {self.unchanged_count} refreshed {self.refreshed}"
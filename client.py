@@ -1,80 +1,396 @@
+import json
 import socket
+import struct
 import threading
 import time
 import traceback
 
-import numpy as np
 import cv2
 from zlib import compress, decompress
 
+from codec import LEGACY_CODEC, get_codec
+from decoder import FrameDecoder
+from fec import NO_FEC, fec_spec, group_size, parse_fec
+from frame_queue import FrameQueue
+from latency import TIMING_OFF, ClockSync, LatencyStats, parse_timing, timing_spec, unpack_stages
+from mux import MUX, MuxLink, is_status, unpack_status
+from nack import pack_nack
+from packet import LEGACY_FORMAT, VERSION, format_spec, parse_format
+from playout import PlayoutBuffer
+from reassembly import Frame, FrameReassembler
+from status import ANGLES, BYE, KEEPALIVE, KEEPALIVE_INTERVAL, LINK, NAMES, SETTINGS, STATS, STATUS_TIMEOUT, SYNC, SYNC_REPLY_STRUCT, MessageReader, pack_angles, pack_json, pack_message, unpack_angles, unpack_json
+
 
 class Client:
-    def __init__(self, host="172.25.25.30", data_port=8004, status_port=8005):
-        self.server_type = "UDP"
-        self.width = 800
-        self.height = 600
+    def __init__(self, host="172.25.25.30", data_port=8004, status_port=8005, codec="adaptive", packet_format="v1:1400", fec=0.0, nack=True, decode_workers=2, timing=True, latency_report=None, max_playout_delay=0.25, server_type="UDP",
+                 width=800, height=600, reconnect_timeout=10.0, mux=False):
+        self.server_type = server_type
+        # status goes with video through the UDP data port, no TCP status connection (see mux.py).
+        # falls back to a status connection if server does not offer it
+        self.mux = mux and server_type == "UDP"
+        # last datagram of server, a single port session is lost when server is silent for STATUS_TIMEOUT
+        self.last_received = 0.0
+        self.width = width
+        self.height = height
+        # payload codec asked in data handshake, server may answer with another one
+        self.codec = get_codec(codec)
+        # udp packet format asked in data handshake
+        self.packet_version, self.pack_size = parse_format(packet_format)
+        # fec overhead asked in data handshake, e.g. 0.25 is one parity packet per 4 data packets
+        self.fec_group = group_size(fec)
+        # ask server to resend lost chunks (binary packets only)
+        self.nack = nack
+        self.nack_count = 0
+        self.last_nack_check = 0.0
+        # stats reported to server every second for its bitrate controller
+        self.report_interval = 1.0
+        self.reported = (0, 0)
+        # ask server for stage durations of every frame, latency histograms are reported every 10 s
+        # as json (printed, and appended to latency_report file if given)
+        self.timing = timing
+        self.clock = ClockSync()
+        self.latency = LatencyStats(interval=10.0)
+        self.latency_report = latency_report
         # host and port config
         self.host = host
         self.data_port = data_port
         self.status_port = status_port
+        # session token given by server, sent again on reconnect to continue the stream where it stopped
+        self.session = None
+        self.resumed = False
+        # token given on the status link, the data greeting carries it so that server pairs the two links
+        self.link = None
+        # messages of the status link, its first ones are read while waiting for the link token and kept for
+        # receive_status in early_status
+        self.status_reader = MessageReader()
+        self.early_status = []
+        # a lost status connection is connected again for up to reconnect_timeout seconds
+        self.reconnect_timeout = reconnect_timeout
+        self.reconnect_lock = threading.Lock()
+        self.connected = threading.Event()
+        self.running = True
+        self.status_socket = None
+        self.data_socket = None
+        self.connect(pause=1.0)
+        self.platform_degrees = [0.0, 0.0]
+        self.platform_degrees_delta = [0.0, 0.0]
+        # status is sent when angles or settings change, a drag sends the latest angles at most every
+        # status_interval seconds, a keepalive goes out when nothing was sent for KEEPALIVE_INTERVAL
+        self.status_interval = 0.02
+        self.status_event = threading.Event()
+        self.settings_changes = {}
+        # told by server, only the controller moves the platform
+        self.controller = False
+        # simulcast layer received and layers offered {name: [width, height]}, told by server.
+        # keys 1 - 9 of the window switch to the n-th layer
+        self.layer = None
+        self.layers = {}
+        # data received and cache, renderer keeps up to 60 frames behind
+        self.buffer = FrameQueue(maxsize=60, policy="drop_oldest", name="ReceiveQueue")
+        self.cache = b""
+        self.tmp = []
+        # binary packets are rebuilt to frames by reassembler, with nack a frame may wait 50 ms for repair
+        self.reassembler = FrameReassembler(self.pack_size, fec_group=self.fec_group, hold=0.05 if self.nack else 0.0)
+        # frames are decoded off the render thread
+        self.decoder = FrameDecoder(self.codec, self.width, self.height, workers=decode_workers)
+        # decoded frames wait in jitter buffer until their capture time plus a delay adapted to arrival jitter
+        # (max_playout_delay seconds at most), frames that are late for it are dropped
+        self.playout = PlayoutBuffer(release=self.decoder.release, max_delay=max_playout_delay)
+        self.reported_late = 0
+        # console message
+        print("Initialized.")
+
+    def connect(self, pause=0.0):
+        """
+        open status and data links and greet server
+        :param pause: seconds waited after each link is up, single port sessions do not wait
+        :return: None
+        """
+        if self.mux:
+            self.connect_data()
+            if self.mux:
+                # one round trip, server knows the session from its token
+                self.status_socket = MuxLink(self.data_socket, (self.host, self.data_port), self.session)
+                self.connected.set()
+                return
+            print("Server offers no single port session, opening status connection.")
+            self.connect_status()
+        else:
+            self.connect_status()
+            time.sleep(pause)
+            self.connect_data()
+        self.connected.set()
+        time.sleep(pause)
+
+    def connect_status(self):
         # status pipe line
         self.status_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.status_socket.connect((self.host, self.status_port))
         print("Status connection established!")
+        self.link = self.request_link()
 
-        time.sleep(1)
+    def request_link(self):
+        """
+        ask server for the token pairing the data link with the status link, status arriving meanwhile is kept
+        :return: token, None if server pairs links by address
+        """
+        self.status_reader = MessageReader()
+        self.early_status = []
+        self.status_socket.sendall(pack_message(LINK))
+        self.status_socket.settimeout(1.0)
+        try:
+            while True:
+                message = self.status_socket.recv(1024)
+                if not message:
+                    # receive_status finds the link closed
+                    return None
+                received = time.time()
+                link = None
+                for kind, payload in self.status_reader.feed(message):
+                    if kind == LINK and len(payload) == 8:
+                        link = payload.hex()
+                    else:
+                        self.early_status.append((kind, payload, received))
+                if link is not None:
+                    return link
+        except socket.timeout:
+            print("Server pairs links by address.")
+            return None
+        finally:
+            self.status_socket.settimeout(None)
+
+    def connect_data(self):
         # data pipe line
         if self.server_type == "TCP":
-            self.data_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.data_socket.connect((self.host, self.data_port))
-            self.data_socket.sendall(bytes(f'Hello Server {str(self.width).zfill(4)} {str(self.height).zfill(4)}', encoding='utf-8'))
+            data_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            data_socket.connect((self.host, self.data_port))
+            data_socket.sendall(self.hello())
+            self.accept_hello(data_socket.recv(1024))
         elif self.server_type == "UDP":
-            self.data_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            self.data_socket.sendto(bytes(f'Hello Server {str(self.width).zfill(4)} {str(self.height).zfill(4)}', encoding='utf-8'), (host, data_port))
-            message, server = self.data_socket.recvfrom(1024)
+            data_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            # room for a few frames in kernel while receiver is busy
+            data_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+            # greetings are sent again every second, a lost one must not hang a reconnect
+            data_socket.settimeout(1.0)
+            deadline = time.time() + max(self.reconnect_timeout, 1.0)
+            while True:
+                data_socket.sendto(self.hello(), (self.host, self.data_port))
+                try:
+                    message, server = data_socket.recvfrom(1024)
+                    break
+                except socket.timeout:
+                    if time.time() >= deadline:
+                        raise
+            data_socket.settimeout(None)
             print(message, server)
-            if message == b"Hello Client":
-                print("Data connection established! ")
-        time.sleep(1)
-        self.platform_degrees = [0.0, 0.0]
-        self.platform_degrees_delta = [0.0, 0.0]
-        # data received and cache
-        self.buffer = []
-        self.cache = b""
-        self.tmp = []
-        # console message
-        print("Initialized.")
+            self.accept_hello(message)
+        self.last_received = time.time()
+        self.data_socket = data_socket
+
+    def close_links(self):
+        # shutdown wakes up receivers blocked on the sockets
+        for link in (self.status_socket, self.data_socket):
+            if link is None:
+                continue
+            try:
+                link.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            link.close()
+
+    def reconnect(self, lost) -> bool:
+        """
+        connect again after the status link was lost. server continues the session of the token within
+        its resume timeout (same layer and bitrate, frame sequence goes on), otherwise a new one starts
+        :param lost: status socket that failed, links replaced meanwhile by another thread are kept
+        :return: True if connected, False if client stops or server did not answer within reconnect_timeout
+        """
+        with self.reconnect_lock:
+            if not self.running:
+                return False
+            if self.status_socket is not lost:
+                return True
+            self.connected.clear()
+            self.close_links()
+            deadline = time.time() + self.reconnect_timeout
+            while self.running and time.time() < deadline:
+                try:
+                    self.connect()
+                except OSError as error:
+                    print(f"Reconnect failed: {error}")
+                    time.sleep(0.5)
+                    continue
+                if not self.resumed:
+                    # new session, frame sequence of server starts again
+                    self.reassembler = FrameReassembler(self.pack_size, fec_group=self.fec_group, hold=0.05 if self.nack else 0.0)
+                    self.playout.clear()
+                    # counters of the new reassembler start at zero, the next report must not go negative
+                    self.reported = (0, 0)
+                    self.reported_late = self.playout.late
+                print(f"Reconnected, session {'resumed' if self.resumed else 'started'}.")
+                self.status_event.set()
+                return True
+            print("Reconnect timed out.")
+            return False
+
+    def hello(self) -> bytes:
+        return bytes(f'Hello Server {str(self.width).zfill(4)} {str(self.height).zfill(4)} {self.codec.spec} {format_spec(self.packet_version, self.pack_size)} {fec_spec(self.fec_group)} {timing_spec(self.timing)} session:{self.session or "-"}{" " + MUX if self.mux else ""}{" link:" + self.link if self.link and not self.mux else ""}', encoding='utf-8')
+
+    def accept_hello(self, message: bytes):
+        """
+        read server greetings "Hello Client [codec] [packet format] [fec] [timing] [session] [mux]" and switch to the settings chosen by server
+        :param message: greetings received on data socket
+        :return: None
+        """
+        items = str(message, encoding="utf-8").split(" ")
+        if items[:2] == ["Hello", "Client"]:
+            self.codec = get_codec(items[2] if len(items) > 2 else LEGACY_CODEC)
+            self.packet_version, self.pack_size = parse_format(items[3] if len(items) > 3 else LEGACY_FORMAT)
+            self.fec_group = parse_fec(items[4] if len(items) > 4 else NO_FEC)
+            self.timing = parse_timing(items[5] if len(items) > 5 else TIMING_OFF)
+            session = items[6][len("session:"):] if len(items) > 6 and items[6].startswith("session:") else None
+            # server gives the same token back when it continues the session
+            self.resumed = session is not None and session == self.session
+            self.session = session
+            self.mux = self.mux and items[7:8] == [MUX]
+            print(f"Data connection established! Codec: {self.codec.spec} Packet: {format_spec(self.packet_version, self.pack_size)} FEC: {fec_spec(self.fec_group)} Timing: {timing_spec(self.timing)} Session: {self.session}")
+
+    def stats_report(self) -> bytes:
+        """
+        frame loss, reassembly timeouts and decode time since last report
+        :return: STATS message
+        """
+        completed = self.reassembler.completed - self.reported[0]
+        expired = self.reassembler.expired - self.reported[1]
+        self.reported = (self.reassembler.completed, self.reassembler.expired)
+        late = self.playout.late - self.reported_late
+        self.reported_late = self.playout.late
+        report = {
+            "loss": round(expired / max(completed + expired, 1), 4),
+            "timeouts": expired,
+            "decode_ms": round(self.decoder.decode_time / max(self.decoder.decode_count, 1) * 1000, 2),
+            "playout_ms": round(self.playout.delay * 1000, 1),
+            "late": late,
+        }
+        self.decoder.decode_time = 0.0
+        self.decoder.decode_count = 0
+        return pack_json(STATS, report)
+
+    def change_settings(self, **settings):
+        """
+        ask server for other stream limits or another layer
+        :param settings: max_fps, max_quality, layer
+        :return: None
+        """
+        self.settings_changes.update(settings)
+        self.status_event.set()
 
     def send_status(self):
-        while self.status_socket:
+        # sleeps until angles change or a report or keepalive is due
+        sent_degrees = None
+        last_angles = last_sent = 0.0
+        last_report = time.time()
+        while self.running:
+            self.status_event.clear()
+            now = time.time()
+            messages = []
+            degrees = [round(degree, 2) for degree in self.platform_degrees]
+            pending = degrees != sent_degrees
+            if pending and now - last_angles >= self.status_interval:
+                messages.append(pack_angles(degrees))
+                sent_degrees, last_angles, pending = degrees, now, False
+            if self.settings_changes:
+                settings, self.settings_changes = self.settings_changes, {}
+                messages.append(pack_json(SETTINGS, settings))
+            if now - last_report >= self.report_interval:
+                last_report = now
+                messages.append(self.stats_report())
+                messages.append(self.clock.request(now))
+            if not messages and now - last_sent >= KEEPALIVE_INTERVAL:
+                messages.append(pack_message(KEEPALIVE))
+            status_socket = self.status_socket
             try:
-                self.status_socket.sendall(bytes(f'{str(round(self.platform_degrees[0], 2)).zfill(6)} {str(round(self.platform_degrees[1], 2)).zfill(6)}', encoding='utf-8'))
-            except ConnectionAbortedError:
-                print("Status-sender offline: Server connection lost")
-                break
-            except ConnectionResetError:
-                print("Status-sender offline: Server connection reset")
-                break
-            time.sleep(0.01)
+                if messages:
+                    status_socket.sendall(b"".join(messages))
+                    last_sent = now
+            except (AttributeError, OSError):
+                # receiver reconnects, angles and settings are sent again on the new link
+                if not self.running or not self.reconnect(status_socket):
+                    print("Status-sender offline: Status socket closed")
+                    break
+                sent_degrees = None
+                continue
+            due = min(last_report + self.report_interval, last_sent + KEEPALIVE_INTERVAL)
+            if pending:
+                # rest of a drag goes out once the interval has passed
+                due = min(due, last_angles + self.status_interval)
+            self.status_event.wait(max(due - time.time(), 0.0))
+
+    def handle_status(self, kind: int, payload: bytes, received: float):
+        """
+        apply one status message of server
+        :param kind: message type, see status.py
+        :param payload: message payload
+        :param received: receive time
+        :return: None
+        """
+        try:
+            if kind == ANGLES:
+                print(f"Server camera-angles {unpack_angles(payload)}.")
+            elif kind == SYNC:
+                self.clock.add(*SYNC_REPLY_STRUCT.unpack(payload), received)
+            elif kind == SETTINGS:
+                settings = unpack_json(payload)
+                if "controller" in settings and bool(settings["controller"]) != self.controller:
+                    self.controller = bool(settings["controller"])
+                    print(f"Platform control {'granted' if self.controller else 'released'}.")
+                self.layers = settings.get("layers", self.layers)
+                if settings.get("layer", self.layer) != self.layer:
+                    self.layer = settings["layer"]
+                    print(f"Layer {self.layer} {self.layers.get(self.layer)} of {list(self.layers)}.")
+        except (struct.error, ValueError):
+            print(f"Broken {NAMES.get(kind, hex(kind))} message discarded.")
 
     def receive_status(self):
-        # mark server as ready when receive "ServerReady"
-        while self.status_socket:
-            try:
-                message = self.status_socket.recv(1024)
-                print("Message ", message)
-                print(f'Server camera-angles {[float(degree) for degree in str(message, encoding="utf-8")[-13:].split(" ")]}.')
-            except ConnectionAbortedError:
-                print("Status-receiver offline: Server connection lost")
-                break
-            except ConnectionResetError:
-                print("Status-receiver offline: Server connection reset")
-                break
-            time.sleep(0.1)
+        # camera angles, role and clock sync answers of server, applied as they arrive
+        reader = self.status_reader
+        while self.running:
+            while self.early_status:
+                self.handle_status(*self.early_status.pop(0))
+            status_socket = self.status_socket
+            reason = "Server closed connection"
+            if self.mux:
+                # status comes with video (receive_session), only silence of server is watched here
+                silent = time.time() - self.last_received
+                if silent < STATUS_TIMEOUT:
+                    time.sleep(min(STATUS_TIMEOUT - silent, 0.5))
+                    continue
+                reason, message = "Server session timed out", b""
+            else:
+                try:
+                    message = status_socket.recv(1024)
+                except ConnectionAbortedError:
+                    reason, message = "Server connection lost", b""
+                except ConnectionResetError:
+                    reason, message = "Server connection reset", b""
+                except (AttributeError, OSError):
+                    reason, message = "Status socket closed", b""
+            if not message:
+                if not self.running:
+                    break
+                print(f"Status-receiver offline: {reason}")
+                if not self.reconnect(status_socket):
+                    break
+                # messages of the new link, request_link may have read its first ones
+                reader = self.status_reader
+                continue
+            received = time.time()
+            for kind, payload in reader.feed(message):
+                self.handle_status(kind, payload, received)
 
     def receive_data(self):
         # receive video from server
-        while self.data_socket:
+        while self.running:
             # receive data
             try:
                 # receive data from data socket
@@ -85,16 +401,21 @@ class Client:
                     if data[-4:] == b'done':
                         # one frame is received
                         self.tmp.append(data[:-4])
-                        self.buffer.append(b''.join(self.tmp))
+                        self.buffer.put(Frame(None, None, b''.join(self.tmp)))
                         # print("received one frame by <receive data>", len(self.buffer))
                         self.tmp = []
                         # self.status_setter((self.server_ready, True))
                     else:
                         # continue receiving
                         self.tmp.append(data)
+                elif self.server_type == "UDP" and self.packet_version:
+                    for frame in (self.receive_session() if self.mux else self.reassembler.receive(self.data_socket)):
+                        self.buffer.put(frame)
+                    if self.nack:
+                        self.request_retransmission()
                 elif self.server_type == "UDP":
-                    data, server = self.data_socket.recvfrom(1024)
-                    print(len(data), str(data[-9:-6], encoding="utf-8"), str(data[-6:-3], encoding="utf-8"), str(data[-3:], encoding="utf-8"), data[-9:], server)
+                    data, server = self.data_socket.recvfrom(self.pack_size)
+                    # print(len(data), str(data[-9:-6], encoding="utf-8"), str(data[-6:-3], encoding="utf-8"), str(data[-3:], encoding="utf-8"), data[-9:], server)
                     # if data is received
                     if data[-6:-3] == data[-3:]:
 
@@ -108,7 +429,7 @@ class Client:
                             for pack in packs:
                                 index = int(pack[-3:])
                                 sorted_packs[index] = pack[:-9]
-                            self.buffer.append(b''.join(sorted_packs))
+                            self.buffer.put(Frame(None, None, b''.join(sorted_packs)))
                             # self.buffer.append(b''.join((pack[:-6] for pack in self.tmp if pack[-6:-4] == data[-6:-4])))
                             # print("received one frame by <receive data>", len(self.buffer))
                             self.tmp = []
@@ -118,34 +439,71 @@ class Client:
                         self.tmp.append(data)
             except ConnectionAbortedError:
                 print("Data-receiver offline: Server connection lostCA")
-                break
+                if not self.wait_connected():
+                    break
             except ConnectionResetError:
                 print("Data-receiver offline: Server connection resetC")
-                break
+                if not self.wait_connected():
+                    break
             except TimeoutError:
                 print("Data-receiver timeout! ")
                 self.tmp = []
                 # self.status_setter((self.server_ready, True))
-            except OSError as e:
-                print(data)
-                print(e)
-                print("Data-receiver offline: Server connection resetO")
-                break
+            except (AttributeError, OSError) as e:
+                if not self.wait_connected():
+                    print(data)
+                    print(e)
+                    print("Data-receiver offline: Server connection resetO")
+                    break
+
+    def receive_session(self):
+        """
+        receive one datagram of a single port session, status messages are applied at once
+        :return: list of Frame ready in order
+        """
+        length = self.data_socket.recv_into(self.reassembler.receive_buffer)
+        data = self.reassembler.receive_view[:length]
+        self.last_received = time.time()
+        if not is_status(data):
+            return self.reassembler.feed(data, self.last_received)
+        session, messages = unpack_status(data)
+        if session == self.session:
+            for kind, payload in MessageReader().feed(messages):
+                self.handle_status(kind, payload, self.last_received)
+        return []
+
+    def wait_connected(self) -> bool:
+        """
+        data link failed, wait for the status receiver to notice and connect again
+        :return: True if receiving can go on, False if client stops
+        """
+        # errors of a link that is still thought alive repeat until the status receiver notices
+        time.sleep(0.05)
+        self.connected.wait(1.0)
+        return self.running
+
+    def request_retransmission(self):
+        # send nacks for partial frames, checked every 5 ms at most
+        now = time.time()
+        if now - self.last_nack_check < 0.005:
+            return
+        self.last_nack_check = now
+        for sequence, missing in self.reassembler.missing_chunks(now):
+            self.data_socket.sendto(pack_nack(VERSION, sequence, missing), (self.host, self.data_port))
+            self.nack_count += 1
+
+    def decode_frames(self):
+        # feed received frames to decoder workers
+        while self.running:
+            frame = self.buffer.get(timeout=0.5)
+            if frame is not None:
+                self.decoder.submit(frame)
 
     def render_stream(self):
         # check if stream comes in
-        while True:
-            if len(self.buffer) >= 1:
-                frame = self.buffer.pop(0)
-                print("Stream Incoming...")
-                try:
-                    frame_buffer = self.unzip_frame(frame)
-                    print("Stream Verified!")
-                    break
-                except:  # zlib.error: Error -3 while decompressing data: incorrect header check
-                    print("Stream data not complete, retrying...")
-            else:
-                time.sleep(0.01)
+        print("Stream Incoming...")
+        image = self.decoder.get()[1]
+        print("Stream Verified!")
         # set window callback
         cv2.namedWindow("Camera0")
 
@@ -158,55 +516,103 @@ class Client:
                     min(max(self.platform_degrees[0] + delta[0] - self.platform_degrees_delta[0], -90), 90),
                     min(max(self.platform_degrees[1] + delta[1] - self.platform_degrees_delta[1], -90), 40)]
                 self.platform_degrees_delta = delta
+                self.status_event.set()
 
         cv2.setMouseCallback("Camera0", mouse_clb)
-        # endless render
-        correct = 0
-        total = 0
+        # endless render, window is only redrawn when a frame is due
+        shown = 0
         start = time.time()
         while True:
-            # discard older data
-            if len(self.buffer) >= 60:
-                self.buffer = self.buffer[-60:]
-            # update frame if buffer is not empty
-            if len(self.buffer) >= 1:
-                frame = self.buffer.pop(0)
+            self.buffer_decoded(min(self.playout.next_due(), 0.005))
+            played = self.playout.get()
+            if played is not None:
+                frame, new_image, decode_time, waited = played
+                display_start = time.time()
                 try:
-                    frame_buffer = self.unzip_frame(frame)
-                    correct += 1
-                    total += 1
-                except:  # zlib.error: Error -3 while decompressing data: incorrect header check
-                    print("Incomplete frame_buffer! Data has been discarded!")
-                    total += 1
-            else:
-                # frame will not be updated
-                pass
-            try:
-                cv2.imshow('Camera0', cv2.imdecode(np.frombuffer(frame_buffer, dtype=np.uint8), 1))
-            except:
-                traceback.print_exc()
-
-            if total % 600 == 0 and total != 0:
-                print(f"Accuracy: {correct / total}, correct: {correct}, total: {total}")
-            if cv2.waitKey(1) & 0xFF == ord('q'):
+                    cv2.imshow('Camera0', new_image)
+                except:
+                    traceback.print_exc()
+                self.record_latency(frame, decode_time, display_start, time.time(), waited)
+                # shown image is copied to window, its array can be reused
+                self.decoder.release(image)
+                image = new_image
+                shown += 1
+                if shown % 600 == 0:
+                    correct, total = self.decoder.decoded, self.decoder.decoded + self.decoder.broken
+                    print(f"Accuracy: {correct / total}, correct: {correct}, total: {total}, dropped: {self.buffer.dropped}")
+                    print(self.reassembler.stats(), self.decoder.stats(), self.playout.stats(), f"NACK: {self.nack_count}")
+            key = cv2.waitKey(1) & 0xFF
+            if ord('1') <= key <= ord('9') and key - ord('1') < len(self.layers):
+                self.change_settings(layer=list(self.layers)[key - ord('1')])
+            if key == ord('q'):
                 print("Camera stopped by keyboard control.")
                 # if self.status_socket:
                 #     self.status_socket.close()
                 # if self.data_socket:
                 #     self.data_socket.close()
-                print(f"Accuracy: {correct / total}, correct: {correct}, total: {total}")
+                print(f"Accuracy: {self.decoder.decoded / max(self.decoder.decoded + self.decoder.broken, 1)}, correct: {self.decoder.decoded}, total: {self.decoder.decoded + self.decoder.broken}")
                 break
         self.stop()
         end = time.time()
-        print(end-start, total/(end-start))
+        print(end-start, shown/(end-start))
+
+    def buffer_decoded(self, timeout: float):
+        # move decoded frames to jitter buffer, waits up to timeout for the first one
+        decoded = self.decoder.get(timeout=timeout)
+        while decoded is not None:
+            self.playout.put(*decoded)
+            decoded = self.decoder.get(timeout=0)
+
+    def record_latency(self, frame: Frame, decode_time: float, display_start: float, display_end: float, waited=0.0):
+        """
+        add stage durations of one displayed frame to latency histograms, report them when due
+        :param frame: displayed frame
+        :param decode_time: decode seconds
+        :param display_start: time imshow was called
+        :param display_end: time imshow returned
+        :param waited: seconds frame waited in jitter buffer
+        :return: None
+        """
+        stages = {"decode": decode_time, "playout": waited, "display": display_end - display_start}
+        if frame.first_arrival is not None:
+            stages["last_packet"] = frame.last_arrival - frame.first_arrival
+            stages["reassembly"] = frame.delivered - frame.last_arrival
+        if frame.timestamp is not None:
+            # capture time on client clock
+            captured = frame.timestamp - self.clock.offset
+            payload = self.reassembler.timing(frame.sequence) if self.timing else None
+            if payload is not None:
+                server_stages = unpack_stages(payload)
+                stages.update((stage, server_stages[stage]) for stage in ("capture", "encode", "compress", "send"))
+                stages["first_packet"] = frame.first_arrival - (captured + server_stages["send_start"])
+                captured -= server_stages["capture"]
+            stages["total"] = display_end - captured
+        self.latency.add(stages)
+        if self.latency.due(display_end):
+            report = json.dumps(self.latency.report(self.clock))
+            print(f"Latency: {report}")
+            if self.latency_report:
+                with open(self.latency_report, "a") as f:
+                    f.write(report + "\n")
+            self.latency.clear()
 
     def stop(self):
         # Destroy all the windows
         cv2.destroyAllWindows()
-        # disconnect to server
-        self.status_socket.sendall(b"end end")
-        self.status_socket = self.status_socket.close()  # None
-        self.data_socket = self.data_socket.close()  # None
+        self.decoder.close()
+        self.disconnect()
+
+    def disconnect(self):
+        # tell server the session is over, threads stop instead of reconnecting
+        self.running = False
+        self.connected.set()
+        with self.reconnect_lock:
+            try:
+                self.status_socket.sendall(pack_message(BYE))
+            except OSError:
+                pass
+            self.close_links()
+            self.status_socket = self.data_socket = None
 
     @staticmethod
     def zip_frame(buffer):
@@ -223,6 +629,9 @@ class Client:
         receive_status.start()
         receive_data = threading.Thread(target=self.receive_data)
         receive_data.start()
+        decode_frames = threading.Thread(target=self.decode_frames)
+        decode_frames.daemon = True
+        decode_frames.start()
         # process_stream = threading.Thread(target=self.process_stream)
         # process_stream.start()
         self.render_stream()
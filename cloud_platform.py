@@ -1,19 +1,39 @@
+import math
+import sys
+import threading
 import time
 import traceback
 from typing import List
 
-from gpiozero.pins.pigpio import PiGPIOFactory
 from gpiozero import AngularServo
 import time
 import os
 
 
 #  run "sudo pigpiod" to start hardware-pwm
+#  "python cloud_platform.py --mock" drives mock pins instead, no hardware needed
 
 
 class CloudPlatform:
-    def __init__(self, host="172.25.25.25", port=8888, motor_x_pin=12, motor_y_pin=13):
-        factory = PiGPIOFactory()
+    """
+    two servo pan-tilt platform. calling it only sets the target angles, a motion planner thread moves the
+    servos there at a fixed control rate with limited velocity and acceleration, so a burst of targets
+    (mouse drag) becomes one smooth movement towards the newest target instead of a burst of jumps.
+    on_move(angles) is called with the angles the servos are set to while they move, and once they stop.
+    """
+    def __init__(self, host="172.25.25.25", port=8888, motor_x_pin=12, motor_y_pin=13, pin_factory=None,
+                 rate=50, max_velocity=180.0, max_acceleration=720.0, report_interval=0.1):
+        """
+        :param pin_factory: gpiozero pin factory, PiGPIOFactory if None, MockFactory(pin_class=MockPWMPin) for tests
+        :param rate: control steps per second
+        :param max_velocity: degrees per second
+        :param max_acceleration: degrees per second squared
+        :param report_interval: seconds between on_move calls while moving
+        """
+        if pin_factory is None:
+            # needs pigpio, imported here so that mock pins work without it
+            from gpiozero.pins.pigpio import PiGPIOFactory
+            pin_factory = PiGPIOFactory()
         self.servo_motor1 = AngularServo(
             pin=motor_x_pin,
             initial_angle=0.0,
@@ -22,7 +42,7 @@ class CloudPlatform:
             min_pulse_width=0.5/1000,
             max_pulse_width=2.5/1000,
             frame_width=20/1000,
-            pin_factory=factory
+            pin_factory=pin_factory
         )
         self.servo_motor2 = AngularServo(
             pin=motor_y_pin,
@@ -32,26 +52,129 @@ class CloudPlatform:
             min_pulse_width=0.5 / 1000,
             max_pulse_width=1.94444 / 1000,
             frame_width=20 / 1000,
-            pin_factory=factory
+            pin_factory=pin_factory
         )
+        self.servos = (self.servo_motor1, self.servo_motor2)
+        self.rate = rate
+        self.max_velocity = max_velocity
+        self.max_acceleration = max_acceleration
+        self.report_interval = report_interval
+        # planner state per axis, only the newest target is kept
+        self.position = [0.0, 0.0]
+        self.velocity = [0.0, 0.0]
+        self.target = [0.0, 0.0]
+        self.condition = threading.Condition()
+        self.closed = False
+        self.on_move = None
+        # counters
+        self.targets = 0
+        self.steps = 0
+        self.planner = threading.Thread(target=self.plan, name="MotionPlanner")
+        self.planner.daemon = True
+        self.planner.start()
 
     def __call__(self, degree: List):
-        self.servo_motor1.angle = degree[0]
-        self.servo_motor2.angle = degree[1]
+        # returns at once, servos follow in planner thread
+        with self.condition:
+            self.target = [float(min(max(angle, servo.min_angle), servo.max_angle)) for angle, servo in zip(degree, self.servos)]
+            self.targets += 1
+            self.condition.notify_all()
+
+    @property
+    def angles(self) -> List[float]:
+        # angles the servos are set to now
+        return [round(servo.angle, 2) for servo in self.servos]
+
+    @property
+    def moving(self) -> bool:
+        return self.position != self.target or any(self.velocity)
+
+    def step(self, axis: int, dt: float):
+        """
+        move one axis for dt seconds: accelerate towards max velocity, brake in time to stop at the target
+        :param axis: 0 x, 1 y
+        :param dt: control interval
+        :return: None
+        """
+        distance = self.target[axis] - self.position[axis]
+        velocity = self.velocity[axis]
+        speed = min(self.max_velocity, math.sqrt(2 * self.max_acceleration * abs(distance)))
+        dv = math.copysign(speed, distance) - velocity
+        velocity += min(max(dv, -self.max_acceleration * dt), self.max_acceleration * dt)
+        position = self.position[axis] + velocity * dt
+        if abs(distance) < 0.01 or (position - self.target[axis]) * distance > 0:
+            # reached or passed the target within this step
+            position, velocity = self.target[axis], 0.0
+        self.position[axis] = position
+        self.velocity[axis] = velocity
+
+    def plan(self):
+        dt = 1 / self.rate
+        last_report = 0.0
+        next_step = time.time()
+        while True:
+            with self.condition:
+                if not self.moving:
+                    self.condition.notify_all()
+                    self.condition.wait_for(lambda: self.moving or self.closed)
+                    next_step = time.time()
+                if self.closed:
+                    break
+                for axis in range(2):
+                    self.step(axis, dt)
+                # one pwm write per servo and step
+                for servo, angle in zip(self.servos, self.position):
+                    servo.angle = angle
+                stopped = not self.moving
+            self.steps += 1
+            now = time.time()
+            if self.on_move and (stopped or now - last_report >= self.report_interval):
+                last_report = now
+                self.on_move(self.angles)
+            next_step += dt
+            if next_step > now:
+                time.sleep(next_step - now)
+            else:
+                # fell behind, do not try to catch up
+                next_step = now
+
+    def wait(self, timeout=None) -> bool:
+        """
+        wait until servos stand at the target
+        :param timeout: seconds, None waits forever
+        :return: True if target is reached
+        """
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.moving, timeout)
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.planner.join()
+        for servo in self.servos:
+            servo.close()
+
+    def stats(self) -> str:
+        return f"CloudPlatform: angles {self.angles} target {self.target} targets {self.targets} steps {self.steps}"
 
 
 if __name__ == "__main__":
-    plm = CloudPlatform()
+    if "--mock" in sys.argv:
+        from gpiozero.pins.mock import MockFactory, MockPWMPin
+        plm = CloudPlatform(pin_factory=MockFactory(pin_class=MockPWMPin))
+        plm.on_move = lambda angles: print(f"Platform at {angles}.")
+    else:
+        plm = CloudPlatform()
     while True:
         d = input("Input Degree: ")
         try:
             d = d.split(" ")
             d = [float(_) for _ in d]
             plm(d)
+            plm.wait()
         except (IndexError, ValueError) as error:
             traceback.print_exc()
             plm([0, 0])
-            time.sleep(2)
+            plm.wait(2)
             break
-
-
@@ -0,0 +1,129 @@
+import bz2
+import lzma
+import zlib
+
+
+#  payload codecs negotiated in the data handshake, spec format is "<name>[:<level>]"
+
+
+class RawCodec:
+    name = "raw"
+
+    def __init__(self, level=None):
+        self.level = None
+
+    @property
+    def spec(self):
+        return self.name
+
+    def compress(self, buffer):
+        # no copy, packet sender slices the frame itself
+        return memoryview(buffer).cast("B")
+
+    def decompress(self, buffer) -> bytes:
+        return buffer
+
+
+class ZlibCodec(RawCodec):
+    name = "zlib"
+    default_level = 6
+    # valid compression levels, -1 is the zlib default
+    levels = range(-1, 10)
+
+    def __init__(self, level=None):
+        super().__init__()
+        self.level = self.default_level if level is None else int(level)
+
+    @property
+    def spec(self):
+        return f"{self.name}:{self.level}"
+
+    def compress(self, buffer) -> bytes:
+        return zlib.compress(buffer, self.level)
+
+    def decompress(self, buffer) -> bytes:
+        return zlib.decompress(buffer)
+
+
+class LzmaCodec(ZlibCodec):
+    # slow, for low-bandwidth links only
+    name = "lzma"
+    default_level = 1
+    levels = range(0, 10)
+
+    def compress(self, buffer) -> bytes:
+        return lzma.compress(buffer, preset=self.level)
+
+    def decompress(self, buffer) -> bytes:
+        return lzma.decompress(buffer)
+
+
+class Bz2Codec(ZlibCodec):
+    # slow, for low-bandwidth links only
+    name = "bz2"
+    default_level = 9
+    levels = range(1, 10)
+
+    def compress(self, buffer) -> bytes:
+        return bz2.compress(buffer, self.level)
+
+    def decompress(self, buffer) -> bytes:
+        return bz2.decompress(buffer)
+
+
+class AdaptiveCodec(ZlibCodec):
+    """
+    zlib that switches itself off when the payload does not shrink enough to be worth the CPU.
+    every frame is prefixed with one flag byte telling the receiver if it is compressed.
+    """
+    name = "adaptive"
+    default_level = 1
+    RAW = b"\x00"
+    ZLIB = b"\x01"
+
+    def __init__(self, level=None, threshold=0.9, probe_interval=60):
+        super().__init__(level)
+        # compressed/raw size ratio above which zlib is dropped
+        self.threshold = threshold
+        # while sending raw, try compressing again every n frames
+        self.probe_interval = probe_interval
+        self.compressing = True
+        self.ratio = 1.0
+        self.count = 0
+
+    def compress(self, buffer) -> bytes:
+        self.count += 1
+        if self.compressing or self.count % self.probe_interval == 0:
+            compressed = zlib.compress(buffer, self.level)
+            self.ratio = len(compressed) / max(memoryview(buffer).nbytes, 1)
+            self.compressing = self.ratio < self.threshold
+            if self.compressing:
+                return self.ZLIB + compressed
+        return self.RAW + bytes(buffer)
+
+    def decompress(self, buffer) -> bytes:
+        if buffer[:1] == self.ZLIB:
+            return zlib.decompress(memoryview(buffer)[1:])
+        if buffer[:1] == self.RAW:
+            return buffer[1:]
+        raise ValueError("Unknown adaptive codec flag.")
+
+
+CODECS = {codec.name: codec for codec in (RawCodec, ZlibCodec, LzmaCodec, Bz2Codec, AdaptiveCodec)}
+# codec used by peers that do not negotiate one
+LEGACY_CODEC = "zlib"
+
+
+def get_codec(spec: str = LEGACY_CODEC):
+    """
+    build a codec from its handshake spec
+    :param spec: "raw", "zlib:6", "lzma", "bz2:9", "adaptive" ...
+    :return: codec instance
+    """
+    name, _, level = spec.partition(":")
+    if name not in CODECS:
+        raise ValueError(f"Unknown codec {spec}.")
+    codec = CODECS[name](level or None)
+    if codec.level is not None and codec.level not in codec.levels:
+        raise ValueError(f"Level of codec {spec} is out of range.")
+    return codec
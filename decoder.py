@@ -0,0 +1,82 @@
+import time
+from collections import deque
+
+import numpy as np
+import cv2
+
+from encoder_pool import EncoderPool
+
+
+class FrameDecoder:
+    """
+    decompress and decode received frames on worker threads, images come out in arrival order.
+    frames downscaled by the server are resized into preallocated window sized arrays, which are reused
+    once the renderer has shown them (release), so the resize step does not allocate per frame.
+    """
+    def __init__(self, codec, width: int, height: int, workers=2):
+        self.codec = codec
+        self.width = width
+        self.height = height
+        # window sized arrays free for reuse
+        self.free = deque(maxlen=workers + 2)
+        self.pool = EncoderPool(self.decode, workers=workers, name="DecoderPool")
+        # counters
+        self.decoded = 0
+        self.broken = 0
+        self.decode_time = 0.0
+        self.decode_count = 0
+
+    def submit(self, frame) -> bool:
+        """
+        :param frame: reassembly.Frame of compressed data
+        :return: True if an older frame waiting for a worker was dropped
+        """
+        return self.pool.submit(frame)
+
+    def get(self, timeout=None):
+        """
+        :param timeout: seconds to wait
+        :return: next (Frame, BGR image, decode seconds), None if no image is ready in time
+        """
+        return self.pool.get(timeout)
+
+    def release(self, image):
+        # image has been shown, its array can be decoded into again
+        if image.shape == (self.height, self.width, 3):
+            self.free.append(image)
+
+    def take_array(self):
+        try:
+            return self.free.pop()
+        except IndexError:
+            return np.empty((self.height, self.width, 3), dtype=np.uint8)
+
+    def decode(self, frame):
+        """
+        run by workers
+        :param frame: reassembly.Frame of compressed data
+        :return: Frame, BGR image at window size, decode seconds; None if frame is broken
+        """
+        start = time.time()
+        try:
+            image = cv2.imdecode(np.frombuffer(self.codec.decompress(frame.data), dtype=np.uint8), cv2.IMREAD_COLOR)
+        except Exception:  # zlib.error: Error -3 while decompressing data: incorrect header check
+            image = None
+        if image is None:
+            print("Incomplete frame_buffer! Data has been discarded!")
+            self.broken += 1
+            return None
+        if image.shape[1] != self.width or image.shape[0] != self.height:
+            # frames downscaled by server bitrate controller are shown at requested size
+            image = cv2.resize(image, (self.width, self.height), dst=self.take_array(), interpolation=cv2.INTER_LINEAR)
+        duration = time.time() - start
+        self.decode_time += duration
+        self.decode_count += 1
+        self.decoded += 1
+        return frame, image, duration
+
+    def close(self):
+        self.pool.close()
+
+    def stats(self) -> str:
+        return f"Decoder: decoded {self.decoded} broken {self.broken} {self.pool.stats()}"
@@ -0,0 +1,126 @@
+import threading
+import traceback
+from collections import deque
+
+
+class EncoderPool:
+    """
+    encode (or decode) frames on several worker threads and hand the results out in submit order.
+    OpenCV releases the GIL while encoding, so throughput scales with the number of workers.
+    waiting jobs beyond one per worker are dropped oldest first. when a finished frame is max_lag frames
+    ahead of the oldest unfinished one, the old one is skipped and discarded when it completes.
+    """
+    def __init__(self, encode, workers=3, max_lag=None, name="EncoderPool"):
+        """
+        :param encode: callable run by workers, encode(item) -> result
+        :param workers: number of worker threads
+        :param max_lag: frames a slow job may fall behind before it is skipped, workers by default
+        :param name: name used in stats
+        """
+        self.encode = encode
+        self.workers = workers
+        self.max_lag = max_lag or workers
+        self.name = name
+        self.condition = threading.Condition()
+        # (sequence, item) waiting for a worker
+        self.jobs = deque()
+        self.in_progress = set()
+        # finished results by sequence
+        self.results = {}
+        self.next_sequence = 0
+        self.next_output = 0
+        self.closed = False
+        # counters
+        self.submitted = 0
+        self.encoded = 0
+        self.dropped = 0
+        self.late = 0
+        self.threads = []
+        for index in range(workers):
+            thread = threading.Thread(target=self.work, name=f"{name}-{index}")
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, item) -> bool:
+        """
+        queue one frame for encoding
+        :param item: argument of encode
+        :return: True if an older waiting frame was dropped
+        """
+        with self.condition:
+            self.jobs.append((self.next_sequence, item))
+            self.next_sequence += 1
+            self.submitted += 1
+            dropped = False
+            while len(self.jobs) > self.workers:
+                self.jobs.popleft()
+                self.dropped += 1
+                dropped = True
+            self.condition.notify_all()
+            return dropped
+
+    def work(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.jobs or self.closed)
+                if self.closed:
+                    return
+                sequence, item = self.jobs.popleft()
+                self.in_progress.add(sequence)
+            try:
+                result = self.encode(item)
+            except Exception:
+                traceback.print_exc()
+                result = None
+            with self.condition:
+                self.in_progress.discard(sequence)
+                if result is None or sequence < self.next_output:
+                    # failed or skipped while encoding
+                    self.late += result is not None
+                else:
+                    self.encoded += 1
+                    self.results[sequence] = result
+                self.condition.notify_all()
+
+    def pending(self, sequence: int) -> bool:
+        return sequence in self.in_progress or any(waiting == sequence for waiting, _ in self.jobs)
+
+    def advance(self) -> bool:
+        # move next_output past frames that will never be delivered, True if next result is ready
+        while self.next_output < self.next_sequence:
+            if self.next_output in self.results:
+                return True
+            if self.pending(self.next_output) and not (self.results and max(self.results) - self.next_output >= self.max_lag):
+                return False
+            # dropped, failed, or too far behind newer frames
+            self.next_output += 1
+        return False
+
+    def get(self, timeout=None):
+        """
+        take the next result in submit order, waiting until it is ready
+        :param timeout: seconds to wait, None waits forever
+        :return: result, None if timeout or pool is closed
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.advance() or self.closed, timeout) or self.closed:
+                return None
+            result = self.results.pop(self.next_output)
+            self.next_output += 1
+            return result
+
+    def clear(self):
+        # forget waiting jobs and results, frames being encoded are discarded when they finish
+        with self.condition:
+            self.jobs.clear()
+            self.results.clear()
+            self.next_output = self.next_sequence
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def stats(self) -> str:
+        return f"{self.name}: workers {self.workers} submitted {self.submitted} encoded {self.encoded} dropped {self.dropped} late {self.late}"
@@ -0,0 +1,57 @@
+#  forward error correction for binary UDP frames
+#
+#  data chunks of a frame are divided to groups of n chunks, every group gets one XOR parity packet
+#  (flag PARITY, index = group number, payload padded to full chunk size). receiver rebuilds one lost
+#  chunk per group without retransmission. overhead is 1/n, negotiated in data handshake as "fec:<n>".
+
+NO_FEC = "fec:0"
+
+
+def group_size(overhead: float) -> int:
+    """
+    :param overhead: parity packets per data packet, e.g. 0.25
+    :return: data chunks per parity group, 0 if fec is off
+    """
+    return max(1, round(1 / overhead)) if overhead > 0 else 0
+
+
+def parse_fec(spec: str = NO_FEC) -> int:
+    """
+    :param spec: "fec:<n>"
+    :return: group size n, 0 if fec is off
+    """
+    name, _, group = spec.partition(":")
+    if name != "fec" or not group.isdigit():
+        raise ValueError(f"Unknown fec {spec}.")
+    return int(group)
+
+
+def fec_spec(group: int) -> str:
+    return f"fec:{group}"
+
+
+def xor_parity(chunks, size: int) -> bytes:
+    """
+    xor of chunks, shorter chunks are padded with zeros
+    :param chunks: bytes-like chunks of one group
+    :param size: parity size, at least the longest chunk
+    :return: parity bytes
+    """
+    parity = 0
+    for chunk in chunks:
+        parity ^= int.from_bytes(chunk, "little")
+    return parity.to_bytes(size, "little")
+
+
+def recover(parity, chunks, length: int) -> bytes:
+    """
+    rebuild the only missing chunk of a group
+    :param parity: parity payload of the group
+    :param chunks: the other chunks of the group
+    :param length: length of the missing chunk
+    :return: missing chunk
+    """
+    missing = int.from_bytes(parity, "little")
+    for chunk in chunks:
+        missing ^= int.from_bytes(chunk, "little")
+    return missing.to_bytes(length, "little")
@@ -0,0 +1,84 @@
+import threading
+from collections import deque
+
+
+class FrameQueue:
+    """
+    bounded frame queue shared by producer and consumer threads.
+    policy "drop_oldest" keeps the newest maxsize frames, "latest" keeps only the newest frame.
+    consumers sleep on a condition variable until a frame is put, no busy waiting.
+    """
+    POLICIES = ("drop_oldest", "latest")
+
+    def __init__(self, maxsize=2, policy="drop_oldest", name="FrameQueue"):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown policy {policy}.")
+        self.name = name
+        self.policy = policy
+        self.maxsize = 1 if policy == "latest" else maxsize
+        self.frames = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        # counters
+        self.put_count = 0
+        self.get_count = 0
+        self.dropped = 0
+
+    def put(self, frame) -> bool:
+        """
+        add a frame, discarding the oldest one when queue is full
+        :param frame: any object
+        :return: True if an older frame was dropped
+        """
+        with self.condition:
+            dropped = False
+            while len(self.frames) >= self.maxsize:
+                self.frames.popleft()
+                self.dropped += 1
+                dropped = True
+            self.frames.append(frame)
+            self.put_count += 1
+            self.condition.notify()
+            return dropped
+
+    def get(self, timeout=None):
+        """
+        take the oldest frame, waiting until one is available
+        :param timeout: seconds to wait, None waits forever, 0 does not wait
+        :return: frame, None if timeout or queue is closed
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.frames or self.closed, timeout):
+                return None
+            if not self.frames:
+                return None
+            self.get_count += 1
+            return self.frames.popleft()
+
+    def peek(self):
+        # newest frame without removing it
+        with self.condition:
+            return self.frames[-1] if self.frames else None
+
+    def clear(self):
+        with self.condition:
+            self.frames.clear()
+
+    def close(self):
+        # wake up all waiting consumers
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def open(self):
+        with self.condition:
+            self.closed = False
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __bool__(self):
+        return bool(self.frames)
+
+    def stats(self) -> str:
+        return f"{self.name}: put {self.put_count} get {self.get_count} dropped {self.dropped} queued {len(self.frames)}"
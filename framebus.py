@@ -0,0 +1,319 @@
+import struct
+import threading
+import time
+from collections import namedtuple
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from frame_queue import FrameQueue
+
+
+#  shared memory frame bus: local processes read camera frames without a socket, a camera handle or a decode
+#
+#  CameraServer publishes to two rings, "<name>_frames" (captured frames: BGR images, or jpeg buffers of an
+#  MJPEG camera in passthrough) and "<name>_jpeg" (full size jpeg as encoded for clients). a ring is one
+#  shared memory block: a header (magic, version, closed flag, slot count, slot capacity, head sequence,
+#  last read time) and slots of a slot header (sequence, timestamp, length, height, width, channels, encoding)
+#  and frame data. the writer zeroes the slot sequence, copies the frame, then sets slot sequence and head,
+#  so a reader knows a frame was overwritten while it read it when the slot sequence has changed.
+#  readers write the time they last looked into the header, the server only publishes to a ring read within
+#  READER_TIMEOUT seconds, and keeps the camera streaming for it. a ring too small for a frame is closed
+#  (closed flag set, readers reopen it by name) and created again larger.
+#
+#  reader:
+#      reader = FrameBusReader("camera")
+#      frame = reader.get(timeout=1.0)   # newest frame not seen yet, image is a view of the slot
+#      ...                               # use frame.image, then check reader.intact(frame)
+
+MAGIC = b"FBUS"
+VERSION = 1
+# magic, version, closed, slots, capacity, head, read time
+HEADER_STRUCT = struct.Struct("=4sBBHIQd")
+HEADER_SIZE = 64
+HEAD_OFFSET = 12
+READ_TIME_OFFSET = 20
+# sequence, timestamp, length, height, width, channels, encoding
+SLOT_STRUCT = struct.Struct("=QdIHHBB")
+SLOT_HEADER_SIZE = 32
+BGR = 0
+JPEG = 1
+READER_TIMEOUT = 2.0
+
+BusFrame = namedtuple("BusFrame", ["sequence", "timestamp", "image", "encoding"])
+
+
+def attach(name: str):
+    # open an existing block without letting this process unlink it at exit
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # python < 3.13 has no track, the resource tracker would remove the block when the reader exits
+        memory = shared_memory.SharedMemory(name)
+        resource_tracker.unregister(memory._name, "shared_memory")
+        return memory
+
+
+class Ring:
+    """
+    writer side of one ring
+    """
+    def __init__(self, name: str, slots: int, capacity: int):
+        self.name = name
+        self.slots = slots
+        self.capacity = capacity
+        self.sequence = 0
+        try:
+            self.memory = shared_memory.SharedMemory(name, create=True, size=self.size)
+        except FileExistsError:
+            # left behind by a server that did not exit cleanly
+            stale = attach(name)
+            stale.close()
+            stale.unlink()
+            self.memory = shared_memory.SharedMemory(name, create=True, size=self.size)
+        self.memory.buf[:HEADER_SIZE] = bytes(HEADER_SIZE)
+        HEADER_STRUCT.pack_into(self.memory.buf, 0, MAGIC, VERSION, 0, slots, capacity, 0, 0.0)
+
+    @property
+    def size(self) -> int:
+        return HEADER_SIZE + self.slots * (SLOT_HEADER_SIZE + self.capacity)
+
+    @property
+    def read_time(self) -> float:
+        return struct.unpack_from("=d", self.memory.buf, READ_TIME_OFFSET)[0]
+
+    def write(self, timestamp: float, frame):
+        """
+        :param timestamp: capture time
+        :param frame: BGR image or 1-d jpeg buffer, not larger than capacity
+        :return: None
+        """
+        self.sequence += 1
+        slot = HEADER_SIZE + (self.sequence % self.slots) * (SLOT_HEADER_SIZE + self.capacity)
+        data = memoryview(np.ascontiguousarray(frame)).cast("B")
+        if frame.ndim == 3:
+            height, width, channels, encoding = frame.shape[0], frame.shape[1], frame.shape[2], BGR
+        else:
+            height, width, channels, encoding = 0, 0, 0, JPEG
+        buf = self.memory.buf
+        # sequence 0 marks the slot as being written
+        SLOT_STRUCT.pack_into(buf, slot, 0, timestamp, len(data), height, width, channels, encoding)
+        buf[slot + SLOT_HEADER_SIZE:slot + SLOT_HEADER_SIZE + len(data)] = data
+        struct.pack_into("=Q", buf, slot, self.sequence)
+        struct.pack_into("=Q", buf, HEAD_OFFSET, self.sequence)
+
+    def close(self):
+        # readers see the closed flag and reopen by name
+        self.memory.buf[5] = 1
+        self.memory.close()
+        self.memory.unlink()
+
+
+class FrameBus:
+    """
+    publishes the frames of CameraServer into shared memory rings for local readers, see FrameBusReader.
+    like the recorder it gets frames without waiting: they are queued by reference and copied to the
+    rings by a writer thread, the oldest are dropped if it falls behind, and rings nobody reads are skipped.
+    """
+    def __init__(self, name="camera", width=640, height=480, slots=4, quality=90, maxsize=4):
+        """
+        :param name: ring names are "<name>_frames" and "<name>_jpeg"
+        :param width: expected frame width, rings grow for larger frames
+        :param height: expected frame height
+        :param slots: frames kept per ring, a frame read by view stays intact for slots - 1 frame times
+        :param quality: jpeg quality when frames have to be encoded, full size frames of the same quality are shared with clients
+        :param maxsize: frames waiting for the writer
+        """
+        self.name = name
+        self.slots = slots
+        self.quality = quality
+        self.frames = Ring(f"{name}_frames", slots, width * height * 3)
+        # jpeg stays well below 1 byte per pixel
+        self.jpeg = Ring(f"{name}_jpeg", slots, width * height)
+        self.queue = FrameQueue(maxsize=maxsize, policy="drop_oldest", name="BusQueue")
+        self.lock = threading.Lock()
+        # counters
+        self.published = 0
+        self.grown = 0
+        self.writer = threading.Thread(target=self.write, name="FrameBus")
+        self.writer.daemon = True
+        self.writer.start()
+
+    def __repr__(self):
+        return f"<FrameBus {self.name}>"
+
+    @staticmethod
+    def read(ring: Ring) -> bool:
+        return time.time() - ring.read_time < READER_TIMEOUT
+
+    def active(self) -> bool:
+        # a local process reads one of the rings
+        return self.read(self.frames) or self.read(self.jpeg)
+
+    @property
+    def setting(self):
+        # encode setting of published jpeg: full size, no re-encoding of camera jpeg
+        return self.quality, 1.0, False
+
+    def wants_jpeg(self) -> bool:
+        return self.read(self.jpeg)
+
+    def put_frame(self, timestamp: float, frame):
+        """
+        queue a captured frame, never blocks
+        :param timestamp: capture time
+        :param frame: BGR image or 1-d jpeg buffer of camera, not modified afterwards
+        :return: None
+        """
+        if frame is not None and self.read(self.frames):
+            self.queue.put(("frames", timestamp, frame))
+
+    def put(self, timestamp: float, jpeg, stages=None):
+        """
+        queue an encoded frame, never blocks
+        :param timestamp: capture time
+        :param jpeg: 1-d uint8 array or bytes, None if the scene has not changed (not published)
+        :param stages: stage durations, not published
+        :return: None
+        """
+        if jpeg is not None:
+            self.queue.put(("jpeg", timestamp, np.frombuffer(jpeg, dtype=np.uint8) if isinstance(jpeg, bytes) else jpeg.reshape(-1)))
+
+    def write(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                # queue is closed
+                break
+            kind, timestamp, frame = item
+            with self.lock:
+                ring = getattr(self, kind)
+                if frame.nbytes > ring.capacity:
+                    ring = self.grow(kind, frame.nbytes)
+                ring.write(timestamp, frame)
+            self.published += 1
+
+    def grow(self, kind: str, size: int) -> Ring:
+        # new ring with room for frames of size, readers reopen it. jpeg sizes vary, leave some headroom
+        ring = getattr(self, kind)
+        ring.close()
+        larger = Ring(ring.name, self.slots, max(size + size // 2, ring.capacity * 2) if kind == "jpeg" else size)
+        setattr(self, kind, larger)
+        self.grown += 1
+        return larger
+
+    def close(self):
+        self.queue.close()
+        self.writer.join()
+        with self.lock:
+            self.frames.close()
+            self.jpeg.close()
+
+    def stats(self) -> str:
+        return f"FrameBus: published {self.published} grown {self.grown} readers frames {self.read(self.frames)} jpeg {self.read(self.jpeg)} {self.queue.stats()}"
+
+
+class FrameBusReader:
+    """
+    reads one ring of a FrameBus from any local process. frames are numpy views of the shared slot, no copy:
+    a view is valid as long as intact(frame) is True, which is slots - 1 frame times at least. use
+    get(copy=True) to keep a frame longer. get polls the head sequence, there is no cross process wakeup.
+    """
+    def __init__(self, name="camera", ring="frames", poll=0.002):
+        """
+        :param name: name of FrameBus
+        :param ring: "frames" for captured frames, "jpeg" for encoded frames
+        :param poll: seconds between looks at the head sequence while waiting
+        """
+        self.name = f"{name}_{ring}"
+        self.poll = poll
+        self.memory = None
+        self.slots = 0
+        self.capacity = 0
+        self.last = 0
+        # counters
+        self.read_count = 0
+        self.skipped = 0
+        self.torn = 0
+        self.open()
+
+    def open(self):
+        # the old mapping is kept until the ring could be opened again
+        memory = attach(self.name)
+        self.close()
+        self.memory = memory
+        magic, version, _, self.slots, self.capacity, self.last, _ = HEADER_STRUCT.unpack_from(self.memory.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.name} is not a frame bus ring of version {VERSION}.")
+
+    @property
+    def closed(self) -> bool:
+        return self.memory.buf[5] == 1
+
+    def touch(self):
+        # tells server that this ring is read
+        struct.pack_into("=d", self.memory.buf, READ_TIME_OFFSET, time.time())
+
+    def slot(self, sequence: int) -> int:
+        return HEADER_SIZE + (sequence % self.slots) * (SLOT_HEADER_SIZE + self.capacity)
+
+    def get(self, timeout=None, copy=False):
+        """
+        :param timeout: seconds to wait for a frame not seen yet, None waits forever
+        :param copy: return a copy that stays valid
+        :return: newest BusFrame not seen yet, None if none came in time
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            if self.closed:
+                # server grew or closed the ring
+                try:
+                    self.open()
+                except FileNotFoundError:
+                    pass
+            self.touch()
+            head = struct.unpack_from("=Q", self.memory.buf, HEAD_OFFSET)[0]
+            if head != self.last and head:
+                frame = self.frame(head, copy)
+                if frame is not None:
+                    self.skipped += max(head - self.last - 1, 0) if self.last else 0
+                    self.last = head
+                    self.read_count += 1
+                    return frame
+                self.torn += 1
+            if deadline is not None and time.time() >= deadline:
+                return None
+            time.sleep(self.poll)
+
+    def frame(self, sequence: int, copy=False):
+        offset = self.slot(sequence)
+        slot_sequence, timestamp, length, height, width, channels, encoding = SLOT_STRUCT.unpack_from(self.memory.buf, offset)
+        if slot_sequence != sequence:
+            return None
+        shape = (height, width, channels) if encoding == BGR else (length,)
+        image = np.ndarray(shape, dtype=np.uint8, buffer=self.memory.buf, offset=offset + SLOT_HEADER_SIZE)
+        if copy:
+            image = image.copy()
+        frame = BusFrame(sequence, timestamp, image, encoding)
+        if copy and not self.intact(frame):
+            return None
+        return frame
+
+    def intact(self, frame: BusFrame) -> bool:
+        """
+        :param frame: frame returned by get
+        :return: True if the slot still holds frame, False if the view has been overwritten meanwhile
+        """
+        return struct.unpack_from("=Q", self.memory.buf, self.slot(frame.sequence))[0] == frame.sequence
+
+    def close(self):
+        if self.memory is not None:
+            try:
+                self.memory.close()
+            except BufferError:
+                # views returned earlier still use it, unmapped once they are gone
+                pass
+            self.memory = None
+
+    def stats(self) -> str:
+        return f"FrameBusReader {self.name}: read {self.read_count} skipped {self.skipped} torn {self.torn}"
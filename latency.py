@@ -0,0 +1,169 @@
+import math
+import struct
+import time
+from collections import deque
+
+from status import pack_sync_request
+
+
+#  glass-to-glass latency instrumentation
+#
+#  server measures capture, encode, compress and send of every frame and, if negotiated in data handshake
+#  ("timing:1"), sends them after the frame in a packet with flag TIMING (see packet.py), payload:
+#  capture u32, encode u32, compress u32, send_start u32 (since capture timestamp), send u32, all microseconds.
+#  client adds first packet, last packet, reassembly, decode, playout (jitter buffer) and display and converts server times to its
+#  own clock with the offset estimated by SYNC messages over the status channel (see status.py).
+
+TIMING_ON = "timing:1"
+TIMING_OFF = "timing:0"
+SERVER_STAGES = ("capture", "encode", "compress", "send_start", "send")
+STAGES_STRUCT = struct.Struct("!5I")
+# stages reported by client, in pipeline order
+STAGES = ("capture", "encode", "compress", "send", "first_packet", "last_packet", "reassembly", "decode", "playout", "display", "total")
+
+
+def parse_timing(spec: str = TIMING_OFF) -> bool:
+    if spec not in (TIMING_ON, TIMING_OFF):
+        raise ValueError(f"Unknown timing {spec}.")
+    return spec == TIMING_ON
+
+
+def timing_spec(timing: bool) -> str:
+    return TIMING_ON if timing else TIMING_OFF
+
+
+def pack_stages(stages: dict) -> bytes:
+    """
+    :param stages: server stage durations in seconds
+    :return: payload of a timing packet
+    """
+    return STAGES_STRUCT.pack(*(min(max(int(stages.get(stage, 0.0) * 1_000_000), 0), 0xFFFFFFFF) for stage in SERVER_STAGES))
+
+
+def unpack_stages(data) -> dict:
+    """
+    :param data: payload of a timing packet
+    :return: server stage durations in seconds
+    """
+    return {stage: value / 1_000_000 for stage, value in zip(SERVER_STAGES, STAGES_STRUCT.unpack_from(data))}
+
+
+class Histogram:
+    """
+    log-spaced buckets, recording is one log and one increment, percentiles are read with a scan
+    of the buckets. values are kept to about 6 percent (20 buckets per decade) between min_value and max_value.
+    """
+    def __init__(self, min_value=0.0001, max_value=10.0, buckets_per_decade=20):
+        self.min_value = min_value
+        self.buckets_per_decade = buckets_per_decade
+        self.buckets = [0] * (int(math.log10(max_value / min_value) * buckets_per_decade) + 2)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float):
+        index = int(math.log10(value / self.min_value) * self.buckets_per_decade) + 1 if value > self.min_value else 0
+        self.buckets[min(index, len(self.buckets) - 1)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def bucket_value(self, index: int) -> float:
+        # upper bound of bucket
+        return self.min_value * 10 ** (index / self.buckets_per_decade)
+
+    def percentile(self, p: float) -> float:
+        """
+        :param p: 0 - 100
+        :return: value below which p percent of the recorded values fall, 0 if empty
+        """
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(self.bucket_value(index), self.max)
+        return self.max
+
+    def clear(self):
+        self.buckets = [0] * len(self.buckets)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+class ClockSync:
+    """
+    offset of client clock to server clock, NTP style.
+    client sends its time t0, server answers with receive time t1 and send time t2, client receives at t3.
+    offset = ((t1 - t0) + (t2 - t3)) / 2 of the sample with the smallest round trip among the recent ones.
+    """
+    def __init__(self, samples=16):
+        # (round trip, offset)
+        self.samples = deque(maxlen=samples)
+
+    def request(self, now=None) -> bytes:
+        # binary SYNC message carrying t0
+        return pack_sync_request(time.time() if now is None else now)
+
+    def add(self, t0: float, t1: float, t2: float, t3: float):
+        self.samples.append(((t3 - t0) - (t2 - t1), ((t1 - t0) + (t2 - t3)) / 2))
+
+    @property
+    def offset(self) -> float:
+        # server clock - client clock, 0 until the first answer
+        return min(self.samples)[1] if self.samples else 0.0
+
+    @property
+    def round_trip(self) -> float:
+        return min(self.samples)[0] if self.samples else 0.0
+
+
+class LatencyStats:
+    """
+    per-stage latency histograms of displayed frames, reported and cleared every interval
+    """
+    def __init__(self, interval=10.0):
+        self.interval = interval
+        self.histograms = {stage: Histogram() for stage in STAGES}
+        self.start = time.time()
+
+    def add(self, stages: dict):
+        for stage, value in stages.items():
+            if value >= 0 and stage in self.histograms:
+                self.histograms[stage].add(value)
+
+    def due(self, now=None) -> bool:
+        return (time.time() if now is None else now) - self.start >= self.interval
+
+    def report(self, clock: ClockSync = None) -> dict:
+        """
+        :param clock: clock sync whose offset and round trip are added to the report
+        :return: {"time", "interval", "clock_offset_ms", "round_trip_ms", "stages": {stage: {count, mean, p50, p95, p99, max}}} in milliseconds
+        """
+        now = time.time()
+        report = {
+            "time": round(now, 3),
+            "interval": round(now - self.start, 3),
+            "stages": {
+                stage: {
+                    "count": histogram.count,
+                    "mean": round(histogram.total / histogram.count * 1000, 3),
+                    "p50": round(histogram.percentile(50) * 1000, 3),
+                    "p95": round(histogram.percentile(95) * 1000, 3),
+                    "p99": round(histogram.percentile(99) * 1000, 3),
+                    "max": round(histogram.max * 1000, 3),
+                } for stage, histogram in self.histograms.items() if histogram.count
+            },
+        }
+        if clock is not None:
+            report["clock_offset_ms"] = round(clock.offset * 1000, 3)
+            report["round_trip_ms"] = round(clock.round_trip * 1000, 3)
+        return report
+
+    def clear(self):
+        for histogram in self.histograms.values():
+            histogram.clear()
+        self.start = time.time()
@@ -0,0 +1,84 @@
+import cv2
+
+
+#  simulcast layers: every layer is the captured frame scaled by a fixed factor, a client picks one
+#  in data handshake (the largest layer its window needs) and can switch over the status channel.
+
+LAYERS = {"full": 1.0, "half": 0.5, "thumb": 0.25}
+DEFAULT_LAYERS = ("full", "half", "thumb")
+# jpeg can be decoded at 1/2, 1/4 and 1/8 size by DCT scaling, much cheaper than a full decode and resize
+REDUCED_DECODE = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+def parse_layers(names) -> tuple:
+    """
+    :param names: layer names offered by server
+    :return: names, largest layer first
+    """
+    names = tuple(names)
+    for name in names:
+        if name not in LAYERS:
+            raise ValueError(f"Unknown layer {name}.")
+    if not names:
+        raise ValueError("No layer given.")
+    return tuple(sorted(set(names), key=lambda name: -LAYERS[name]))
+
+
+def fit_layer(layers, width: int, height: int, asked_width: int, asked_height: int) -> str:
+    """
+    :param layers: names offered, largest first
+    :param width: capture width
+    :param height: capture height
+    :param asked_width: window width of client
+    :param asked_height: window height of client
+    :return: smallest layer covering the window of client, the largest layer if none does
+    """
+    for name in reversed(layers):
+        if width * LAYERS[name] >= asked_width and height * LAYERS[name] >= asked_height:
+            return name
+    return layers[0]
+
+
+class FramePyramid:
+    """
+    scaled BGR images of one captured frame, each made once per frame and shared by all encodes.
+    a scale is made from the smallest image already made that is at least as large, jpeg buffers
+    are decoded at the smallest DCT-scaled size that is at least as large.
+    """
+    def __init__(self, frame):
+        """
+        :param frame: BGR image or raw jpeg buffer
+        """
+        self.frame = frame
+        # scale -> image
+        self.images = {1.0: frame} if frame.ndim == 3 else {}
+
+    def decode(self, scale: float):
+        # jpeg buffer at 1/1, 1/2, 1/4 or 1/8 size
+        factor = max(factor for factor in REDUCED_DECODE if 1 / factor >= scale)
+        if 1 / factor not in self.images:
+            self.images[1 / factor] = cv2.imdecode(self.frame.reshape(-1), REDUCED_DECODE[factor])
+        return 1 / factor, self.images[1 / factor]
+
+    def image(self, scale: float):
+        """
+        :param scale: factor of captured size, 0 < scale <= 1
+        :return: BGR image
+        """
+        if scale in self.images:
+            return self.images[scale]
+        larger = [known for known in self.images if known > scale]
+        if larger:
+            source_scale = min(larger)
+            source = self.images[source_scale]
+        else:
+            source_scale, source = self.decode(scale)
+            if source_scale == scale:
+                return source
+        if self.frame.ndim == 3:
+            height, width = self.frame.shape[:2]
+        else:
+            height, width = round(source.shape[0] / source_scale), round(source.shape[1] / source_scale)
+        image = cv2.resize(source, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+        self.images[scale] = image
+        return image
@@ -0,0 +1,82 @@
+import struct
+import time
+
+
+#  single port session transport: status messages travel with video on the UDP data port
+#
+#  a client asking "mux" in its data handshake opens no TCP status connection, one forwarded UDP port carries
+#  the whole session. status messages (status.py) are sent in datagrams of
+#  marker   u8     MARKER, never a packet version
+#  session  u8[8]  session token of the data handshake
+#  and whole status messages. video packets (packet.py) and nacks (nack.py) start with the packet version
+#  and stay as they are. server sends video to the address the last status datagram of the session came
+#  from, so a client whose NAT mapping changes is followed. both sides send a KEEPALIVE when nothing was sent
+#  for KEEPALIVE_INTERVAL and drop a session silent for STATUS_TIMEOUT: status and video live and die together.
+
+MUX = "mux"
+MARKER = 0xFE
+SESSION_HEADER = struct.Struct("!B8s")
+
+
+def is_status(data) -> bool:
+    """
+    :param data: datagram received on the data port
+    :return: True if it carries status messages of a single port session
+    """
+    return len(data) >= SESSION_HEADER.size and data[0] == MARKER
+
+
+def pack_status(session: str, messages: bytes) -> bytes:
+    """
+    :param session: session token, 16 hex digits
+    :param messages: packed status messages
+    :return: datagram
+    """
+    return SESSION_HEADER.pack(MARKER, bytes.fromhex(session)) + messages
+
+
+def unpack_status(data):
+    """
+    :param data: datagram, see is_status
+    :return: session token, status messages
+    """
+    return bytes(data[1:SESSION_HEADER.size]).hex(), bytes(data[SESSION_HEADER.size:])
+
+
+def asks_mux(hello: bytes) -> bool:
+    # client greetings "Hello Server W H codec format fec timing session mux"
+    return hello.split(b" ")[9:10] == [MUX.encode()]
+
+
+class MuxLink:
+    """
+    status link of a single port session, stands in for the TCP status socket (sendall) and the asyncio
+    StreamWriter (write). the UDP socket is shared with video and is not closed with the link.
+    """
+    def __init__(self, sock, address, session: str):
+        """
+        :param sock: UDP socket of the data port
+        :param address: peer address, follows the peer when its status comes from another one
+        :param session: session token
+        """
+        self.socket = sock
+        self.address = address
+        self.session = session
+        self.last_sent = 0.0
+        self.last_received = time.time()
+
+    def sendall(self, data: bytes):
+        self.socket.sendto(pack_status(self.session, data), self.address)
+        self.last_sent = time.time()
+
+    write = sendall
+
+    def silent(self, now=None) -> float:
+        # seconds since peer was last heard of
+        return (time.time() if now is None else now) - self.last_received
+
+    def shutdown(self, how):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,63 @@
+import struct
+import time
+from collections import OrderedDict, namedtuple
+
+
+#  selective retransmission
+#
+#  client sends a control datagram to the server data port listing the missing chunks of one frame
+#  version  u8   packet format version
+#  type     u8   control type, NACK = 1
+#  count    u16  number of indices
+#  sequence u32  frame sequence
+#  count x u16 missing chunk indices
+#  server answers with the listed chunks (flag RETRANSMIT) from a short-lived cache of sent frames.
+
+CONTROL = struct.Struct("!BBHI")
+NACK = 1
+# keeps one nack in a 1400 bytes datagram
+MAX_NACK_INDICES = 512
+
+CachedFrame = namedtuple("CachedFrame", ["sequence", "data", "timestamp", "count", "size", "sent"])
+
+
+def pack_nack(version: int, sequence: int, indices) -> bytes:
+    indices = indices[:MAX_NACK_INDICES]
+    return CONTROL.pack(version, NACK, len(indices), sequence) + struct.pack(f"!{len(indices)}H", *indices)
+
+
+def parse_nack(data):
+    """
+    :param data: control datagram
+    :return: sequence, indices or None if data is not a nack
+    """
+    if len(data) < CONTROL.size:
+        return None
+    version, control, count, sequence = CONTROL.unpack_from(data)
+    if control != NACK or len(data) < CONTROL.size + 2 * count:
+        return None
+    return sequence, list(struct.unpack_from(f"!{count}H", data, CONTROL.size))
+
+
+class FrameCache:
+    """
+    recently sent frames kept for retransmission, frames older than ttl seconds are too late to show
+    """
+    def __init__(self, max_frames=16, ttl=0.1):
+        self.max_frames = max_frames
+        self.ttl = ttl
+        self.frames = OrderedDict()
+
+    def add(self, sequence: int, data, timestamp: int, count: int, size: int):
+        self.frames[sequence] = CachedFrame(sequence, data, timestamp, count, size, time.time())
+        while len(self.frames) > self.max_frames:
+            self.frames.popitem(last=False)
+
+    def get(self, sequence: int, now=None):
+        frame = self.frames.get(sequence)
+        if frame is None or (time.time() if now is None else now) - frame.sent > self.ttl:
+            return None
+        return frame
+
+    def clear(self):
+        self.frames.clear()
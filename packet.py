@@ -0,0 +1,282 @@
+import errno
+import socket
+import struct
+import time
+from collections import namedtuple
+
+from fec import xor_parity
+
+
+#  binary UDP packet format
+#
+#  every datagram is a 24-byte header followed by one chunk of an encoded frame
+#  version    u8   packet format version
+#  flags      u8   packet flags
+#  length     u16  payload length of this datagram
+#  sequence   u32  frame sequence, increases by one per frame and wraps at 2**32
+#  index      u16  chunk index in frame
+#  count      u16  number of chunks in frame
+#  timestamp  u64  capture time in microseconds
+#  size       u32  frame size in bytes
+
+VERSION = 1
+# packet flags
+PARITY = 0x01
+RETRANSMIT = 0x02
+# stage durations of the frame, payload defined in latency.py
+TIMING = 0x04
+# no payload, scene has not changed since the last frame, sent instead of a frame
+UNCHANGED = 0x08
+HEADER = struct.Struct("!BBHIHHQI")
+HEADER_SIZE = HEADER.size
+# 1400 bytes datagrams fit the path MTU of most links (ethernet, pppoe, vpn)
+DEFAULT_PACK_SIZE = 1400
+MIN_PACK_SIZE = 256
+# larger datagrams are fragmented by IP, only sensible on a LAN or with jumbo frames
+MAX_PACK_SIZE = 65507
+# format used by peers that do not negotiate one, ascii trailer of CameraServer.slice_data_udp
+LEGACY_FORMAT = "legacy"
+LEGACY_PACK_SIZE = 1024
+
+# linux UDP generic segmentation offload, one sendmsg is split to many datagrams by the kernel
+SOL_UDP = getattr(socket, "SOL_UDP", 17)
+UDP_SEGMENT = getattr(socket, "UDP_SEGMENT", 103)
+# kernel limit of segments per sendmsg
+GSO_MAX_SEGMENTS = 64
+GSO_MAX_BYTES = 65000
+
+Header = namedtuple("Header", ["version", "flags", "length", "sequence", "index", "count", "timestamp", "size"])
+
+
+def timestamp_us(t=None) -> int:
+    return int((time.time() if t is None else t) * 1_000_000)
+
+
+def parse_format(spec: str = LEGACY_FORMAT):
+    """
+    parse packet format spec of the data handshake
+    :param spec: "legacy" or "v<version>[:<pack size>]", e.g. "v1:1400", "v1:8972"
+    :return: version (0 for legacy), pack size
+    """
+    if spec == LEGACY_FORMAT:
+        return 0, LEGACY_PACK_SIZE
+    version, _, pack_size = spec.partition(":")
+    if not version.startswith("v") or int(version[1:]) != VERSION:
+        raise ValueError(f"Unknown packet format {spec}.")
+    pack_size = int(pack_size) if pack_size else DEFAULT_PACK_SIZE
+    return VERSION, min(max(pack_size, MIN_PACK_SIZE), MAX_PACK_SIZE)
+
+
+def format_spec(version: int, pack_size: int) -> str:
+    return LEGACY_FORMAT if version == 0 else f"v{version}:{pack_size}"
+
+
+def parse_header(data) -> Header:
+    """
+    read the header of a received datagram
+    :param data: datagram
+    :return: Header
+    """
+    if len(data) < HEADER_SIZE:
+        raise ValueError("Packet too short.")
+    header = Header(*HEADER.unpack_from(data))
+    if header.version != VERSION:
+        raise ValueError(f"Unknown packet version {header.version}.")
+    return header
+
+
+class Packetizer:
+    """
+    slice encoded frames to datagrams of at most pack_size bytes with a binary header
+    """
+    def __init__(self, pack_size=DEFAULT_PACK_SIZE):
+        self.pack_size = pack_size
+        self.payload_size = pack_size - HEADER_SIZE
+        self.sequence = 0
+
+    def next_sequence(self) -> int:
+        sequence = self.sequence
+        self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+        return sequence
+
+    def chunk_count(self, size: int) -> int:
+        return max(1, -(-size // self.payload_size))
+
+    def packetize(self, data, timestamp=None, flags=0):
+        """
+        divide one frame to packets
+        :param data: encoded frame
+        :param timestamp: capture time in seconds, now if None
+        :param flags: packet flags
+        :return: packets
+        """
+        data = memoryview(data).cast("B")
+        size = len(data)
+        count = self.chunk_count(size)
+        if count > 0xFFFF:
+            raise ValueError(f"Frame of {size} bytes needs more than 65535 packets.")
+        sequence = self.next_sequence()
+        stamp = timestamp_us(timestamp)
+        packs = []
+        for index in range(count):
+            chunk = data[index * self.payload_size: (index + 1) * self.payload_size]
+            packs.append(HEADER.pack(VERSION, flags, len(chunk), sequence, index, count, stamp, size) + chunk)
+        return packs
+
+
+class PacketSender(Packetizer):
+    """
+    send frames without building a bytes object per packet.
+    payloads are memoryview slices of the encoded frame, headers are packed into preallocated buffers,
+    each packet is sent with sendmsg scatter-gather [header, payload]. on linux, up to 64 packets are
+    batched in one sendmsg with UDP_SEGMENT (GSO), falling back to one sendmsg per packet if refused.
+    if fec_group is set, an XOR parity packet follows every fec_group data packets.
+    if cache (nack.FrameCache) is set, sent frames are kept there so that resend can repeat lost chunks.
+    """
+    def __init__(self, sock: socket.socket, pack_size=DEFAULT_PACK_SIZE, gso=True, fec_group=0, cache=None):
+        super().__init__(pack_size)
+        self.socket = sock
+        self.fec_group = fec_group
+        self.cache = cache
+        self.headers = []
+        self.parity_headers = []
+        self.retransmit_headers = []
+        self.timing_header = bytearray(HEADER_SIZE)
+        self.unchanged_header = bytearray(HEADER_SIZE)
+        self.sendmsg = hasattr(sock, "sendmsg")
+        self.gso_batch = min(GSO_MAX_SEGMENTS, GSO_MAX_BYTES // pack_size)
+        self.gso = gso and self.sendmsg and self.gso_batch > 1
+        self.gso_option = [(SOL_UDP, UDP_SEGMENT, struct.pack("H", pack_size))]
+        # counters
+        self.packets = 0
+        self.syscalls = 0
+        self.retransmitted = 0
+
+    @staticmethod
+    def header_buffers(headers, count: int):
+        while len(headers) < count:
+            headers.append(bytearray(HEADER_SIZE))
+        return headers
+
+    def send(self, data, address, timestamp=None, flags=0) -> int:
+        """
+        packetize and send one frame
+        :param data: encoded frame, any bytes-like object
+        :param address: client address
+        :param timestamp: capture time in seconds, now if None
+        :param flags: packet flags
+        :return: bytes sent
+        """
+        data = memoryview(data).cast("B")
+        size = len(data)
+        count = self.chunk_count(size)
+        if count > 0xFFFF:
+            raise ValueError(f"Frame of {size} bytes needs more than 65535 packets.")
+        sequence = self.next_sequence()
+        stamp = timestamp_us(timestamp)
+        if self.cache is not None:
+            self.cache.add(sequence, data, stamp, count, size)
+        headers = self.header_buffers(self.headers, count)
+        buffers = []
+        for index in range(count):
+            chunk = data[index * self.payload_size: (index + 1) * self.payload_size]
+            HEADER.pack_into(headers[index], 0, VERSION, flags, len(chunk), sequence, index, count, stamp, size)
+            buffers.append(headers[index])
+            buffers.append(chunk)
+            if self.fec_group and index % self.fec_group == self.fec_group - 1 and index < count - 1:
+                buffers.extend(self.parity(data, sequence, index // self.fec_group, count, stamp, size, flags))
+        sent = self.send_buffers(buffers, address)
+        if self.fec_group:
+            # last chunk may be short, GSO only allows it at the end of a batch, so last parity goes alone
+            sent += self.send_buffers(self.parity(data, sequence, (count - 1) // self.fec_group, count, stamp, size, flags), address)
+        return sent
+
+    def resend(self, sequence: int, indices, address, flags=0) -> int:
+        """
+        send chunks of a cached frame again
+        :param sequence: frame sequence
+        :param indices: missing chunk indices
+        :param address: client address
+        :param flags: packet flags
+        :return: bytes sent, 0 if frame is no longer cached
+        """
+        frame = self.cache.get(sequence) if self.cache is not None else None
+        if frame is None:
+            return 0
+        # ascending order keeps the short last chunk at the end (GSO)
+        indices = sorted(index for index in set(indices) if index < frame.count)
+        headers = self.header_buffers(self.retransmit_headers, len(indices))
+        buffers = []
+        for header, index in zip(headers, indices):
+            chunk = frame.data[index * self.payload_size: (index + 1) * self.payload_size]
+            HEADER.pack_into(header, 0, VERSION, flags | RETRANSMIT, len(chunk), sequence, index, frame.count, frame.timestamp, frame.size)
+            buffers.append(header)
+            buffers.append(chunk)
+        self.retransmitted += len(indices)
+        return self.send_buffers(buffers, address)
+
+    def send_timing(self, payload, address, timestamp=None) -> int:
+        """
+        send stage durations of the last frame sent
+        :param payload: latency.pack_stages() data
+        :param address: client address
+        :param timestamp: capture time of the frame
+        :return: bytes sent
+        """
+        header = self.timing_header
+        HEADER.pack_into(header, 0, VERSION, TIMING, len(payload), (self.sequence - 1) & 0xFFFFFFFF, 0, 1, timestamp_us(timestamp), len(payload))
+        return self.send_buffers([header, payload], address)
+
+    def send_unchanged(self, address, timestamp=None) -> int:
+        """
+        tell client that the frame captured at timestamp shows nothing new, last frame sent is still current
+        :param address: client address
+        :param timestamp: capture time of the skipped frame
+        :return: bytes sent
+        """
+        header = self.unchanged_header
+        HEADER.pack_into(header, 0, VERSION, UNCHANGED, 0, (self.sequence - 1) & 0xFFFFFFFF, 0, 0, timestamp_us(timestamp), 0)
+        return self.send_buffers([header, b""], address)
+
+    def parity(self, data, sequence, group, count, stamp, size, flags):
+        """
+        build parity packet of one group
+        :return: header and payload buffers
+        """
+        header = self.header_buffers(self.parity_headers, group + 1)[group]
+        start = group * self.fec_group
+        chunks = [data[index * self.payload_size: (index + 1) * self.payload_size] for index in range(start, min(start + self.fec_group, count))]
+        HEADER.pack_into(header, 0, VERSION, flags | PARITY, self.payload_size, sequence, group, count, stamp, size)
+        return [header, xor_parity(chunks, self.payload_size)]
+
+    def send_buffers(self, buffers, address) -> int:
+        """
+        send packets given as a flat [header, payload, header, payload, ...] list
+        :param buffers: header and payload buffers
+        :param address: client address
+        :return: bytes sent
+        """
+        sent = 0
+        start = 0
+        while self.gso and start < len(buffers):
+            batch = buffers[start: start + 2 * self.gso_batch]
+            try:
+                sent += self.socket.sendmsg(batch, self.gso_option if len(batch) > 2 else [], 0, address)
+            except OSError as error:
+                if error.errno not in (errno.EINVAL, errno.EIO, errno.ENOPROTOOPT, errno.EOPNOTSUPP):
+                    raise
+                # kernel or interface does not support UDP_SEGMENT
+                print(f"UDP GSO unavailable ({error}), sending one packet per syscall.")
+                self.gso = False
+                break
+            self.syscalls += 1
+            self.packets += len(batch) // 2
+            start += len(batch)
+        for index in range(start, len(buffers), 2):
+            if self.sendmsg:
+                sent += self.socket.sendmsg(buffers[index: index + 2], [], 0, address)
+            else:
+                sent += self.socket.sendto(bytes(buffers[index]) + buffers[index + 1], address)
+            self.syscalls += 1
+            self.packets += 1
+        return sent
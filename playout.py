@@ -0,0 +1,145 @@
+import heapq
+import time
+from collections import deque
+
+
+class PlayoutBuffer:
+    """
+    jitter buffer between decoder and renderer, frames are shown at their capture timestamp plus an
+    adaptive delay instead of as soon as they are decoded.
+    transit of a frame is decode done (client clock) - capture timestamp (server clock), the clock offset
+    is the same for all frames and cancels out. base is the smallest transit of the last window seconds,
+    the jitter of a frame is its transit - base. the added delay follows the percentile of the jitter of
+    the last jitter_window seconds: it grows at once when frames come later, and shrinks step by step
+    (decay per frame) when the link calms down, within min_delay - max_delay. a burst of late frames, like
+    a delay spike, raises the delay only for a short time. a frame faster than all before starts the
+    history again, the frames before it were a draining backlog (stream start) not jitter. a frame is due at
+    timestamp + base + delay, with the estimate of the time it is looked at, so frames waiting are moved
+    along when it changes. when several frames are due only the newest is shown, older ones are dropped
+    as late, so latency stays bounded by base + delay. frames without timestamp (TCP, legacy packets)
+    are due when they arrive.
+    """
+    def __init__(self, release=None, min_delay=0.0, max_delay=0.25, percentile=95, window=5.0, jitter_window=1.0, decay=0.05):
+        """
+        :param release: called with the image of a dropped frame, see FrameDecoder.release
+        :param min_delay: seconds added at least
+        :param max_delay: seconds added at most, later frames are dropped rather than delay grows
+        :param percentile: 0 - 100, share of frames in time at the delay
+        :param window: seconds of transit history for base
+        :param jitter_window: seconds of transit history for delay
+        :param decay: part of the gap closed per frame when the delay shrinks
+        """
+        self.release = release
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.percentile = percentile
+        self.window = window
+        self.jitter_window = jitter_window
+        self.decay = decay
+        self.delay = min_delay
+        # (arrival, transit) of recent frames
+        self.transits = deque()
+        self.base = 0.0
+        # (timestamp, order, item) waiting to be shown, arrival for frames without timestamp
+        self.frames = []
+        self.order = 0
+        self.last_shown = None
+        # counters
+        self.received = 0
+        self.shown = 0
+        self.late = 0
+        self.waited = 0.0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def estimate(self, arrival: float, transit: float):
+        # update base and delay with the transit of one frame
+        if self.transits and transit < self.base - 0.001:
+            # faster than all frames before, those were a backlog draining (stream start) or a slower path
+            self.transits.clear()
+        self.transits.append((arrival, transit))
+        while self.transits[0][0] < arrival - self.window:
+            self.transits.popleft()
+        self.base = min(transit for _, transit in self.transits)
+        recent = sorted(transit for arrived, transit in self.transits if arrived >= arrival - self.jitter_window)
+        jitter = recent[min(int(len(recent) * self.percentile / 100), len(recent) - 1)] - self.base
+        target = min(max(jitter, self.min_delay), self.max_delay)
+        if target > self.delay:
+            self.delay = target
+        else:
+            self.delay += (target - self.delay) * self.decay
+
+    def put(self, frame, image, decode_time: float, arrival=None):
+        """
+        :param frame: reassembly.Frame, timestamp is the capture time on server clock or None
+        :param image: decoded image
+        :param decode_time: decode seconds
+        :param arrival: time frame was decoded, now if None
+        :return: None
+        """
+        arrival = time.time() if arrival is None else arrival
+        self.received += 1
+        if frame.timestamp is None:
+            timestamp = arrival
+        else:
+            if self.last_shown is not None and frame.timestamp < self.last_shown - self.window:
+                # server clock went back (restart), start over
+                self.transits.clear()
+                self.last_shown = None
+            if self.last_shown is not None and frame.timestamp <= self.last_shown:
+                # completed after a newer frame was shown
+                self.drop(image)
+                return
+            self.estimate(arrival, arrival - frame.timestamp)
+            timestamp = frame.timestamp
+        heapq.heappush(self.frames, (timestamp, self.order, (frame, image, decode_time, arrival)))
+        self.order += 1
+
+    def get(self, now=None):
+        """
+        :param now: render time, now if None
+        :return: newest due (Frame, image, decode seconds, seconds waited in buffer), None if no frame is due
+        """
+        now = time.time() if now is None else now
+        item = None
+        while self.frames and self.due(self.frames[0]) <= now:
+            if item is not None:
+                self.drop(item[1])
+            item = heapq.heappop(self.frames)[2]
+        if item is None:
+            return None
+        frame, image, decode_time, arrival = item
+        if frame.timestamp is not None:
+            self.last_shown = frame.timestamp
+        self.shown += 1
+        self.waited += now - arrival
+        return frame, image, decode_time, now - arrival
+
+    def next_due(self, now=None) -> float:
+        """
+        :param now: time, now if None
+        :return: seconds until the next frame is due, 0 if one is due, inf if buffer is empty
+        """
+        if not self.frames:
+            return float("inf")
+        return max(self.due(self.frames[0]) - (time.time() if now is None else now), 0.0)
+
+    def due(self, entry) -> float:
+        # playout time of a waiting frame
+        timestamp, _, (frame, _, _, _) = entry
+        return timestamp + self.base + self.delay if frame.timestamp is not None else timestamp
+
+    def drop(self, image):
+        self.late += 1
+        if self.release is not None:
+            self.release(image)
+
+    def clear(self):
+        # frames waiting are dropped, delay estimate is kept
+        while self.frames:
+            self.drop(heapq.heappop(self.frames)[2][1])
+        self.last_shown = None
+
+    def stats(self) -> str:
+        return f"Playout: delay {round(self.delay * 1000, 1)} ms waited {round(self.waited / max(self.shown, 1) * 1000, 1)} ms received {self.received} shown {self.shown} late {self.late} queued {len(self.frames)}"
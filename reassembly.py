@@ -0,0 +1,277 @@
+import time
+from collections import OrderedDict, namedtuple
+
+from fec import recover
+from packet import DEFAULT_PACK_SIZE, HEADER, HEADER_SIZE, PARITY, TIMING, UNCHANGED, VERSION
+
+
+# first_arrival, last_arrival: first and last packet of frame, delivered: left reassembler
+Frame = namedtuple("Frame", ["sequence", "timestamp", "data", "first_arrival", "last_arrival", "delivered"], defaults=(None, None, None))
+
+
+def sequence_before(a: int, b: int) -> bool:
+    # serial number arithmetic, True if frame a was sent before frame b
+    return a != b and (b - a) & 0xFFFFFFFF < 0x80000000
+
+
+class PartialFrame:
+    """
+    one frame being reassembled, chunks are written at their offset in a pooled bytearray
+    """
+    __slots__ = ("sequence", "count", "size", "timestamp", "buffer", "bitmap", "received", "arrival", "last_arrival", "last_packet", "nacks", "parities", "group_received")
+
+    def __init__(self, sequence, count, size, timestamp, buffer, arrival, fec_group=0):
+        self.sequence = sequence
+        self.count = count
+        self.size = size
+        self.timestamp = timestamp
+        self.buffer = buffer
+        # bit i is set when chunk i has arrived
+        self.bitmap = 0
+        self.received = 0
+        self.arrival = arrival
+        self.last_arrival = arrival
+        self.last_packet = arrival
+        # retransmission requests sent for this frame
+        self.nacks = 0
+        # fec parity payloads and received data chunks by group
+        self.parities = {}
+        self.group_received = [0] * -(-count // fec_group) if fec_group else None
+
+    def complete(self) -> bool:
+        return self.received == self.count
+
+    def missing(self):
+        return [index for index in range(self.count) if not self.bitmap >> index & 1]
+
+
+class FrameReassembler:
+    """
+    rebuild frames from binary packets with O(1) work per packet.
+    datagrams are received with recv_into a preallocated buffer and copied once to their offset in the
+    frame buffer. frame buffers come from a pool and are reused. several frames can be in flight, a frame
+    that is not complete within timeout seconds is expired, a frame completed after a newer one was
+    delivered is dropped as late. with fec_group, one lost chunk per group is rebuilt from its parity packet.
+    with hold, a completed frame waits up to hold seconds for older partial frames that may still be
+    repaired by retransmission, so frames are always delivered in order.
+    """
+    def __init__(self, pack_size=DEFAULT_PACK_SIZE, timeout=0.25, max_frames=16, fec_group=0, hold=0.0):
+        self.pack_size = pack_size
+        self.payload_size = pack_size - HEADER_SIZE
+        self.fec_group = fec_group
+        self.timeout = timeout
+        self.max_frames = max_frames
+        self.hold = hold
+        self.receive_buffer = bytearray(pack_size)
+        self.receive_view = memoryview(self.receive_buffer)
+        # frames in flight by sequence
+        self.frames = {}
+        # completed frames waiting for older ones, by sequence
+        self.ready = {}
+        self.pool = []
+        # payloads of timing packets by sequence, they arrive after their frame
+        self.timings = OrderedDict()
+        self.last_sequence = None
+        self.newest_sequence = None
+        self.last_expire = 0.0
+        # arrival of the last "scene unchanged" packet, server is alive and the last frame is current
+        self.last_unchanged = None
+        # counters
+        self.completed = 0
+        self.expired = 0
+        self.late = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.recovered = 0
+        self.unrecoverable = 0
+        self.unchanged = 0
+
+    def take_buffer(self, size: int) -> bytearray:
+        buffer = self.pool.pop() if self.pool else bytearray(size)
+        if len(buffer) < size:
+            buffer.extend(bytes(size - len(buffer)))
+        return buffer
+
+    def recycle(self, frame: PartialFrame):
+        self.pool.append(frame.buffer)
+
+    def receive(self, sock, now=None):
+        """
+        receive one datagram from socket
+        :param sock: udp socket
+        :param now: arrival time, time.time() if None
+        :return: list of Frame ready in order
+        """
+        length = sock.recv_into(self.receive_buffer)
+        return self.feed(self.receive_view[:length], now)
+
+    def feed(self, data, now=None):
+        """
+        add one datagram
+        :param data: datagram, bytes-like
+        :param now: arrival time, time.time() if None
+        :return: list of Frame ready in order
+        """
+        now = time.time() if now is None else now
+        if now - self.last_expire > min(self.timeout, self.hold or self.timeout) / 4:
+            self.expire(now)
+        self.add(data, now)
+        return self.release(now) if self.ready else []
+
+    def add(self, data, now: float):
+        if len(data) < HEADER_SIZE:
+            self.invalid += 1
+            return None
+        version, flags, length, sequence, index, count, timestamp, size = HEADER.unpack_from(data)
+        if flags & TIMING:
+            if version == VERSION and length <= len(data) - HEADER_SIZE:
+                self.timings[sequence] = bytes(data[HEADER_SIZE: HEADER_SIZE + length])
+                while len(self.timings) > 4 * self.max_frames:
+                    self.timings.popitem(last=False)
+            return None
+        if flags & UNCHANGED:
+            if version == VERSION:
+                self.unchanged += 1
+                self.last_unchanged = now
+            return None
+        parity = flags & PARITY
+        if parity and not self.fec_group:
+            return None
+        limit = -(-count // self.fec_group) if parity else count
+        if version != VERSION or index >= limit or length > len(data) - HEADER_SIZE or size > count * self.payload_size:
+            self.invalid += 1
+            return None
+        if self.last_sequence is not None and not sequence_before(self.last_sequence, sequence):
+            # frame is already delivered or older than a delivered one, parity of delivered frames is not needed
+            if not parity:
+                self.late += 1
+            return None
+        if sequence in self.ready:
+            if not parity:
+                self.duplicates += 1
+            return None
+        frame = self.frames.get(sequence)
+        if frame is None:
+            if len(self.frames) >= self.max_frames:
+                self.drop(min(self.frames.values(), key=lambda item: item.arrival))
+            frame = PartialFrame(sequence, count, size, timestamp, self.take_buffer(size), now, self.fec_group)
+            self.frames[sequence] = frame
+            if self.newest_sequence is None or sequence_before(self.newest_sequence, sequence):
+                self.newest_sequence = sequence
+        frame.last_arrival = now
+        frame.last_packet = now
+        if parity:
+            if index in frame.parities:
+                self.duplicates += 1
+                return None
+            frame.parities[index] = bytes(data[HEADER_SIZE: HEADER_SIZE + length])
+            self.recover(frame, index)
+        else:
+            if frame.bitmap >> index & 1:
+                self.duplicates += 1
+                return None
+            self.write(frame, index, data[HEADER_SIZE: HEADER_SIZE + length])
+            if self.fec_group:
+                self.recover(frame, index // self.fec_group)
+        if frame.complete():
+            self.complete(frame)
+
+    def write(self, frame: PartialFrame, index: int, chunk):
+        offset = index * self.payload_size
+        frame.buffer[offset: offset + len(chunk)] = chunk
+        frame.bitmap |= 1 << index
+        frame.received += 1
+        if self.fec_group:
+            frame.group_received[index // self.fec_group] += 1
+
+    def chunk_length(self, frame: PartialFrame, index: int) -> int:
+        return self.payload_size if index < frame.count - 1 else frame.size - index * self.payload_size
+
+    def group_range(self, frame: PartialFrame, group: int):
+        return range(group * self.fec_group, min((group + 1) * self.fec_group, frame.count))
+
+    def recover(self, frame: PartialFrame, group: int):
+        """
+        rebuild the missing chunk of a group if it is the only one and the parity has arrived
+        :return: None
+        """
+        members = self.group_range(frame, group)
+        if group not in frame.parities or frame.group_received[group] != len(members) - 1:
+            return
+        missing = next(index for index in members if not frame.bitmap >> index & 1)
+        others = [frame.buffer[index * self.payload_size: index * self.payload_size + self.chunk_length(frame, index)] for index in members if index != missing]
+        self.write(frame, missing, recover(frame.parities[group], others, self.chunk_length(frame, missing)))
+        self.recovered += 1
+
+    def missing_chunks(self, now=None, delay=0.01, deadline=None, max_nacks=2):
+        """
+        find partial frames worth a retransmission request.
+        a frame qualifies when a newer frame has started or nothing arrived for it within delay seconds,
+        and it is younger than deadline seconds (hold by default). every frame is asked at most max_nacks times.
+        :return: list of (sequence, missing indices)
+        """
+        now = time.time() if now is None else now
+        deadline = deadline if deadline is not None else (self.hold or self.timeout)
+        requests = []
+        for frame in self.frames.values():
+            if frame.nacks >= max_nacks or now - frame.arrival > deadline:
+                continue
+            if now - frame.last_arrival < delay and frame.sequence == self.newest_sequence:
+                continue
+            if frame.nacks and now - frame.last_arrival < delay:
+                # previous request may still be answered
+                continue
+            frame.nacks += 1
+            frame.last_arrival = now
+            requests.append((frame.sequence, frame.missing()))
+        return requests
+
+    def complete(self, frame: PartialFrame):
+        del self.frames[frame.sequence]
+        self.completed += 1
+        self.ready[frame.sequence] = Frame(frame.sequence, frame.timestamp / 1_000_000, bytes(memoryview(frame.buffer)[:frame.size]), frame.arrival, frame.last_packet)
+        self.recycle(frame)
+
+    def waiting(self, sequence: int, now: float) -> bool:
+        # True if an older partial frame may still be repaired in time
+        return any(sequence_before(frame.sequence, sequence) and now - frame.arrival <= self.hold for frame in self.frames.values())
+
+    def release(self, now: float):
+        """
+        deliver completed frames in sequence order
+        :return: list of Frame
+        """
+        delivered = []
+        base = self.last_sequence if self.last_sequence is not None else min(self.ready)
+        for sequence in sorted(self.ready, key=lambda item: (item - base) & 0xFFFFFFFF):
+            if self.hold and self.waiting(sequence, now):
+                break
+            delivered.append(self.ready.pop(sequence)._replace(delivered=now))
+            self.last_sequence = sequence
+            # partial frames older than the delivered one would be shown out of order
+            for older in [older for older in self.frames if sequence_before(older, sequence)]:
+                self.drop(self.frames[older])
+        return delivered
+
+    def timing(self, sequence: int):
+        """
+        :param sequence: frame sequence
+        :return: timing payload of frame, None if it has not arrived
+        """
+        return self.timings.pop(sequence, None)
+
+    def drop(self, frame: PartialFrame):
+        del self.frames[frame.sequence]
+        self.expired += 1
+        if self.fec_group:
+            self.unrecoverable += sum(received < len(self.group_range(frame, group)) for group, received in enumerate(frame.group_received))
+        self.recycle(frame)
+
+    def expire(self, now: float):
+        self.last_expire = now
+        for frame in [frame for frame in self.frames.values() if now - frame.arrival > self.timeout]:
+            self.drop(frame)
+
+    def stats(self) -> str:
+        return f"Reassembly: completed {self.completed} expired {self.expired} late {self.late} duplicates {self.duplicates} invalid {self.invalid} unchanged {self.unchanged} in-flight {len(self.frames)}" + (
+            f" FEC: recovered {self.recovered} unrecoverable groups {self.unrecoverable}" if self.fec_group else "")
@@ -0,0 +1,326 @@
+import mmap
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+import cv2
+
+from frame_queue import FrameQueue
+
+
+#  on-disk recording of the encoded stream
+#
+#  frames are appended to segment files "<start ms>.mjpeg" (concatenated jpeg data) next to an index
+#  "<start ms>.idx" of one entry per frame: offset u64, length u32, capture timestamp f64, big endian.
+#  a new segment is started every segment_seconds of capture time, segments older than retention_seconds
+#  are deleted. an index entry is written after its frame data, so a segment being written is always readable
+#  up to its last index entry.
+
+SEGMENT_SUFFIX = ".mjpeg"
+INDEX_SUFFIX = ".idx"
+INDEX_STRUCT = struct.Struct("!QId")
+INDEX_DTYPE = np.dtype([("offset", ">u8"), ("length", ">u4"), ("timestamp", ">f8")])
+
+
+def list_segments(directory: str):
+    """
+    :param directory: recording directory
+    :return: [(start timestamp, segment path, index path)] oldest first
+    """
+    segments = []
+    for name in os.listdir(directory):
+        stem, suffix = os.path.splitext(name)
+        if suffix == SEGMENT_SUFFIX and stem.isdigit():
+            segments.append((int(stem) / 1000, os.path.join(directory, name), os.path.join(directory, stem + INDEX_SUFFIX)))
+    return sorted(segments)
+
+
+class Recorder:
+    """
+    records encoded frames in the background. CameraServer hands it the frames it encoded for clients
+    like to a subscriber, put never blocks: frames wait in a bounded queue for the writer thread and the
+    oldest are dropped if the disk falls behind.
+    """
+    def __init__(self, directory="recordings", segment_seconds=60.0, retention_seconds=3600.0, quality=90, maxsize=60):
+        """
+        :param directory: where segments are written, created if missing
+        :param segment_seconds: capture time covered by one segment
+        :param retention_seconds: segments ending longer ago are deleted, None keeps everything
+        :param quality: jpeg quality when frames have to be encoded, full size frames of the same quality are shared with clients
+        :param maxsize: frames waiting for the writer
+        """
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.retention_seconds = retention_seconds
+        self.quality = quality
+        os.makedirs(self.directory, exist_ok=True)
+        self.queue = FrameQueue(maxsize=maxsize, policy="drop_oldest", name="RecordQueue")
+        # segment being written
+        self.segment = None
+        self.index = None
+        self.segment_start = 0.0
+        self.offset = 0
+        # counters
+        self.written = 0
+        self.written_bytes = 0
+        self.segments = 0
+        self.deleted = 0
+        self.writer = threading.Thread(target=self.write, name="Recorder")
+        self.writer.daemon = True
+        self.writer.start()
+
+    def __repr__(self):
+        return f"<Recorder {self.directory}>"
+
+    @property
+    def setting(self):
+        # encode setting of recorded frames: full size, no re-encoding of camera jpeg
+        return self.quality, 1.0, False
+
+    def put(self, timestamp: float, jpeg, stages=None) -> bool:
+        """
+        queue an encoded frame for writing, never blocks
+        :param timestamp: capture time
+        :param jpeg: 1-d uint8 array or bytes of jpeg data, None if the scene has not changed (not recorded)
+        :param stages: stage durations, not recorded
+        :return: True if an older frame was dropped
+        """
+        if jpeg is None:
+            # playback holds the last frame until the next one is due
+            return False
+        return self.queue.put((timestamp, jpeg, stages))
+
+    def write(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                # queue is closed
+                break
+            timestamp, jpeg, _ = item
+            try:
+                self.append(timestamp, jpeg)
+            except OSError as error:
+                print(f"Recorder: Frame not written ({error})")
+        self.close_segment()
+
+    def append(self, timestamp: float, jpeg):
+        if self.segment is None or timestamp - self.segment_start >= self.segment_seconds:
+            self.rotate(timestamp)
+        data = memoryview(jpeg).cast("B")
+        self.segment.write(data)
+        self.segment.flush()
+        self.index.write(INDEX_STRUCT.pack(self.offset, len(data), timestamp))
+        self.index.flush()
+        self.offset += len(data)
+        self.written += 1
+        self.written_bytes += len(data)
+
+    def rotate(self, timestamp: float):
+        self.close_segment()
+        stem = str(int(timestamp * 1000))
+        self.segment = open(os.path.join(self.directory, stem + SEGMENT_SUFFIX), "ab")
+        self.index = open(os.path.join(self.directory, stem + INDEX_SUFFIX), "ab")
+        self.segment_start = timestamp
+        self.offset = self.segment.tell()
+        self.segments += 1
+        self.remove_expired(timestamp)
+
+    def close_segment(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.index.close()
+            self.segment = self.index = None
+
+    def remove_expired(self, now: float):
+        # a segment ends where the next one starts, the newest one is being written
+        if self.retention_seconds is None:
+            return
+        segments = list_segments(self.directory)
+        for (_, segment, index), (end, _, _) in zip(segments, segments[1:]):
+            if end < now - self.retention_seconds:
+                for path in (segment, index):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                self.deleted += 1
+
+    def close(self):
+        # frames already queued are written first
+        self.queue.close()
+        self.writer.join()
+
+    def stats(self) -> str:
+        return f"Recorder: written {self.written} ({round(self.written_bytes / 1024 / 1024, 2)} MB) segments {self.segments} deleted {self.deleted} {self.queue.stats()}"
+
+
+class Player:
+    """
+    read access to a recording. segments are memory mapped, frames are returned as numpy views of the
+    mapping without copying, seeking to a timestamp is a binary search of the index.
+    """
+    def __init__(self, directory="recordings"):
+        self.directory = directory
+        self.maps = []
+        # per frame, all segments in order
+        self.timestamps = np.empty(0, dtype=np.float64)
+        self.segment_of = np.empty(0, dtype=np.int32)
+        self.offsets = np.empty(0, dtype=np.int64)
+        self.lengths = np.empty(0, dtype=np.int64)
+        self.load()
+
+    def load(self):
+        """
+        (re)open all segments, picks up frames recorded since the last load
+        :return: None
+        """
+        self.close()
+        indexes = []
+        for start, segment, index in list_segments(self.directory):
+            try:
+                with open(index, "rb") as f:
+                    data = f.read()
+                with open(segment, "rb") as f:
+                    size = os.fstat(f.fileno()).st_size
+                    if not size:
+                        continue
+                    mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except FileNotFoundError:
+                # deleted by retention meanwhile
+                continue
+            # an entry being written is not complete yet
+            entries = np.frombuffer(data, dtype=INDEX_DTYPE, count=len(data) // INDEX_DTYPE.itemsize)
+            entries = entries[entries["offset"] + entries["length"] <= size]
+            indexes.append((len(self.maps), entries))
+            self.maps.append(mapping)
+        if not indexes:
+            return
+        self.timestamps = np.concatenate([entries["timestamp"].astype(np.float64) for _, entries in indexes])
+        self.segment_of = np.concatenate([np.full(len(entries), number, dtype=np.int32) for number, entries in indexes])
+        self.offsets = np.concatenate([entries["offset"].astype(np.int64) for _, entries in indexes])
+        self.lengths = np.concatenate([entries["length"].astype(np.int64) for _, entries in indexes])
+        # segments are in capture order, keep lookups valid if a clock jump broke that
+        if np.any(np.diff(self.timestamps) < 0):
+            order = np.argsort(self.timestamps, kind="stable")
+            self.timestamps, self.segment_of = self.timestamps[order], self.segment_of[order]
+            self.offsets, self.lengths = self.offsets[order], self.lengths[order]
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def start(self) -> float:
+        return float(self.timestamps[0]) if len(self) else 0.0
+
+    @property
+    def end(self) -> float:
+        return float(self.timestamps[-1]) if len(self) else 0.0
+
+    def seek(self, timestamp: float) -> int:
+        """
+        :param timestamp: capture time
+        :return: position of the first frame captured at or after timestamp, last frame if there is none
+        """
+        if not len(self):
+            raise IndexError("Recording is empty.")
+        return min(int(np.searchsorted(self.timestamps, timestamp)), len(self) - 1)
+
+    def frame(self, position: int):
+        """
+        :param position: 0 - len(self) - 1
+        :return: capture timestamp, 1-d uint8 view of the jpeg data in the mapped segment
+        """
+        mapping = self.maps[self.segment_of[position]]
+        return float(self.timestamps[position]), np.frombuffer(mapping, dtype=np.uint8, count=int(self.lengths[position]), offset=int(self.offsets[position]))
+
+    def frame_at(self, timestamp: float):
+        return self.frame(self.seek(timestamp))
+
+    def close(self):
+        for mapping in self.maps:
+            try:
+                mapping.close()
+            except BufferError:
+                # frames returned earlier still use it, unmapped once they are gone
+                pass
+        self.maps = []
+
+
+class PlaybackCamera:
+    """
+    cv2.VideoCapture-like source playing a recording, for CameraServer(source=lambda: PlaybackCamera(...)).
+    frames are paced by their recorded timestamps. with CAP_PROP_CONVERT_RGB off they are delivered as
+    jpeg buffers straight from the mapping, like an MJPEG camera, so passthrough streams them without copying.
+    width, height and frame rate are those of the recording and can not be changed.
+    """
+    def __init__(self, directory="recordings", start=None, speed=1.0, loop=True):
+        """
+        :param directory: recording directory
+        :param start: capture timestamp to start from, beginning of the recording if None
+        :param speed: playback speed factor
+        :param loop: start again at the end, otherwise read fails at the end
+        """
+        self.player = Player(directory)
+        self.speed = speed
+        self.loop = loop
+        self.convert_rgb = True
+        self.opened = len(self.player) > 0
+        self.position = self.player.seek(start) if self.opened and start is not None else 0
+        # wall clock time the frame at position is due
+        self.anchor = None
+        self.shape = cv2.imdecode(self.player.frame(self.position)[1], cv2.IMREAD_COLOR).shape if self.opened else (0, 0, 3)
+
+    def isOpened(self) -> bool:
+        return self.opened
+
+    def set(self, prop, value) -> bool:
+        if prop == cv2.CAP_PROP_CONVERT_RGB:
+            self.convert_rgb = bool(value)
+            return True
+        return False
+
+    def get(self, prop) -> float:
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.shape[1])
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.shape[0])
+        if prop == cv2.CAP_PROP_FPS:
+            duration = self.player.end - self.player.start
+            return (len(self.player) - 1) / duration * self.speed if duration > 0 else 0.0
+        if prop == cv2.CAP_PROP_CONVERT_RGB:
+            return float(self.convert_rgb)
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return self.player.timestamps[self.position] * 1000 if self.opened else 0.0
+        return 0.0
+
+    def pace(self, timestamp: float):
+        now = time.time()
+        if self.anchor is None:
+            self.anchor = (now, timestamp)
+        due = self.anchor[0] + (timestamp - self.anchor[1]) / self.speed
+        if due > now:
+            time.sleep(due - now)
+        elif now - due > 1.0:
+            # reader stalled, do not rush to catch up
+            self.anchor = (now, timestamp)
+
+    def read(self):
+        if not self.opened:
+            return False, None
+        if self.position >= len(self.player):
+            if not self.loop:
+                return False, None
+            self.position = 0
+            self.anchor = None
+        timestamp, jpeg = self.player.frame(self.position)
+        self.position += 1
+        self.pace(timestamp)
+        if not self.convert_rgb:
+            return True, jpeg.reshape(1, -1)
+        return True, cv2.imdecode(jpeg, cv2.IMREAD_COLOR)
+
+    def release(self):
+        self.opened = False
+        self.player.close()
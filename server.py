@@ -1,33 +1,111 @@
+import json
+import secrets
 import socket
+import struct
 import sys
 import threading
 import time
-import traceback
 
-import numpy as np
 import cv2
 from zlib import compress, decompress
 
-from cloud_platform import CloudPlatform
+from camera_profile import CameraProfile, is_jpeg, open_device, set_mode
+from change_detector import ChangeDetector
+from encoder_pool import EncoderPool
+from layers import DEFAULT_LAYERS, LAYERS, FramePyramid, fit_layer, parse_layers
+from frame_queue import FrameQueue
+from mux import MuxLink, asks_mux, is_status, unpack_status
+from status import ANGLES, BYE, KEEPALIVE, KEEPALIVE_INTERVAL, LINK, NAMES, SETTINGS, STATS, STATUS_TIMEOUT, SYNC, SYNC_REQUEST_STRUCT, MessageReader, is_binary, pack_angles, pack_json, pack_message, pack_sync_reply, unpack_angles, unpack_json
+from subscriber import LINK_TIMEOUT, Subscriber, hello_link, parse_hello
+
+try:
+    from cloud_platform import CloudPlatform
+except ImportError:
+    # gpiozero or pigpio is missing, a platform has to be given to CameraServer
+    CloudPlatform = None
 
 
 class CameraServer:
-    def __init__(self, fps=60, width=400, height=400, host="172.25.25.30", data_port=8004, status_port=8005):
-        self.buffer = []
+    def __init__(self, fps=60, width=400, height=400, host="172.25.25.30", data_port=8004, status_port=8005, passthrough=True, encode_workers=3,
+                 server_type="UDP", source=None, platform=None, recorder=None, bus=None, skip_static=True, refresh_interval=2.0, change_threshold=10,
+                 layers=DEFAULT_LAYERS, profile=None, idle_timeout=30.0, idle_fps=2.0, resume_timeout=30.0):
+        """
+        :param source: callable returning a cv2.VideoCapture-like camera, camera 0 if None
+        :param platform: callable taking camera angles, CloudPlatform if None
+        :param recorder: recorder.Recorder writing the streamed frames to disk while clients are connected, None for no recording
+        :param bus: framebus.FrameBus publishing frames to local processes, streams while one of them reads, None for no bus
+        :param skip_static: frames showing nothing new are not encoded, clients get a tiny keepalive instead
+        :param refresh_interval: seconds between frames sent while the scene does not change
+        :param change_threshold: luma difference of a changed cell, see ChangeDetector
+        :param layers: simulcast layers offered to clients, see layers.py
+        :param profile: camera_profile.CameraProfile or its path, the saved profile of camera 0 if None (see camera_profile.py)
+        :param idle_timeout: seconds the camera stays open after the last client has left, 0 closes it at once
+        :param idle_fps: frames read per second while the camera is idle, keeps exposure and white balance settled
+        :param resume_timeout: seconds a client can come back with its session token and continue its session
+        """
+        # captured frames waiting for encode and send, only the newest 2 are kept
+        self.buffer = FrameQueue(maxsize=2, policy="drop_oldest", name="CaptureQueue")
 
-        self.server_type = "UDP"
+        self.server_type = server_type
         # camera angles X and Y axis
         self.camera_angles = [0.0, 0.0]
-        self.platform = CloudPlatform()
+        if platform is None and CloudPlatform is None:
+            raise RuntimeError("CloudPlatform needs gpiozero and pigpio, give a platform instead.")
+        self.platform = platform if platform is not None else CloudPlatform()
+        # angles the platform really stands at, told to clients. a platform with a motion planner
+        # reports them through on_move while it moves, other platforms are there at once
+        self.platform_angles = list(self.camera_angles)
+        if hasattr(self.platform, "on_move"):
+            self.platform.on_move = self.platform_moved
         self.platform(self.camera_angles)
         time.sleep(1)
         print("Platform Ready.")
 
-        self.status_changed = False
-
         self.fps = fps
+        # capture size, size of the largest layer
         self.width = width
         self.height = height
+        # every frame is scaled to the layers clients have chosen, once per layer
+        self.layers = parse_layers(layers)
+        # send the camera's own MJPEG bytes instead of decoding and re-encoding every frame
+        self.passthrough = passthrough
+        # set by init_camera when the device really delivers jpeg buffers
+        self.jpeg_passthrough = False
+        self.source = source
+        # modes the camera really delivers, measured by camera_profile.py. without one the mode is set blindly
+        if isinstance(profile, str):
+            profile = CameraProfile.load(profile)
+        elif profile is None and source is None:
+            profile = CameraProfile.find(0)
+        self.profile = profile
+        # mode chosen from profile by init_camera
+        self.mode = None
+        # clients, every frame is encoded once per distinct setting and sent to all of them
+        self.subscribers = []
+        self.subscribers_lock = threading.Lock()
+        self.subscriber_count = 0
+        # jpeg encoding on several cores, frames come out in capture order
+        self.encoder = EncoderPool(self.encode_job, workers=encode_workers)
+        # gets every frame like a subscriber, writes never hold up sending
+        self.recorder = recorder
+        # shared memory rings for local readers, captured frames are published before change detection
+        self.bus = bus
+        # compares captured frames to the last one sent, between capture and encode
+        self.detector = ChangeDetector(threshold=change_threshold, refresh_interval=refresh_interval) if skip_static else None
+        # camera stays open between sessions, a new session streams at once instead of opening the device again
+        self.idle_timeout = idle_timeout
+        self.idle_fps = idle_fps
+        # set when a session starts, wake up the stream service and the idle camera
+        self.stream_wakeup = threading.Event()
+        self.camera_wakeup = threading.Event()
+        # set by the stream service to end its stages, they do not stop on their own when the last client
+        # leaves, the next one may be joining at once
+        self.stream_stopped = threading.Event()
+        # a frame grabbed by flush_camera, read_frame retrieves it
+        self.grabbed = False
+        # sessions of clients that have left, token -> (time left, Subscriber)
+        self.resume_timeout = resume_timeout
+        self.suspended = {}
         # init camera
         self.camera = None
         self.test_camera()
@@ -40,40 +118,103 @@ class CameraServer:
         self.status_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.status_server.bind((self.host, self.status_port))
         self.status_server.listen()
-        self.status_socket = None
         # data server
         if self.server_type == "TCP":
             self.data_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.data_server.bind((self.host, self.data_port))
             self.data_server.listen()
-            self.data_socket = None
         elif self.server_type == "UDP":
             self.data_server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             self.data_server.bind((self.host, self.data_port))
-            self.data_socket = None
-            self.address = None
             # measurement
         self.data_socket_bytes_flux = 0
         self.status_socket_bytes_flux = 0
+        # data bytes/s of last measurement
+        self.data_rate = 0.0
         # controllers
         self.server_should_close = False
         self.count = 0
 
     def init_camera(self):
-        if sys.platform == 'linux':
-            self.camera = cv2.VideoCapture(0, cv2.CAP_V4L2)  # direct show  CAP_DSHOW
-        else:
-            self.camera = cv2.VideoCapture(0, cv2.CAP_DSHOW)  # direct show  CAP_DSHOW
+        self.camera = self.open_camera()
         if self.camera.isOpened():
             print("Camera is Online.")
         else:
             print("Camera Error!")
 
-        self.camera.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter.fourcc('M', 'J', 'P', 'G'))
-        self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)  # width
-        self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)  # height
-        self.camera.set(cv2.CAP_PROP_FPS, self.fps)  # FPS
+        self.mode = self.profile.choose(self.width, self.height, self.fps, self.passthrough) if self.profile is not None else None
+        if self.mode is not None:
+            self.apply_mode(self.mode)
+        else:
+            set_mode(self.camera, "MJPG", self.width, self.height, self.fps)
         print(f"Camera FPS: {self.camera.get(cv2.CAP_PROP_FPS)} Width: {self.camera.get(cv2.CAP_PROP_FRAME_WIDTH)} Height: {self.camera.get(cv2.CAP_PROP_FRAME_HEIGHT)}.")
+        self.init_passthrough()
+
+    def open_camera(self):
+        if self.source is not None:
+            return self.source()
+        return open_device(0)
+
+    def apply_mode(self, mode: dict):
+        """
+        set a profiled mode, every property is known to be accepted
+        :param mode: mode of self.profile
+        :return: None
+        """
+        set_mode(self.camera, mode["fourcc"], mode["width"], mode["height"], mode["fps"])
+        if (mode["width"], mode["height"]) != (self.width, self.height):
+            # camera has no mode of the asked size, layers are scaled from the mode size
+            print(f"No {self.width}x{self.height} mode in camera profile, capturing {mode['width']}x{mode['height']}.")
+            self.width, self.height = mode["width"], mode["height"]
+        print(f"Camera mode {mode['fourcc'] or '-'} {mode['width']}x{mode['height']}@{mode['fps']:g} measured {mode['measured_fps']} fps latency {mode['latency_ms']} ms.")
+
+    def init_passthrough(self):
+        """
+        ask the driver for raw V4L2 buffers and keep them only if they are jpeg,
+        otherwise fall back to the BGR decode and imencode path
+        :return: None
+        """
+        self.jpeg_passthrough = False
+        if not self.passthrough:
+            return
+        if self.mode is not None:
+            # profile knows if the mode delivers jpeg, no trial read
+            if self.mode["jpeg"] and self.camera.set(cv2.CAP_PROP_CONVERT_RGB, 0):
+                self.jpeg_passthrough = True
+                print("Camera MJPEG passthrough enabled.")
+            else:
+                print("Camera MJPEG passthrough unavailable, encoding frames.")
+            return
+        if self.camera.set(cv2.CAP_PROP_CONVERT_RGB, 0):
+            ret, frame = self.camera.read()
+            if ret and self.is_jpeg(frame):
+                self.jpeg_passthrough = True
+                print("Camera MJPEG passthrough enabled.")
+                return
+        # device can not supply compressed frames
+        self.camera.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+        print("Camera MJPEG passthrough unavailable, encoding frames.")
+
+    is_jpeg = staticmethod(is_jpeg)
+
+    @staticmethod
+    def encode_frame(frame, quality=95, scale=1.0, reencode=False, pyramid=None):
+        """
+        turn a captured frame to jpeg data, passthrough frames are returned as they are
+        :param frame: BGR image or raw jpeg buffer
+        :param quality: jpeg quality used when encoding is needed
+        :param scale: resize factor used when encoding is needed
+        :param reencode: decode passthrough frames to apply quality and scale
+        :param pyramid: FramePyramid of frame shared by all encodes of the frame, a new one if None
+        :return: 1-d uint8 array of jpeg data, None if a jpeg buffer can not be decoded
+        """
+        if frame.ndim != 3 and not reencode:
+            # raw jpeg buffer from camera, no copy
+            return frame.reshape(-1)
+        image = (pyramid or FramePyramid(frame)).image(scale)
+        if image is None:
+            return None
+        return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].reshape(-1)
 
     def close_camera(self):
         if self.camera:
@@ -83,27 +224,157 @@ class CameraServer:
         else:
             pass
 
-    def reset(self, trigger=None):
-        print(f"Reset all connections. <Trigger: {trigger}>")
-        self.status_socket = None
-        if self.server_type == "TCP":
-            self.data_socket = None
-        elif self.server_type == "UDP":
-            # self.data_server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            # self.data_server.bind((self.host, self.data_port))
-            self.data_socket = None
+    def stop_camera(self):
+        # camera has been idle for idle_timeout, release it and park the platform
+        self.close_camera()
         self.camera_angles = [0.0, 0.0]
         self.platform(self.camera_angles)
-        self.close_camera()
-        self.buffer = []
+
+    def idle_read(self):
+        # frames are grabbed but not decoded, the sensor keeps running
+        grab = getattr(self.camera, "grab", None)
+        if grab is not None:
+            grab()
+        else:
+            self.camera.read()
+
+    def flush_camera(self):
+        """
+        drop the frames the driver buffered while the camera was idle, they are up to a few idle intervals old.
+        grabs until one waits for the sensor, that fresh frame is the next one read_frame returns
+        :return: None
+        """
+        if not hasattr(self.camera, "grab"):
+            return
+        interval = 1 / max(self.fps, 1)
+        # V4L2 keeps 4 buffers by default
+        for _ in range(8):
+            start = time.time()
+            if not self.camera.grab():
+                return
+            if time.time() - start >= interval / 2:
+                self.grabbed = True
+                return
+
+    def reset(self, trigger=None):
+        # last subscriber has left, stop streaming. camera stays open for idle_timeout, see stream
+        print(f"Reset stream. <Trigger: {trigger}>")
+        print(self.buffer.stats())
+        print(self.encoder.stats())
+        if self.recorder is not None:
+            print(self.recorder.stats())
+        if self.bus is not None:
+            print(self.bus.stats())
+        if self.detector is not None:
+            print(self.detector.stats())
+            self.detector.force()
+        self.buffer.clear()
+        self.encoder.clear()
         print(self.count)
         self.count = 0
 
+    def streaming(self) -> bool:
+        # camera runs while a client is connected or a local process reads the frame bus
+        return bool(self.ready_subscribers()) or (self.bus is not None and self.bus.active())
+
+    def ready_subscribers(self):
+        with self.subscribers_lock:
+            return [subscriber for subscriber in self.subscribers if subscriber.ready]
+
+    def find_subscriber(self, host: str, missing: str, link=None):
+        """
+        find the subscriber of a host still waiting for its status or data link, or register a new one.
+        a data link carrying a link token joins the status link the token was given on. links of clients
+        that do not ask for one are paired by ip, first come first served: two such clients behind one
+        address connecting at the same time may get each other's links.
+        :param host: client ip
+        :param missing: "status_socket" or "data_socket", None registers a new one (single port session)
+        :param link: link token of the data greeting, see Subscriber.link_token
+        :return: Subscriber
+        """
+        with self.subscribers_lock:
+            for subscriber in self.subscribers:
+                if missing and subscriber.host == host and getattr(subscriber, missing) is None and not subscriber.closed \
+                        and subscriber.link_token == link:
+                    return subscriber
+            self.subscriber_count += 1
+            subscriber = Subscriber(self.subscriber_count, host, self.server_type, self.fps)
+            self.subscribers.append(subscriber)
+        self.start_subscriber(subscriber)
+        return subscriber
+
+    def start_subscriber(self, subscriber: Subscriber):
+        serve = threading.Thread(target=self.serve_subscriber, args=(subscriber,))
+        serve.daemon = True
+        serve.start()
+
+    def serve_subscriber(self, subscriber: Subscriber):
+        # wait for both links, send while they are alive, then remove subscriber
+        while not subscriber.ready and not subscriber.closed:
+            if self.link_expired(subscriber):
+                subscriber.close()
+                break
+            # woken up as soon as the other link is attached
+            subscriber.linked.wait(max(subscriber.created + LINK_TIMEOUT - time.time(), 0.1))
+            subscriber.linked.clear()
+        if subscriber.ready:
+            print(f"{subscriber} joined.")
+            self.stream_wakeup.set()
+            self.camera_wakeup.set()
+            self.refresh()
+            send_data = threading.Thread(target=subscriber.send_data)
+            send_data.daemon = True
+            send_data.start()
+        while subscriber.ready:
+            time.sleep(1)
+            if subscriber.mux:
+                self.check_session(subscriber)
+        self.remove_subscriber(subscriber)
+
+    @staticmethod
+    def link_expired(subscriber: Subscriber) -> bool:
+        # client opened one link and never the other
+        if not subscriber.ready and not subscriber.closed and time.time() - subscriber.created > LINK_TIMEOUT:
+            print(f"{subscriber}: Second link did not come within {LINK_TIMEOUT} s.")
+            return True
+        return False
+
+    def remove_subscriber(self, subscriber: Subscriber):
+        subscriber.close()
+        with self.subscribers_lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+            if subscriber.controller:
+                # oldest remaining client takes over the platform
+                for other in self.subscribers:
+                    if other.status_socket and not other.closed:
+                        other.controller = True
+                        other.settings_changed = True
+                        self.notify_status(other)
+                        print(f"{other} is the controller now.")
+                        break
+            self.purge_sessions()
+            if subscriber.token and subscriber.width and self.resume_timeout > 0:
+                # kept for the client to come back with its token, frames it was sent are not
+                subscriber.chunk_cache.clear()
+                subscriber.queue.clear()
+                self.suspended[subscriber.token] = (time.time(), subscriber)
+        print(f"{subscriber} left. <Sent: {subscriber.count} {subscriber.queue.stats()}>")
+
+    def assign_controller(self, subscriber: Subscriber):
+        with self.subscribers_lock:
+            if not any(other.controller for other in self.subscribers):
+                subscriber.controller = True
+                subscriber.settings_changed = True
+                print(f"{subscriber} is the controller.")
+        self.notify_status(subscriber)
+
     def test_camera(self):
-        if sys.platform == 'linux':
-            self.camera = cv2.VideoCapture(0, cv2.CAP_V4L2)  # direct show  CAP_DSHOW
-        else:
-            self.camera = cv2.VideoCapture(0, cv2.CAP_DSHOW)  # direct show  CAP_DSHOW
+        if self.profile is not None:
+            # device has been probed, opening it twice at startup is not needed
+            print(f"Camera profile {self.profile.device}: {len(self.profile.modes)} modes.")
+            return
+        self.camera = self.open_camera()
         if self.camera.isOpened():
             print("Camera Test Pass")
             self.camera.release()
@@ -114,189 +385,562 @@ class CameraServer:
             self.camera = None
             raise Exception("Camera Unable to Initialize.")
 
-    def send_status(self):
-        # send "ServerReady" if server is ready
-        while self.status_socket:
+    def open_session(self, subscriber: Subscriber):
+        # single port session, status goes through the data port (see mux.py)
+        subscriber.status_socket = MuxLink(self.data_server, subscriber.address, subscriber.token)
+        subscriber.binary_status = True
+        subscriber.linked.set()
+        self.assign_controller(subscriber)
+        self.start_status(subscriber)
+
+    def start_status(self, subscriber: Subscriber):
+        send_status = threading.Thread(target=self.send_status, args=(subscriber,))
+        send_status.daemon = True
+        send_status.start()
+
+    def check_session(self, subscriber: Subscriber):
+        """
+        keepalive and idle detection of a single port session, called about every second. there is no
+        connection to lose, a client silent for STATUS_TIMEOUT is dropped with its video
+        :param subscriber: subscriber with a MuxLink, its status is dropped when the link fails
+        :return: None
+        """
+        link = subscriber.status_socket
+        if link is None:
+            return
+        if link.silent() > STATUS_TIMEOUT:
+            print(f"{subscriber}: Client session timed out")
+            subscriber.drop_status()
+        elif time.time() - link.last_sent >= KEEPALIVE_INTERVAL:
+            try:
+                link.sendall(pack_message(KEEPALIVE))
+            except BlockingIOError:
+                # send buffer is full of video, tried again next time
+                pass
+            except OSError as error:
+                print(f"{subscriber}: Client session lost ({error})")
+                subscriber.drop_status()
+
+    def send_status(self, subscriber: Subscriber):
+        # send camera angles, role and clock sync answers as soon as they are due, once the protocol of client is known
+        while subscriber.status_socket:
             try:
-                if self.status_changed:
-                    # camera angle is changed by client
-                    self.status_socket_bytes_flux += 13
-                    message = bytes(
-                        f'{str(round(self.camera_angles[0], 2)).zfill(6)} {str(round(self.camera_angles[1], 2)).zfill(6)}',
-                        encoding='utf-8'
-                    )
-
-                    self.status_socket.settimeout(5)
-                    self.status_socket.sendall(message)
-                    self.status_changed = False
+                subscriber.status_event.wait(1.0)
+                subscriber.status_event.clear()
+                if subscriber.binary_status is None:
+                    continue
+                data = self.status_messages(subscriber)
+                if data:
+                    subscriber.status_socket.sendall(data)
             except ConnectionAbortedError:
-                print("Client status connection lost")
+                print(f"{subscriber}: Client status connection lost")
                 print("Stop sending status")
-                self.status_socket = None
+                subscriber.drop_status()
                 break
             except ConnectionResetError:
-                print("Client status connection lost")
+                print(f"{subscriber}: Client status connection lost")
                 print("Stop sending status")
-                self.status_socket = None
+                subscriber.drop_status()
                 break
-            except AttributeError:
-                self.status_socket = None
+            except (AttributeError, BrokenPipeError, OSError):
+                subscriber.drop_status()
                 break
-            except BrokenPipeError:
-                self.status_socket = None
-                break
-            time.sleep(0.1)
 
-    def receive_status(self):
-        # mark client as ready when receive "ClientReady"
-        while self.status_socket:
+    def notify_status(self, subscriber: Subscriber):
+        # wake up status sender of subscriber
+        subscriber.status_event.set()
+
+    def status_messages(self, subscriber: Subscriber) -> bytes:
+        """
+        take the status due to a client, in its protocol
+        :param subscriber: client whose protocol is known
+        :return: messages to send, may be empty
+        """
+        messages = []
+        if subscriber.link_requested and subscriber.binary_status:
+            # first, client waits for it before greeting on the data link
+            subscriber.link_requested = False
+            messages.append(pack_message(LINK, bytes.fromhex(subscriber.link_token)))
+        if subscriber.status_changed:
+            # camera angle is changed by controller
+            subscriber.status_changed = False
+            messages.append(self.angles_message(subscriber.binary_status))
+        if subscriber.settings_changed:
+            # legacy clients are not told
+            subscriber.settings_changed = False
+            if subscriber.binary_status:
+                messages.append(pack_json(SETTINGS, self.settings_message(subscriber)))
+        while subscriber.sync_replies:
+            messages.append(self.sync_message(*subscriber.sync_replies.pop(0), binary=subscriber.binary_status))
+        data = b"".join(messages)
+        self.status_socket_bytes_flux += len(data)
+        return data
+
+    def angles_message(self, binary=False) -> bytes:
+        if binary:
+            return pack_angles(self.platform_angles)
+        return bytes(
+            f'{str(round(self.platform_angles[0], 2)).zfill(6)} {str(round(self.platform_angles[1], 2)).zfill(6)}',
+            encoding='utf-8'
+        )
+
+    @staticmethod
+    def sync_message(t0: float, t1: float, binary=False) -> bytes:
+        # answer of clock sync request sent at t0 and received at t1, t2 is now
+        if binary:
+            return pack_sync_reply(t0, t1, time.time())
+        return bytes(f"SYNC {json.dumps({'t0': t0, 't1': t1, 't2': time.time()})}\n", encoding="utf-8")
+
+    def reply_sync(self, subscriber: Subscriber, t0: float, t1: float):
+        subscriber.sync_replies.append((t0, t1))
+        self.notify_status(subscriber)
+
+    @staticmethod
+    def split_reports(text: str, kinds=("STATS", "SYNC")):
+        """
+        take client reports "<KIND> {json}\n" (stats reports, clock sync requests) out of status text
+        :param text: status text received, may end with an incomplete report
+        :param kinds: report kinds
+        :return: angle text, [(kind, report)], incomplete tail to be prefixed to the next message
+        """
+        reports = []
+        while True:
+            found = [(text.find(f"{kind} "), kind) for kind in kinds if f"{kind} " in text]
+            if not found:
+                return text, reports, ""
+            start, kind = min(found)
+            end = text.find("\n", start)
+            if end < 0:
+                return text[:start], reports, text[start:]
+            try:
+                reports.append((kind, json.loads(text[start + len(kind) + 1:end])))
+            except ValueError:
+                print(f"Broken {kind} report discarded.")
+            text = text[:start] + text[end + 1:]
+
+    def apply_report(self, subscriber: Subscriber, report: dict):
+        if subscriber.bitrate.update(report, subscriber.data_rate):
+            print(f"{subscriber}: Bitrate controller: {subscriber.bitrate.settings()} <Report: {report}>")
+        if report.get("loss", 0.0) > 0 or report.get("timeouts", 0) > 0:
+            # client may be showing a broken frame while the scene stands still
+            self.refresh()
+
+    def refresh(self):
+        # next captured frame is sent even if the scene has not changed
+        if self.detector is not None:
+            self.detector.force()
+
+    def settings_message(self, subscriber: Subscriber) -> dict:
+        # role and layer of client, layers it can switch to with their sizes
+        return {
+            "controller": subscriber.controller,
+            "layer": subscriber.layer,
+            "layers": {name: [round(self.width * LAYERS[name]), round(self.height * LAYERS[name])] for name in self.layers},
+        }
+
+    def apply_settings(self, subscriber: Subscriber, settings: dict):
+        if "max_fps" in settings or "max_quality" in settings:
+            subscriber.bitrate.limit(settings.get("max_fps"), settings.get("max_quality"))
+            print(f"{subscriber}: Stream limits set to fps {subscriber.bitrate.max_fps} quality {subscriber.bitrate.max_quality}.")
+        if "layer" in settings:
+            if settings["layer"] in self.layers:
+                subscriber.layer = settings["layer"]
+                print(f"{subscriber}: Layer {subscriber.layer}.")
+                # first frame of the new layer is sent even if the scene stands still
+                self.refresh()
+            else:
+                print(f"{subscriber}: Layer {settings['layer']} is not offered.")
+            # client is told the layer it gets
+            subscriber.settings_changed = True
+            self.notify_status(subscriber)
+
+    def set_camera_angles(self, camera_angles):
+        self.camera_angles = camera_angles
+        # motion planner only takes the newest target, servos follow on its thread
+        self.platform(self.camera_angles)
+        if not hasattr(self.platform, "on_move"):
+            self.platform_moved(self.camera_angles)
+        print(f"New camera-angle is set to {self.camera_angles[0]} {self.camera_angles[1]}.")
+
+    def platform_moved(self, angles):
+        # every client is told the angles the platform stands at, called by the motion planner thread
+        self.platform_angles = list(angles)
+        with self.subscribers_lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.status_changed = True
+            self.notify_status(subscriber)
+
+    def move_platform(self, subscriber: Subscriber, camera_angles):
+        # viewers can not move the platform
+        if not subscriber.controller:
+            return
+        if camera_angles[0] != self.camera_angles[0] or camera_angles[1] != self.camera_angles[1]:
+            self.set_camera_angles(camera_angles)
+
+    def handle_status(self, subscriber: Subscriber, message: bytes, tail="") -> str:
+        """
+        apply status bytes received from a client, binary messages or legacy text
+        :param subscriber: sender
+        :param message: bytes received, empty if connection is closed (raises ValueError)
+        :param tail: incomplete text report of the previous message
+        :return: incomplete text report to be prefixed to the next message
+        """
+        if not message:
+            raise ValueError("Status connection is closed.")
+        if subscriber.binary_status is None:
+            subscriber.binary_status = is_binary(message)
+            print(f"{subscriber}: {'Binary' if subscriber.binary_status else 'Text'} status protocol.")
+            # status held back until now
+            self.notify_status(subscriber)
+        if not subscriber.binary_status:
+            return self.handle_text_status(subscriber, message, tail)
+        received = time.time()
+        for kind, payload in subscriber.status_reader.feed(message):
+            self.handle_message(subscriber, kind, payload, received)
+        return tail
+
+    def handle_message(self, subscriber: Subscriber, kind: int, payload: bytes, received: float):
+        """
+        apply one binary status message, every message is applied in order
+        :param subscriber: sender
+        :param kind: message type, see status.py
+        :param payload: message payload
+        :param received: receive time
+        :return: None
+        """
+        try:
+            if kind == ANGLES:
+                self.move_platform(subscriber, unpack_angles(payload))
+            elif kind == STATS:
+                self.apply_report(subscriber, unpack_json(payload))
+            elif kind == SYNC:
+                self.reply_sync(subscriber, SYNC_REQUEST_STRUCT.unpack(payload)[0], received)
+            elif kind == SETTINGS:
+                self.apply_settings(subscriber, unpack_json(payload))
+            elif kind == BYE:
+                # client ends its session, nothing to resume
+                subscriber.token = None
+                subscriber.drop_status()
+            elif kind == LINK:
+                # client pairs its data link by token instead of by address, answered even if already paired
+                subscriber.link_token = subscriber.link_token or secrets.token_hex(8)
+                subscriber.link_requested = True
+                self.notify_status(subscriber)
+            # keepalive and unknown types only show the client is alive
+        except (struct.error, ValueError):
+            print(f"{subscriber}: Broken {NAMES.get(kind, hex(kind))} message discarded.")
+
+    def handle_text_status(self, subscriber: Subscriber, message: bytes, tail="") -> str:
+        """
+        apply one legacy status message: stats reports of any client, camera angles of the controller
+        :param subscriber: sender
+        :param message: bytes received
+        :param tail: incomplete report of the previous message
+        :return: incomplete report to be prefixed to the next message
+        """
+        # print("Message ", message)
+        received = time.time()
+        text, reports, tail = self.split_reports(tail + str(message, encoding='utf-8'))
+        for kind, report in reports:
+            if kind == "STATS":
+                self.apply_report(subscriber, report)
+            elif kind == "SYNC" and "t0" in report:
+                self.reply_sync(subscriber, report["t0"], received)
+        if not text:
+            # only reports in this message
+            return tail
+        self.move_platform(subscriber, [float(degree) for degree in text[-13:].split(" ")])
+        return tail
+
+    def receive_status(self, subscriber: Subscriber):
+        # every message is applied as it arrives, a client silent for STATUS_TIMEOUT is dropped
+        tail = ""
+        while subscriber.status_socket:
             try:
-                message = self.status_socket.recv(1024*16)
-                # print("Message ", message)
-                new_camera_angles = [float(degree) for degree in str(message, encoding='utf-8')[-13:].split(" ")]
-                if new_camera_angles[0] != self.camera_angles[0] or new_camera_angles[1] != self.camera_angles[1]:
-                    self.camera_angles = new_camera_angles
-                    self.status_changed = True
-                    self.platform(self.camera_angles)
-                    print(f"New camera-angle is set to {self.camera_angles[0]} {self.camera_angles[1]}.")
+                message = subscriber.status_socket.recv(1024*16)
+                tail = self.handle_status(subscriber, message, tail)
 
             except ConnectionAbortedError:
-                print("Client status connection lost")
+                print(f"{subscriber}: Client status connection lost")
                 print("Stop receiving status")
-                self.status_socket = None
+                subscriber.drop_status()
                 break
             except ConnectionResetError:
-                print("Client status connection lost")
+                print(f"{subscriber}: Client status connection lost")
                 print("Stop receiving status")
-                self.status_socket = None
+                subscriber.drop_status()
                 break
-            except AttributeError:
-                self.status_socket = None
+            except socket.timeout:
+                print(f"{subscriber}: Client status connection timed out")
+                subscriber.drop_status()
                 break
-            except BrokenPipeError:
-                self.status_socket = None
+            except (AttributeError, BrokenPipeError, OSError):
+                subscriber.drop_status()
                 break
             except ValueError:
-                self.status_socket = None
-                print("ValueError at receive status")
+                subscriber.drop_status()
+                print(f"{subscriber}: ValueError at receive status")
                 break
-            time.sleep(0.01)
 
     def establish_status_connection(self) -> None:
         """
-        start status-server service forever
+        start status-server service forever, every connection gets its own status threads
         :return: None
         """
         while not self.server_should_close:
-            self.status_socket, addr = self.status_server.accept()
+            status_socket, addr = self.status_server.accept()
             # following codes will not be run until a client connects this server
             print(f"Status server connected by {addr}")
-            send_status = threading.Thread(target=self.send_status)
+            subscriber = self.find_subscriber(addr[0], "status_socket")
+            status_socket.settimeout(STATUS_TIMEOUT)
+            subscriber.status_socket = status_socket
+            subscriber.linked.set()
+            self.assign_controller(subscriber)
+            send_status = threading.Thread(target=self.send_status, args=(subscriber,))
             send_status.daemon = True
-            receive_status = threading.Thread(target=self.receive_status)
+            receive_status = threading.Thread(target=self.receive_status, args=(subscriber,))
             receive_status.daemon = True
             send_status.start()
             receive_status.start()
-            # status service is opened
-            while self.status_socket:
-                # status-socket is alive, do nothing
-                time.sleep(1)
-            # status service is closed
-            self.reset(trigger="establish_status_connection")
 
     def establish_data_connection(self) -> None:
         """
         start data-server service forever
+        UDP: greetings register the client, other datagrams are control messages of known clients
+        TCP: every connection sends its greetings first
         :return: None
         """
         while not self.server_should_close:
             if self.server_type == "TCP":
-                self.data_socket, addr = self.data_server.accept()
+                data_socket, addr = self.data_server.accept()
                 # following codes will not be run until a client connects this server
                 print(f"Message <establish_data_connection>: Data server connected by {addr}")
-                # receive greetings and settings
-                message = self.data_socket.recv(1024)
-                self.width, self.height = [int(item) for item in str(message[-9:], encoding="utf-8").split(' ')]
-                print(f"Width, Height set to {self.width} {self.height}")
+                try:
+                    # receive greetings and settings
+                    message = data_socket.recv(1024)
+                    items = parse_hello(message)
+                    subscriber = self.find_subscriber(addr[0], "data_socket", hello_link(items))
+                    subscriber.address = addr
+                    subscriber.data_socket = data_socket
+                    data_socket.sendall(self.greet(subscriber, message))
+                    subscriber.linked.set()
+                except (ValueError, IndexError):
+                    print(f"Broken greetings from {addr} discarded.")
+                    data_socket.close()
+                except OSError as error:
+                    print(f"Data connection of {addr} failed: {error}")
+                    data_socket.close()
             elif self.server_type == "UDP":
-                message, self.address = self.data_server.recvfrom(1024)
-                print("Message <establish_data_connection>: ", message, self.address)
-                self.width, self.height = [int(item) for item in str(message[-9:], encoding="utf-8").split(' ')]
-                print(f"Width, Height set to {self.width} {self.height}")
-                self.data_socket = self.data_server
-                self.data_socket.sendto(b"Hello Client", self.address)
-            # data-socket is ready, start sending data
-            send_data = threading.Thread(target=self.send_data)
-            send_data.daemon = True
-            send_data.start()
-            # data service is opened
-            while self.data_socket:
-                # data-socket is alive, do nothing
-                time.sleep(1)
-            # data service is closed
-            self.reset(trigger="establish_data_connection")
+                # one bad datagram must not end the data service
+                try:
+                    message, address = self.data_server.recvfrom(2048)
+                except OSError as error:
+                    print(f"Data socket error: {error}")
+                    continue
+                try:
+                    self.receive_datagram(message, address)
+                except (ValueError, IndexError):
+                    print(f"Broken greetings from {address} discarded.")
+                except OSError as error:
+                    print(f"Data socket error: {error}")
+
+    def receive_datagram(self, message: bytes, address):
+        """
+        handle one datagram on UDP data port
+        :param message: greetings of a client or a control message of a known client
+        :param address: sender address
+        :return: subscriber of address, None if unknown
+        """
+        if message.startswith(b"Hello Server"):
+            print("Message <establish_data_connection>: ", message, address)
+            # broken greetings raise ValueError before anything is registered
+            items = parse_hello(message)
+            # a single port session has no status link to be paired with
+            subscriber = self.subscriber_at(address) or self.find_subscriber(address[0], None if asks_mux(message) else "data_socket", hello_link(items))
+            subscriber.address = address
+            subscriber.data_socket = self.data_server
+            self.data_server.sendto(self.greet(subscriber, message), address)
+            subscriber.linked.set()
+            if subscriber.mux and subscriber.status_socket is None:
+                # status only after the reply, client reads the reply first
+                self.open_session(subscriber)
+            return subscriber
+        if is_status(message):
+            return self.receive_session_status(message, address)
+        subscriber = self.subscriber_at(address)
+        if subscriber:
+            # retransmission requests
+            subscriber.receive_control(message)
+        return subscriber
+
+    def receive_session_status(self, message: bytes, address):
+        """
+        apply a status datagram of a single port session
+        :param message: datagram, see mux.py
+        :param address: sender address, video follows it
+        :return: subscriber of the session, None if the session is unknown or closed
+        """
+        token, messages = unpack_status(message)
+        with self.subscribers_lock:
+            for subscriber in self.subscribers:
+                if subscriber.mux and subscriber.status_socket and subscriber.token == token:
+                    break
+            else:
+                return None
+        link = subscriber.status_socket
+        if address != subscriber.address:
+            # NAT mapping of client has changed
+            print(f"{subscriber}: Client moved to {address}.")
+            subscriber.address = link.address = address
+        link.last_received = time.time()
+        # a datagram holds whole messages, a lost or broken one must not spoil the next
+        for kind, payload in MessageReader().feed(messages):
+            self.handle_message(subscriber, kind, payload, link.last_received)
+        return subscriber
+
+    def subscriber_at(self, address):
+        with self.subscribers_lock:
+            for subscriber in self.subscribers:
+                if subscriber.address == address and not subscriber.closed:
+                    return subscriber
+        return None
+
+    def greet(self, subscriber: Subscriber, message: bytes) -> bytes:
+        """
+        accept_hello for a subscriber just found or registered, a subscriber its greetings fail for is removed
+        :return: reply to greetings
+        """
+        try:
+            return self.accept_hello(subscriber, message)
+        except Exception:
+            self.remove_subscriber(subscriber)
+            raise
+
+    def accept_hello(self, subscriber: Subscriber, message: bytes) -> bytes:
+        reply = subscriber.accept_hello(message, resume=self.take_session)
+        if subscriber.resumed is None:
+            # capture size is configured, a client only gets the layer fitting its window
+            subscriber.layer = fit_layer(self.layers, self.width, self.height, subscriber.width, subscriber.height)
+        print(f"{subscriber}: Layer {subscriber.layer}.")
+        subscriber.settings_changed = True
+        self.notify_status(subscriber)
+        return reply
+
+    def take_session(self, token: str):
+        """
+        find the session a client comes back to, see Subscriber.accept_hello
+        :param token: session token sent by client
+        :return: Subscriber that held the session, None if it is unknown or expired
+        """
+        old = None
+        with self.subscribers_lock:
+            self.purge_sessions()
+            if token in self.suspended:
+                old = self.suspended.pop(token)[1]
+            else:
+                for other in self.subscribers:
+                    if other.token == token:
+                        # client came back before its old links were found dead
+                        old = other
+                        break
+        if old is not None:
+            # the token moves to the new subscriber, the old one is not kept when it is removed
+            old.token = None
+            old.close()
+        return old
+
+    def purge_sessions(self):
+        # forget sessions not resumed within resume_timeout, called with subscribers_lock held
+        now = time.time()
+        for token, (left, _) in list(self.suspended.items()):
+            if now - left > self.resume_timeout:
+                del self.suspended[token]
+
+    def submit_frames(self):
+        # hand every captured frame to encoder pool with the clients due it
+        while not self.stream_stopped.is_set():
+            # sleep until a frame is captured
+            item = self.buffer.get(timeout=0.5)
+            if item is None:
+                continue
+            timestamp, frame, stages, changed = item
+            groups = self.group_subscribers(timestamp, changed)
+            if groups:
+                self.encoder.submit((timestamp, frame, stages, groups))
+
+    def encode_job(self, job):
+        """
+        encode a frame once per distinct setting, run by encoder pool workers
+        :param job: timestamp, frame, stage durations, {setting or None: [Subscriber]}
+        :return: timestamp, [(jpeg or None, stage durations, [Subscriber])], settings a frame failed to encode
+            with are left out
+        """
+        timestamp, frame, stages, groups = job
+        # downscaled images are shared by the layers and settings of this frame
+        pyramid = FramePyramid(frame)
+        encoded = []
+        for setting, subscribers in groups.items():
+            start = time.time()
+            # setting None: scene has not changed, nothing is encoded
+            jpeg = self.encode_frame(frame, *setting, pyramid=pyramid) if setting is not None else None
+            if setting is not None and jpeg is None:
+                # corrupt camera frame, nothing is sent. None would tell the clients the scene is unchanged
+                for subscriber in subscribers:
+                    if isinstance(subscriber, Subscriber):
+                        subscriber.missed_change = True
+                continue
+            encoded.append((jpeg, dict(stages, encode=time.time() - start), subscribers))
+        return timestamp, encoded
 
     def send_data(self):
-        while self.data_socket:
-            try:
-                if self.buffer:
-                    frame = self.zip_frame(cv2.imencode(".jpg", self.buffer.pop(0))[1])
-                    self.data_socket_bytes_flux += len(frame)
-                    self.count += 1
-                    # TCP
-                    if self.server_type == "TCP":
-                        self.data_socket.sendall(frame)
-                        self.data_socket.sendall(b'done')
-                    # UDP
-                    if self.server_type == "UDP":
-                        for pack in self.slice_data_udp(frame, 1024):
-                            #print(len(pack))
-                            #if len(pack) > 4096:
-                            #    print(pack)
-                            #    self.data_socket = None
-                            self.data_socket.sendto(pack, self.address)
-                else:
-                    ...
-            except ConnectionAbortedError:
-                print("Client data connection lost")
-                print("Stop sending data")
-                self.data_socket = None
-                break
-            except ConnectionResetError:
-                print("Client data connection lost")
-                print("Stop sending data")
-                self.data_socket = None
-                break
-            except BrokenPipeError:
-                self.data_socket = None
-                break
-            except AttributeError:
-                self.data_socket = None
-                break
-            except Exception:
-                with open(r"log.txt", "a") as f:
-                    f.write(f"{time.ctime(time.time())}\n")
-                    traceback.print_exc(file=f)
-                    f.close()
-                print("Error saved to log.txt.")
-                self.data_socket = None
-                break
+        # queue encoded frames to each client in capture order
+        while not self.stream_stopped.is_set():
+            result = self.encoder.get(timeout=0.5)
+            if result is None:
+                continue
+            timestamp, encoded = result
+            for jpeg, stages, subscribers in encoded:
+                for subscriber in subscribers:
+                    if subscriber is self.recorder or subscriber is self.bus:
+                        subscriber.put(timestamp, jpeg, stages)
+                        continue
+                    if jpeg is None and subscriber.queue:
+                        # a frame is still waiting, a keepalive must not push it out
+                        continue
+                    # a slow client drops its own oldest frame
+                    subscriber.queue.put((timestamp, jpeg, stages))
+            self.count += 1
 
-    @staticmethod
-    def slice_data_udp(data: bytes, pack_size=4096):
+    def group_subscribers(self, timestamp: float, changed=True):
         """
-        divide data to packs
-        :param data: bytes
-        :param pack_size: slice-size
-        :return: packs sliced
+        clients due a frame captured at timestamp, grouped by encode setting, the recorder gets every frame,
+        the frame bus while a local process reads its jpeg ring. an unchanged frame is a keepalive (setting None)
+        to every client but those that missed the last changed frame, they get it encoded when due.
+        :param timestamp: capture time
+        :param changed: False if the scene has not changed since the last changed frame
+        :return: {(quality, scale, reencode) or None: [Subscriber, Recorder or FrameBus]}
         """
-        data_pack_size = pack_size - 9
-        pack_length = len(data) // data_pack_size + bool(len(data) % data_pack_size)
-        salt = np.random.randint(0, 999)
-        packs = (data[step * data_pack_size: (step + 1) * data_pack_size] + bytes(
-            f'{salt}'.zfill(3) + f'{pack_length - 1}'.zfill(3) + f'{step}'.zfill(3), encoding='utf-8') for step in
-                 range(pack_length))
-        return packs
+        groups = {}
+        for subscriber in self.ready_subscribers():
+            if not changed and not subscriber.missed_change:
+                # keepalives do not count against the frame rate of the client
+                groups.setdefault(None, []).append(subscriber)
+                continue
+            bitrate = subscriber.bitrate
+            if bitrate.should_send(timestamp):
+                subscriber.missed_change = False
+                # layer size cut further by the bitrate controller
+                scale = LAYERS[subscriber.layer] * bitrate.scale
+                groups.setdefault((bitrate.quality, scale, scale != 1.0 or not bitrate.full), []).append(subscriber)
+            elif changed:
+                # detector reference moved on without this client
+                subscriber.missed_change = True
+        if self.recorder is not None:
+            groups.setdefault(self.recorder.setting if changed else None, []).append(self.recorder)
+        if self.bus is not None and self.bus.wants_jpeg():
+            groups.setdefault(self.bus.setting if changed else None, []).append(self.bus)
+        return groups
 
     @staticmethod
     def zip_frame(buffer):
@@ -311,49 +955,94 @@ class CameraServer:
         start stream service forever
         :return: None
         """
+        stream = None
         while not self.server_should_close:
-            # start stream service if connection is established else wait
-            if self.status_socket and self.data_socket:
-                stream = threading.Thread(target=self.stream)
-                stream.daemon = True
-                stream.start()
+            # start stream service if a client is connected else wait
+            if self.streaming():
+                self.stream_stopped.clear()
+                submit_frames = threading.Thread(target=self.submit_frames)
+                submit_frames.daemon = True
+                submit_frames.start()
+                send_data = threading.Thread(target=self.send_data)
+                send_data.daemon = True
+                send_data.start()
                 # stream is opened
-                while self.status_socket and self.data_socket:
-                    # connection is alive, do nothing
-                    time.sleep(1)
+                while self.streaming() and submit_frames.is_alive() and send_data.is_alive():
+                    # capture thread outlives sessions while the camera is idle, started again once it closed
+                    if stream is None or not stream.is_alive():
+                        stream = threading.Thread(target=self.stream)
+                        stream.daemon = True
+                        stream.start()
+                    # connection is alive, do nothing. a short look, a client may leave and the next join at once
+                    time.sleep(0.1)
                 # stream is stopped
+                self.stream_stopped.set()
+                submit_frames.join()
+                send_data.join()
                 self.reset(trigger="establish_stream_service")
             else:
-                # wait
-                time.sleep(1)
+                # wait, a joining client wakes up at once
+                self.stream_wakeup.wait(1)
+                self.stream_wakeup.clear()
 
     def stream(self):
-        # initialize camera device if data-link has been established
-        while self.status_socket and self.data_socket:
+        # capture while a client is connected, then keep the camera open at idle_fps for idle_timeout seconds
+        idle_since = None
+        while not self.server_should_close:
+            if not self.streaming():
+                if not self.camera:
+                    break
+                if idle_since is None:
+                    idle_since = time.time()
+                    print(f"Camera is idle, kept open for {self.idle_timeout} s.")
+                if time.time() - idle_since >= self.idle_timeout:
+                    break
+                self.idle_read()
+                self.camera_wakeup.wait(1 / self.idle_fps)
+                self.camera_wakeup.clear()
+                continue
+            if idle_since is not None:
+                idle_since = None
+                print("Camera resumed.")
+                self.flush_camera()
             # check if camera is armed
             if not self.camera:
-                # camera is not armed, try arming
+                # camera is not armed, try arming. a profiled mode is known to deliver at once
                 self.init_camera()
-                time.sleep(1)
+                if self.mode is None:
+                    time.sleep(1)
             else:
                 # camera is ready, capture buffer
-                try:
-                    assert self.camera.isOpened() is True
-                    self.buffer.append(self.camera.read()[1])
-                    # discard redundant buffer
-                    if len(self.buffer) >= 2:
-                        self.buffer = self.buffer[-2:]
-                except AssertionError:
+                ret, item = self.read_frame() if self.camera.isOpened() else (False, None)
+                if ret:
+                    # oldest frame is discarded if sender falls behind
+                    self.buffer.put(item)
+                else:
+                    # a failed read is not an unchanged scene, nothing is sent for it
                     print("Camera Error! Restarting...", file=sys.stderr)
                     self.close_camera()
                     time.sleep(1)
                     self.init_camera()
                     time.sleep(1)
 
-        # connection is closed, close camera
-        if self.camera:
-            self.close_camera()
-            self.data_socket = None
+        # camera has been idle for too long or server closes
+        self.stop_camera()
+
+    def read_frame(self):
+        """
+        capture one frame, tell if it shows something new since the last changed one
+        :return: ret, (timestamp, frame, stage durations, changed). nothing is to be sent if ret is False
+        """
+        start = time.time()
+        ret, frame = self.camera.retrieve() if self.grabbed else self.camera.read()
+        self.grabbed = False
+        timestamp = time.time()
+        if ret and self.bus is not None:
+            # queued by reference, camera returns a new array every read
+            self.bus.put_frame(timestamp, frame)
+        # an unchanged frame is kept, a client that missed the last change is sent it
+        changed = ret and (self.detector is None or self.detector.changed(frame, timestamp))
+        return ret, (timestamp, frame, {"capture": timestamp - start}, changed)
 
     def capture(self):
         ret, frame = self.camera.read()
@@ -384,12 +1073,16 @@ class CameraServer:
             s = time.time()
             count = 0
             while preview:
-                if self.buffer and self.camera:
-                    cv2.imshow('Camera0', self.buffer[-1])
+                item = self.buffer.peek()
+                if item is not None and item[1] is not None and self.camera:
+                    frame = item[1]
+                    if frame.ndim != 3:
+                        frame = cv2.imdecode(frame.reshape(-1), 1)
+                    cv2.imshow('Camera0', frame)
                 if cv2.waitKey(1) & 0xFF == ord('q'):
                     print("Camera stopped by keyboard control.")
                     break
-                if self.status_socket and self.data_socket:
+                if self.ready_subscribers():
                     preview = True
                 else:
                     preview = False
@@ -398,23 +1091,41 @@ class CameraServer:
 
     def measure_network_flux(self):
         while not self.server_should_close:
-            # start measurement if connection is established else wait
-            if self.status_socket and self.data_socket:
-                start = time.time()
-                self.data_socket_bytes_flux = 0
-                self.status_socket_bytes_flux = 0
+            # start measurement if a client is connected else wait
+            subscribers = self.ready_subscribers()
+            if subscribers:
+                start = self.start_measurement(subscribers)
                 while time.time() - start < 1.0:
                     time.sleep(0.01)
-                print(
-                    f"NetworkFlux: {round((self.data_socket_bytes_flux + self.status_socket_bytes_flux) / (time.time() - start) / 1024, 3)} kb/s DataFlux: {round(self.data_socket_bytes_flux / (time.time() - start) / 1024, 3)} kb/s  StatusFlux: {round(self.status_socket_bytes_flux / (time.time() - start) / 1024, 3)} kb/s RemainingBuffer: {len(self.buffer)}"
-                )
+                self.report_network_flux(subscribers, start)
                 time.sleep(1.0)
             else:
-                # wait
+                # wait, sessions left behind are forgotten meanwhile
+                with self.subscribers_lock:
+                    self.purge_sessions()
                 time.sleep(1)
 
+    def start_measurement(self, subscribers) -> float:
+        for subscriber in subscribers:
+            subscriber.bytes_flux = 0
+        self.status_socket_bytes_flux = 0
+        return time.time()
+
+    def report_network_flux(self, subscribers, start: float):
+        self.data_socket_bytes_flux = 0
+        for subscriber in subscribers:
+            subscriber.data_rate = subscriber.bytes_flux / (time.time() - start)
+            self.data_socket_bytes_flux += subscriber.bytes_flux
+        self.data_rate = self.data_socket_bytes_flux / (time.time() - start)
+        print(
+            f"NetworkFlux: {round((self.data_socket_bytes_flux + self.status_socket_bytes_flux) / (time.time() - start) / 1024, 3)} kb/s DataFlux: {round(self.data_socket_bytes_flux / (time.time() - start) / 1024, 3)} kb/s  StatusFlux: {round(self.status_socket_bytes_flux / (time.time() - start) / 1024, 3)} kb/s RemainingBuffer: {len(self.buffer)} DroppedFrames: {self.buffer.dropped} Subscribers: {len(subscribers)}"
+        )
+        for subscriber in subscribers:
+            print(f"    {subscriber}: {round(subscriber.data_rate / 1024, 3)} kb/s {subscriber.queue.stats()} Retransmitted: {subscriber.packetizer.retransmitted if subscriber.packetizer else 0}")
+
     def __call__(self, *args, **kwargs):
         # Todo: status and data server should be opened or closed at same time to avoid error!!
+        # (single port sessions, see mux.py, have one link only)
         # open 2 ports, wait connection, keep connection, send data
         establish_status_connection = threading.Thread(target=self.establish_status_connection)
         establish_status_connection.daemon = True
@@ -439,6 +1150,8 @@ class CameraServer:
         # server loop
         while not self.server_should_close:
             time.sleep(1)
+        if self.bus is not None:
+            self.bus.close()
 
 
 class Server:
@@ -0,0 +1,102 @@
+import json
+import struct
+
+
+#  binary status protocol, both directions of the status connection
+#
+#  message: type u8, payload length u16, payload. types are 0x80 and above so that the first byte tells a
+#  binary client apart from a legacy one, whose text ("0000.0 0000.0", "STATS {json}\n") starts with ascii.
+#  ANGLES     !ff camera angles x, y in degrees, client: new target, server: angles the platform stands at
+#  STATS      json report for the bitrate controller, client only
+#  KEEPALIVE  empty, client sends it when nothing else was sent for a while
+#  SYNC       client: !d t0, server: !ddd t0 t1 t2, see latency.ClockSync
+#  SETTINGS   json, client: stream limits {"max_fps", "max_quality"} and simulcast layer {"layer": name},
+#             server: {"controller": bool, "layer": name, "layers": {name: [width, height]}}
+#  BYE        empty, client leaves
+#  LINK       client: empty, sent first, asks how its data greeting is paired with this connection,
+#             server: u8[8] token, the data greeting carries it as "link:<token>"
+#  unknown types are skipped.
+
+ANGLES = 0x81
+STATS = 0x82
+KEEPALIVE = 0x83
+SYNC = 0x84
+SETTINGS = 0x85
+BYE = 0x86
+LINK = 0x87
+NAMES = {ANGLES: "ANGLES", STATS: "STATS", KEEPALIVE: "KEEPALIVE", SYNC: "SYNC", SETTINGS: "SETTINGS", BYE: "BYE", LINK: "LINK"}
+HEADER_STRUCT = struct.Struct("!BH")
+ANGLES_STRUCT = struct.Struct("!ff")
+SYNC_REQUEST_STRUCT = struct.Struct("!d")
+SYNC_REPLY_STRUCT = struct.Struct("!ddd")
+MAX_PAYLOAD = 0xFFFF
+# client heartbeat interval, server drops a status connection silent for STATUS_TIMEOUT seconds
+KEEPALIVE_INTERVAL = 1.0
+STATUS_TIMEOUT = 5.0
+
+
+def is_binary(data: bytes) -> bool:
+    """
+    :param data: first bytes received on a status connection
+    :return: True if sent by a binary protocol client
+    """
+    return bool(data) and data[0] >= 0x80
+
+
+def pack_message(kind: int, payload: bytes = b"") -> bytes:
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"Status payload of {len(payload)} bytes is too long.")
+    return HEADER_STRUCT.pack(kind, len(payload)) + payload
+
+
+def pack_angles(angles) -> bytes:
+    return pack_message(ANGLES, ANGLES_STRUCT.pack(*angles))
+
+
+def pack_json(kind: int, content: dict) -> bytes:
+    return pack_message(kind, json.dumps(content).encode("utf-8"))
+
+
+def pack_sync_request(t0: float) -> bytes:
+    return pack_message(SYNC, SYNC_REQUEST_STRUCT.pack(t0))
+
+
+def pack_sync_reply(t0: float, t1: float, t2: float) -> bytes:
+    return pack_message(SYNC, SYNC_REPLY_STRUCT.pack(t0, t1, t2))
+
+
+def unpack_angles(payload: bytes):
+    return [round(angle, 2) for angle in ANGLES_STRUCT.unpack(payload)]
+
+
+def unpack_json(payload: bytes) -> dict:
+    content = json.loads(payload.decode("utf-8"))
+    if not isinstance(content, dict):
+        raise ValueError("Status payload is not an object.")
+    return content
+
+
+class MessageReader:
+    """
+    splits the received byte stream to messages, a message cut by recv is completed by the next chunk
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data: bytes):
+        """
+        :param data: bytes received
+        :return: [(type, payload)] of the messages completed by data
+        """
+        self.buffer += data
+        messages = []
+        start = 0
+        while len(self.buffer) - start >= HEADER_STRUCT.size:
+            kind, length = HEADER_STRUCT.unpack_from(self.buffer, start)
+            end = start + HEADER_STRUCT.size + length
+            if end > len(self.buffer):
+                break
+            messages.append((kind, bytes(self.buffer[start + HEADER_STRUCT.size:end])))
+            start = end
+        del self.buffer[:start]
+        return messages
@@ -0,0 +1,287 @@
+import secrets
+import threading
+import time
+import traceback
+
+import numpy as np
+
+from bitrate import BitrateController
+from codec import LEGACY_CODEC, get_codec
+from fec import NO_FEC, fec_spec, parse_fec
+from frame_queue import FrameQueue
+from latency import TIMING_OFF, pack_stages, parse_timing, timing_spec
+from layers import DEFAULT_LAYERS
+from mux import MUX
+from nack import FrameCache, parse_nack
+from packet import LEGACY_FORMAT, PacketSender, format_spec, parse_format
+from status import MessageReader
+
+# seconds a client has to open its second link, a subscriber with one link only is dropped then
+LINK_TIMEOUT = 10.0
+MAX_SIZE = 16384
+
+
+def parse_hello(message: bytes) -> list:
+    """
+    split client greetings, checked before a subscriber is registered for them
+    :param message: greetings received on data socket
+    :return: items of "Hello Server WWWW HHHH ..."
+    :raise ValueError: message is not client greetings or has no valid size
+    """
+    items = str(message, encoding="utf-8").split(" ")
+    if items[:2] != ["Hello", "Server"] or len(items) < 4:
+        raise ValueError("Not client greetings.")
+    width, height = int(items[2]), int(items[3])
+    if not (0 < width <= MAX_SIZE and 0 < height <= MAX_SIZE):
+        raise ValueError(f"Invalid size {width}x{height}.")
+    return items
+
+
+def hello_link(items: list):
+    """
+    :param items: client greetings split by parse_hello
+    :return: token of the status link the data link belongs to, None if the client pairs by address
+    """
+    for item in items[9:]:
+        if item.startswith("link:"):
+            return item[len("link:"):]
+    return None
+
+
+class Subscriber:
+    """
+    one client of CameraServer: its status connection, its data link and the settings negotiated on it.
+    encoded frames are put to its own send queue and sent by its own thread, a slow client only drops
+    its own frames.
+    """
+    def __init__(self, subscriber_id: int, host: str, server_type="UDP", max_fps=60):
+        self.id = subscriber_id
+        self.host = host
+        self.created = time.time()
+        # told to client in data handshake, a client coming back with it continues this session
+        self.token = secrets.token_hex(8)
+        # subscriber of the session continued by this one
+        self.resumed = None
+        self.server_type = server_type
+        # status connection (TCP), binary or legacy text protocol as told by the first bytes client sends
+        self.status_socket = None
+        self.binary_status = None
+        self.status_reader = MessageReader()
+        # status waiting to be sent, status_event wakes up the sender
+        self.status_changed = True
+        self.settings_changed = False
+        # clock sync requests (t0, t1) waiting for an answer
+        self.sync_replies = []
+        self.status_event = threading.Event()
+        # data connection, TCP socket or the shared UDP server socket
+        self.data_socket = None
+        self.address = None
+        # only the controller drives the cloud platform
+        self.controller = False
+        # token pairing the data link with this status link, told to a client asking with LINK. clients that do
+        # not ask are paired by address: their status link takes the next data link from the same ip
+        self.link_token = None
+        self.link_requested = False
+        # set once status or data link is lost, subscriber is removed then
+        self.closed = False
+        # set when a link is attached or subscriber is closed, wakes up the wait for both links
+        self.linked = threading.Event()
+        # settings negotiated in data handshake
+        self.width = 0
+        self.height = 0
+        # simulcast layer sent to this client, chosen by server from width and height, switched by client
+        self.layer = DEFAULT_LAYERS[0]
+        self.codec = get_codec(LEGACY_CODEC)
+        self.packet_version, self.pack_size = parse_format(LEGACY_FORMAT)
+        self.fec_group = 0
+        # send stage durations after every frame (binary packets only)
+        self.timing = False
+        self.packetizer = None
+        # status messages go through the data port, no TCP status connection (see mux.py)
+        self.mux = False
+        # recently sent frames, lost chunks are resent from here when client asks (binary packets only)
+        self.chunk_cache = FrameCache(max_frames=16, ttl=0.1)
+        # jpeg quality, scale and frame rate driven by client reports
+        self.bitrate = BitrateController(max_fps=max_fps)
+        # client has not got the last changed frame, the next one it is due is sent even if unchanged
+        self.missed_change = True
+        # encoded frames waiting for this client
+        self.queue = FrameQueue(maxsize=2, policy="drop_oldest", name=f"SendQueue{subscriber_id}")
+        # measurement
+        self.bytes_flux = 0
+        self.data_rate = 0.0
+        self.count = 0
+
+    def __repr__(self):
+        return f"<Subscriber {self.id} {self.address or self.host}{' controller' if self.controller else ''}>"
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.status_socket and self.data_socket) and not self.closed
+
+    def drop_status(self):
+        self.status_socket = None
+        self.closed = True
+        self.status_event.set()
+        self.linked.set()
+
+    def drop_data(self):
+        self.data_socket = None
+        self.closed = True
+        self.queue.close()
+        self.linked.set()
+
+    def close(self):
+        self.closed = True
+        self.queue.close()
+        self.linked.set()
+        if self.status_socket:
+            try:
+                self.status_socket.close()
+            except OSError:
+                pass
+        if self.data_socket and self.server_type == "TCP":
+            try:
+                self.data_socket.close()
+            except OSError:
+                pass
+
+    def accept_hello(self, message: bytes, resume=None) -> bytes:
+        """
+        apply client greetings "Hello Server WWWW HHHH [codec] [packet format] [fec] [timing] [session] [mux]",
+        settings the client does not ask or the server does not support fall back to legacy ones
+        :param message: greetings received on data socket
+        :param resume: callable taking a session token, returns the subscriber that held it or None
+        :return: reply "Hello Client <codec> <packet format> <fec> <timing> session:<token> [mux]"
+        """
+        items = parse_hello(message)
+        self.width, self.height = int(items[2]), int(items[3])
+        try:
+            self.codec = get_codec(items[4]) if len(items) > 4 else get_codec(LEGACY_CODEC)
+        except ValueError:
+            print(f"Codec {items[4]} is not supported, using {LEGACY_CODEC}.")
+            self.codec = get_codec(LEGACY_CODEC)
+        try:
+            self.packet_version, self.pack_size = parse_format(items[5] if len(items) > 5 else LEGACY_FORMAT)
+        except ValueError:
+            print(f"Packet format {items[5]} is not supported, using {LEGACY_FORMAT}.")
+            self.packet_version, self.pack_size = parse_format(LEGACY_FORMAT)
+        try:
+            # parity packets need the binary format
+            self.fec_group = parse_fec(items[6]) if len(items) > 6 and self.packet_version else 0
+        except ValueError:
+            print(f"FEC {items[6]} is not supported, using {NO_FEC}.")
+            self.fec_group = 0
+        try:
+            self.timing = parse_timing(items[7]) if len(items) > 7 and self.packet_version else False
+        except ValueError:
+            print(f"Timing {items[7]} is not supported, using {TIMING_OFF}.")
+            self.timing = False
+        token = items[8][len("session:"):] if len(items) > 8 and items[8].startswith("session:") else ""
+        # greetings sent again because the reply was lost keep the session they have
+        old = resume(token) if resume and token and token not in ("-", self.token) else None
+        if old is not None:
+            self.resume(old, token)
+        # single port sessions need binary packets to tell status datagrams apart
+        self.mux = len(items) > 9 and items[9] == MUX and self.server_type == "UDP" and bool(self.packet_version)
+        self.chunk_cache.clear()
+        previous = old.packetizer if old is not None else self.packetizer
+        self.packetizer = PacketSender(self.data_socket, self.pack_size, fec_group=self.fec_group, cache=self.chunk_cache) if self.packet_version and self.server_type == "UDP" else None
+        if previous and self.packetizer:
+            # frame sequence goes on, client keeps its reassembler
+            self.packetizer.sequence = previous.sequence
+        packet_format = format_spec(self.packet_version, self.pack_size)
+        print(f"{self}: Width, Height set to {self.width} {self.height} Codec: {self.codec.spec} Packet: {packet_format} FEC: {fec_spec(self.fec_group)} Timing: {timing_spec(self.timing)}")
+        return bytes(f"Hello Client {self.codec.spec} {packet_format} {fec_spec(self.fec_group)} {timing_spec(self.timing)} session:{self.token}{' ' + MUX if self.mux else ''}", encoding="utf-8")
+
+    def resume(self, old, token: str):
+        # continue the session of an earlier connection: same token, learned bitrate settings and layer
+        self.token = token
+        self.bitrate = old.bitrate
+        self.layer = old.layer
+        self.resumed = old
+        print(f"{self}: Session of {old} resumed.")
+
+    def receive_control(self, message: bytes):
+        """
+        handle one control datagram of client (nack)
+        :param message: datagram
+        :return: None
+        """
+        nack = parse_nack(message)
+        if nack and self.packetizer:
+            sequence, indices = nack
+            self.bytes_flux += self.packetizer.resend(sequence, indices, self.address)
+
+    def send_data(self):
+        while self.data_socket and not self.closed:
+            try:
+                # sleep until a frame is encoded for this client
+                item = self.queue.get(timeout=0.5)
+                if item is None:
+                    continue
+                self.send_frame(*item)
+            except (ConnectionAbortedError, ConnectionResetError):
+                print(f"{self}: Client data connection lost")
+                print("Stop sending data")
+                self.drop_data()
+                break
+            except (BrokenPipeError, AttributeError):
+                self.drop_data()
+                break
+            except Exception:
+                with open(r"log.txt", "a") as f:
+                    f.write(f"{time.ctime(time.time())}\n")
+                    traceback.print_exc(file=f)
+                    f.close()
+                print("Error saved to log.txt.")
+                self.drop_data()
+                break
+
+    def send_frame(self, timestamp: float, frame, stages=None):
+        """
+        compress and send one encoded frame
+        :param timestamp: capture time
+        :param frame: jpeg buffer, None if the scene has not changed since the last frame
+        :param stages: stage durations of frame so far (capture, encode)
+        :return: None
+        """
+        if frame is None:
+            # binary packets carry a keepalive, other formats get nothing until the scene changes
+            if self.server_type == "UDP" and self.packetizer:
+                self.bytes_flux += self.packetizer.send_unchanged(self.address, timestamp)
+            return
+        start = time.time()
+        frame = self.codec.compress(frame)
+        send_start = time.time()
+        self.bytes_flux += len(frame)
+        self.count += 1
+        # TCP
+        if self.server_type == "TCP":
+            self.data_socket.sendall(frame)
+            self.data_socket.sendall(b'done')
+        # UDP
+        if self.server_type == "UDP" and self.packetizer:
+            self.packetizer.send(frame, self.address, timestamp)
+            if self.timing:
+                stages = dict(stages or {}, compress=send_start - start, send_start=send_start - timestamp, send=time.time() - send_start)
+                self.packetizer.send_timing(pack_stages(stages), self.address, timestamp)
+        elif self.server_type == "UDP":
+            for pack in self.slice_data_udp(frame, self.pack_size):
+                self.data_socket.sendto(pack, self.address)
+
+    @staticmethod
+    def slice_data_udp(data: bytes, pack_size=4096):
+        """
+        divide data to packs
+        :param data: bytes
+        :param pack_size: slice-size
+        :return: packs sliced
+        """
+        data_pack_size = pack_size - 9
+        pack_length = len(data) // data_pack_size + bool(len(data) % data_pack_size)
+        salt = np.random.randint(0, 999)
+        packs = (bytes(data[step * data_pack_size: (step + 1) * data_pack_size]) + bytes(
+            f'{salt}'.zfill(3) + f'{pack_length - 1}'.zfill(3) + f'{step}'.zfill(3), encoding='utf-8') for step in
+                 range(pack_length))
+        return packs